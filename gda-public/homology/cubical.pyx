@@ -0,0 +1,449 @@
+# cython: boundscheck=True, linetrace=True
+# distutils: define_macros=CYTHON_TRACE_NOGIL=1
+
+r"""
+This Cython module contains persistence for the sublevel-set filtration of an
+image (a 2d array) or a volume (a 3d array), as a cubical complex.  Each pixel
+is a vertex with the pixel value as height, each pair of pixels that differ by
+1 along one axis is an edge, and so on, and each cell gets the greatest height
+of its pixels.  (This is sometimes called the V-construction.)
+
+Nothing but the pixels is ever stored:  the edges are the implicit 4 (or 6)
+neighbors of each pixel, which a union-find visits in order of height.  So,
+memory is proportional to the number of pixels.
+
+ - :func:`pers0` gives 0-dimensional persistence (components).  It can also
+   work on slabs of a :class:`numpy.memmap` that is too big for memory.
+ - :func:`pers1` gives 1-dimensional persistence (holes) of an image, and
+   :func:`pers2` gives 2-dimensional persistence (voids) of a volume.  By
+   Alexander duality, these are the 0-dimensional persistence of the
+   superlevel-set filtration of the complement, where pixels are joined to all
+   8 (or 26) of their neighbors, and the outside of the grid is one oldest
+   component [CUBICAL]_.
+
+This module is compiled by either of these commands
+ - :code:`python setup.py install`  (as called by :code:`pip` for standard installation and use)
+ - :code:`python setup.py build_ext --inplace` (as run by developers for code testing)
+
+References
+----------
+.. [CUBICAL] A. Garin, T. Heiss, K. Maggs, B. Bleile and V. Robins, Duality in
+   persistent homology of images, SoCG (2020)
+
+Copyright
+---------
+- This file is part of https://github.com/geomdata/gda-public/
+- 2015, 2016, 2017 by Geometric Data Analytics, Inc. (http://geomdata.com)
+- AGPL license. See `LICENSE` or https://github.com/geomdata/gda-public/blob/master/LICENSE
+"""
+
+"""
+The following stanza is for docstring discovery in Cython.
+>>> import numpy as np
+>>> from homology.cubical import *
+>>> print("test")
+test
+
+"""
+
+# boilerplate for efficient NumPy indexing
+import numpy as np
+cimport numpy as np
+cimport cython
+ctypedef np.int64_t NINT_t
+ctypedef np.float64_t NDBL_t
+
+import itertools
+
+
+cdef inline NINT_t find(NINT_t[:] parent, NINT_t i):
+    r""" Find the root of the component containing pixel i, halving the path
+    along the way. """
+    while parent[i] != i:
+        parent[i] = parent[parent[i]]
+        i = parent[i]
+    return i
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cpdef sweep(NDBL_t[:] heights, NINT_t[:] order, NINT_t[:] offsets,
+            NINT_t[:] parent, NINT_t[:] rank, np.uint8_t[:] anchored):
+    r""" Add the pixels of a padded, flattened grid in the given order, and
+    join each one to its active neighbors.  When two components meet, the one
+    that was started later in the order dies, by the elder rule.
+
+    A component is *anchored* once it contains a pixel marked in `anchored`,
+    such as a pixel on the edge of a tile.  The elder rule can only be decided
+    here when the younger component is not anchored;  otherwise the meeting is
+    kept as an edge, to be decided later with the neighboring tiles.
+
+    Parameters
+    ----------
+    heights : :class:`numpy.ndarray`
+        Heights of the padded grid, flattened.
+    order : :class:`numpy.ndarray`
+        Padded indices of the pixels to add, in order.
+    offsets : :class:`numpy.ndarray`
+        Index offsets of the neighbors of a pixel in the padded grid.
+    parent : :class:`numpy.ndarray`
+        Union-find table, which is -1 for inactive pixels.  The pad must never
+        be reached through an inactive neighbor, so it is either all inactive
+        or already joined into active components.
+    rank : :class:`numpy.ndarray`
+        Position in order at which each active component started.
+    anchored : :class:`numpy.ndarray`
+        Nonzero for anchored pixels.  It is updated in place for roots.
+
+    Returns
+    -------
+    younger, where : :class:`numpy.ndarray`
+        For each death with positive persistence, the pixel that started the
+        dying component, and the pixel at which it died.
+    edges : :class:`numpy.ndarray`
+        Rows (older, younger, where) for meetings of anchored components.
+    """
+    cdef NINT_t n = order.shape[0]
+    cdef NINT_t m = offsets.shape[0]
+    cdef NINT_t i, k, p, q, rp, rq
+    younger = []
+    where = []
+    edges = []
+
+    for i in range(n):
+        p = order[i]
+        parent[p] = p
+        rank[p] = i
+        for k in range(m):
+            q = p + offsets[k]
+            if parent[q] < 0:
+                continue
+            rp = find(parent, p)
+            rq = find(parent, q)
+            if rp == rq:
+                continue
+            if rank[rq] < rank[rp]:
+                rp, rq = rq, rp
+            # now rp is older, and rq dies here
+            parent[rq] = rp
+            if anchored[rq]:
+                anchored[rp] = 1
+                edges.append((rp, rq, p))
+            elif heights[rq] != heights[p]:
+                younger.append(rq)
+                where.append(p)
+
+    return np.array(younger, dtype=np.int64), np.array(where, dtype=np.int64),\
+        np.array(edges, dtype=np.int64).reshape(-1, 3)
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cpdef merge(NDBL_t[:] heights, NINT_t[:] rank, NINT_t[:] left, NINT_t[:] right):
+    r""" Union-find over an explicit list of edges, already in order, by the
+    elder rule.  This joins the anchored components of all tiles.
+
+    Parameters
+    ----------
+    heights : :class:`numpy.ndarray`
+        Height of each vertex.
+    rank : :class:`numpy.ndarray`
+        Position of each vertex in the global order.
+    left, right : :class:`numpy.ndarray`
+        Vertices of each edge.
+
+    Returns
+    -------
+    younger, where : :class:`numpy.ndarray`
+        For each edge that joins two components, the vertex that started the
+        dying component, and the position of the edge.
+    """
+    cdef NINT_t n = left.shape[0]
+    cdef NINT_t i, rp, rq
+    cdef NINT_t[:] parent = np.arange(heights.shape[0], dtype=np.int64)
+    younger = []
+    where = []
+
+    for i in range(n):
+        rp = find(parent, left[i])
+        rq = find(parent, right[i])
+        if rp == rq:
+            continue
+        if rank[rq] < rank[rp]:
+            rp, rq = rq, rp
+        parent[rq] = rp
+        younger.append(rq)
+        where.append(i)
+
+    return np.array(younger, dtype=np.int64), np.array(where, dtype=np.int64)
+
+
+def _padded(img_array, pad_value):
+    r""" Pad the array by one pixel on each side, and return the flattened
+    heights, the padded index of each pixel, and the padded strides. """
+    img = np.asarray(img_array, dtype=np.float64)
+    assert img.ndim in (2, 3),\
+        "Cubical persistence is for images (2d arrays) or volumes (3d arrays) only."
+    padded = np.ascontiguousarray(np.pad(img, 1, mode='constant', constant_values=pad_value))
+    strides = np.array(padded.strides, dtype=np.int64)//padded.itemsize
+    inside = np.zeros(shape=(img.size,), dtype=np.int64)
+    for axis, coord in enumerate(np.unravel_index(np.arange(img.size), img.shape)):
+        inside += (coord + 1)*strides[axis]
+    return img, padded.ravel(), inside, strides
+
+
+def _offsets(strides, full):
+    r""" Index offsets of the 2*d axis neighbors, or of all 3**d - 1
+    neighbors if full. """
+    d = strides.shape[0]
+    if full:
+        steps = [np.array(s) for s in itertools.product([-1, 0, 1], repeat=d) if any(s)]
+    else:
+        steps = list(np.eye(d, dtype=np.int64)) + list(-np.eye(d, dtype=np.int64))
+    return np.array([np.dot(s, strides) for s in steps], dtype=np.int64)
+
+
+def _unpad(padded_index, shape):
+    r""" The flat index in the original array of pixels of the padded one. """
+    coords = np.unravel_index(padded_index, tuple(s + 2 for s in shape))
+    return np.ravel_multi_index(tuple(c - 1 for c in coords), shape)
+
+
+def _slab(source, start, stop):
+    r""" The rows [start, stop) of an array, where source is either an array
+    holding just those rows, or the arguments to reopen a
+    :class:`numpy.memmap` of the whole. """
+    if isinstance(source, tuple):
+        filename, dtype, offset, shape = source
+        whole = np.memmap(filename, dtype=dtype, mode='r', offset=offset, shape=shape)
+        return whole[start:stop]
+    return source
+
+
+def _tile(job):
+    r""" 0-dimensional persistence of one slab of rows of an image or volume.
+    The first and last rows are anchored, except at the edges of the whole.
+
+    Parameters
+    ----------
+    job : tuple
+        (source, start, stop, total), as in :func:`_slab`, where total is the
+        number of rows of the whole array.
+
+    Returns
+    -------
+    bars : :class:`numpy.ndarray`
+        Rows (younger, where) of global flat indices of deaths.
+    edges : :class:`numpy.ndarray`
+        Rows (older, younger, where) of global flat indices, for meetings of
+        anchored components.
+    extremes : tuple
+        (min, argmin, max, argmax), with global flat indices.
+    heights : tuple
+        The heights at bars and edges.
+    """
+    source, start, stop, total = job
+    part, heights, inside, strides = _padded(_slab(source, start, stop), np.inf)
+    flat = part.ravel()
+    order = inside[np.argsort(flat, kind='stable')]
+    parent = -np.ones(shape=heights.shape, dtype=np.int64)
+    rank = np.zeros(shape=heights.shape, dtype=np.int64)
+    anchored = np.zeros(shape=heights.shape, dtype=np.uint8)
+    rows = inside.reshape(part.shape[0], -1)
+    if start > 0:
+        anchored[rows[0]] = 1
+    if stop < total:
+        anchored[rows[-1]] = 1
+    younger, where, edges = sweep(heights, order, _offsets(strides, False),
+                                  parent, rank, anchored)
+
+    bars = _unpad(np.stack([younger, where], axis=1), part.shape)
+    edges = _unpad(edges, part.shape)
+    shift = start*rows.shape[1]
+    extremes = (flat.min(), flat.argmin() + shift, flat.max(), flat.argmax() + shift)
+    return bars + shift, edges + shift, extremes, (flat[bars], flat[edges])
+
+
+def pers0(img_array, tile=None, parallel=False):
+    r""" 0-dimensional persistence of the sublevel sets of an image or volume,
+    where pixels are joined to their 4 (or 6) neighbors.
+
+    As in :func:`homology.dim0.unionfind`, ties go to the pixel of lower
+    index, the global minimum gets a bar that dies at the global maximum, and
+    bars of zero persistence are left out.
+
+    For arrays that are too big for memory, such as a :class:`numpy.memmap`,
+    give `tile` to work on slabs of that many rows (along the first axis) at a
+    time.  Each slab is loaded and swept on its own.  Components that reach
+    the first or last row of a slab are kept as a small graph, and these
+    graphs are joined at the end.  The result is identical to the untiled one.
+
+    Parameters
+    ----------
+    img_array : :class:`numpy.ndarray`
+        of dimension 2 or 3.
+    tile : int
+        Number of rows in each slab.  Default: None, for one slab.
+    parallel : bool
+        If True, sweep the slabs in a
+        :class:`concurrent.futures.ProcessPoolExecutor`.  A
+        :class:`numpy.memmap` is reopened by each worker, rather than sent to
+        it.  Default: False
+
+    Returns
+    -------
+    :class:`homology.PersDiag`, whose indices are flat indices of pixels.
+
+    Examples
+    --------
+
+    >>> img = np.array([[0., 5., 1.],
+    ...                 [5., 5., 5.],
+    ...                 [2., 5., 3.]])
+    >>> pers0(img).diagram[['birth', 'death']].values.tolist()
+    [[3.0, 5.0], [2.0, 5.0], [1.0, 5.0], [0.0, 5.0]]
+    >>> pers0(img, tile=1).diagram.equals(pers0(img).diagram)
+    True
+
+    """
+    from . import PersDiag
+    import mmap
+
+    assert np.ndim(img_array) in (2, 3),\
+        "Cubical persistence is for images (2d arrays) or volumes (3d arrays) only."
+    total = img_array.shape[0]
+    if tile is None:
+        tile = total
+    starts = np.arange(0, max(total - 1, 1), tile)
+    stops = np.minimum(starts + tile + 1, total)
+
+    if parallel and isinstance(img_array, np.memmap) and \
+            isinstance(img_array.base, mmap.mmap) and img_array.flags.c_contiguous:
+        whole = (img_array.filename, img_array.dtype, img_array.offset, img_array.shape)
+        jobs = [(whole, start, stop, total) for start, stop in zip(starts, stops)]
+    else:
+        jobs = [(img_array[start:stop], start, stop, total) for start, stop in zip(starts, stops)]
+
+    if parallel:
+        import os
+        from concurrent.futures import ProcessPoolExecutor
+        workers = os.cpu_count() or 1
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(_tile, jobs))
+    else:
+        results = [_tile(job) for job in jobs]
+
+    bars = np.concatenate([r[0] for r in results])
+    bar_heights = np.concatenate([r[3][0] for r in results])
+    edges = np.concatenate([r[1] for r in results])
+    edge_heights = np.concatenate([r[3][1] for r in results])
+
+    # join the anchored components of all slabs, in the global order.
+    vertices, inverse = np.unique(edges[:, :2], return_inverse=True)
+    inverse = inverse.reshape(-1, 2)
+    heights = np.empty(shape=vertices.shape, dtype=np.float64)
+    heights[inverse] = edge_heights[:, :2]
+    rank = np.empty(shape=vertices.shape, dtype=np.int64)
+    rank[np.lexsort((vertices, heights))] = np.arange(vertices.shape[0])
+    order = np.lexsort((edges[:, 2], edge_heights[:, 2]))
+    younger, where = merge(heights, rank, inverse[order, 0], inverse[order, 1])
+    where = order[where]
+    keep = heights[younger] != edge_heights[where, 2]
+    younger, where = younger[keep], where[keep]
+    bars = np.concatenate([bars, np.stack([vertices[younger], edges[where, 2]], axis=1)])
+    bar_heights = np.concatenate([bar_heights, np.stack([heights[younger],
+                                                         edge_heights[where, 2]], axis=1)])
+
+    # list the bars by death, then birth, so the order does not depend on tile.
+    order = np.lexsort((bars[:, 0], bar_heights[:, 0], bars[:, 1], bar_heights[:, 1]))
+    bars, bar_heights = bars[order], bar_heights[order]
+
+    lows, argmins, highs, argmaxs = (np.array(x) for x in zip(*(r[2] for r in results)))
+    low = np.lexsort((argmins, lows))[0]
+    high = np.lexsort((argmaxs, -highs))[0]
+    return PersDiag(np.append(bars[:, 0], argmins[low]),
+                    np.append(bars[:, 1], argmaxs[high]),
+                    np.append(bar_heights[:, 0], lows[low]),
+                    np.append(bar_heights[:, 1], highs[high]), dict())
+
+
+def _pers_top(img_array):
+    r""" (d-1)-dimensional persistence of a d-dimensional array, by duality.
+    """
+    from . import PersDiag
+
+    img, heights, inside, strides = _padded(img_array, np.inf)
+    flat = img.ravel()
+    order = inside[np.argsort(flat, kind='stable')[::-1]]
+
+    # the pad is one component, older than everything
+    parent = -np.ones(shape=heights.shape, dtype=np.int64)
+    rank = np.zeros(shape=heights.shape, dtype=np.int64)
+    pad = np.ones(shape=heights.shape, dtype='bool')
+    pad[inside] = False
+    pad = np.flatnonzero(pad)
+    parent[pad] = pad[0]
+    rank[pad[0]] = -1
+
+    anchored = np.zeros(shape=heights.shape, dtype=np.uint8)
+    younger, where, edges = sweep(heights, order, _offsets(strides, True),
+                                  parent, rank, anchored)
+
+    # a hole is born when its region of the complement is cut off, and dies
+    # when the highest pixel of that region is added.
+    birth_index = _unpad(where, img.shape)
+    death_index = _unpad(younger, img.shape)
+    return PersDiag(birth_index, death_index,
+                    flat[birth_index], flat[death_index], dict())
+
+
+def pers1(img_array):
+    r""" 1-dimensional persistence of the sublevel sets of an image, where
+    pixels are joined to their 4 neighbors.  This is found by the duality
+    described above, with one union-find pass over all 8 neighbors, in order
+    of decreasing height.
+
+    Parameters
+    ----------
+    img_array : :class:`numpy.ndarray`
+        of dimension 2.
+
+    Returns
+    -------
+    :class:`homology.PersDiag`.  Each bar is born at the pixel that closes a
+    loop, and dies at the highest pixel inside it.
+
+    Examples
+    --------
+
+    >>> img = np.array([[1., 1., 1., 1.],
+    ...                 [1., 4., 3., 1.],
+    ...                 [1., 1., 2., 1.],
+    ...                 [0., 1., 1., 1.]])
+    >>> pers1(img).diagram[['birth', 'death']].values.tolist()
+    [[1.0, 4.0]]
+
+    """
+    if np.ndim(img_array) != 2:
+        raise ValueError("pers1 is for images (2d arrays).  Use pers2 for volumes.")
+    return _pers_top(img_array)
+
+
+def pers2(img_array):
+    r""" 2-dimensional persistence (voids) of the sublevel sets of a volume,
+    where voxels are joined to their 6 neighbors.  This is found by the duality
+    described above, with one union-find pass over all 26 neighbors, in order
+    of decreasing height.
+
+    Parameters
+    ----------
+    img_array : :class:`numpy.ndarray`
+        of dimension 3.
+
+    Returns
+    -------
+    :class:`homology.PersDiag`.
+    """
+    if np.ndim(img_array) != 3:
+        raise ValueError("pers2 is for volumes (3d arrays).  Use pers1 for images.")
+    return _pers_top(img_array)
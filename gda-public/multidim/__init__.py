@@ -10,7 +10,10 @@ a minimal amount of user headache.
 Included are:
     - `PointCloud`, for data points in Euclidean space.
     - `SimplicialComplex`, for abstract simplicial complexes, built
-      from `Simplex` objects sorted by dimension into `SimplexStratum` objects.
+      from `Simplex` objects sorted by dimension into `SimplexStratum` objects,
+      which select many cells at once as a `SimplexBatch`.
+    - `ArrayStratum`, an optional array-backed store for the strata of very
+      large complexes.
 
 
 Copyright
@@ -102,22 +105,64 @@ True
 
 from __future__ import print_function
 
-from collections import defaultdict
+from collections import defaultdict, OrderedDict
+from functools import partial
 import itertools
 import numpy as np
 import pandas as pd
 # Don't roll our own L2 norms
-from scipy.spatial.distance import squareform, cdist, pdist, is_valid_dm
+from scipy.spatial.distance import squareform, cdist, pdist, is_valid_dm, is_valid_y, num_obs_y
 from . import fast_algorithms
 import homology.dim0
 import homology.dim1
 
 
+def _column(stratum, col):
+    r""" The array of one column of a stratum, without copying. """
+    if isinstance(stratum, ArrayStratum):
+        return stratum._columns[col]
+    return stratum[col].values
+
+
+def _position(stratum, label):
+    r""" Row position in a stratum of the cell with the given index. """
+    if isinstance(stratum, ArrayStratum) and stratum._index is None:
+        if not 0 <= label < len(stratum):
+            raise KeyError(label)
+        return label
+    return stratum.index.get_loc(label)
+
+
+def _positions(stratum, labels):
+    r""" Row positions in a stratum of the cells with the given indices. """
+    labels = np.asarray(labels, dtype=np.int64)
+    n = len(stratum)
+    index = stratum.index
+    if isinstance(index, pd.RangeIndex) and index.start == 0 and index.step == 1:
+        positions = labels
+        missing = (labels < 0) | (labels >= n)
+    else:
+        positions = index.get_indexer(labels)
+        missing = positions < 0
+    if np.any(missing):
+        raise KeyError(labels[missing].tolist())
+    return positions
+
+
+def _assign(stratum, col, positions, value):
+    r""" Write values into one column of a stratum at the given positions. """
+    if isinstance(stratum, ArrayStratum):
+        stratum._columns[col][positions] = value
+    else:
+        stratum.iloc[positions, stratum.columns.get_loc(col)] = value
+
+
 class Simplex(object):
     r"""
     This class is a convenient container to access the data in the
     pd DataFrame stratum[dim] of a SimplicialComplex.
-    It is always faster to access stratum[dim].loc[index] directly.
+    It is always faster to access stratum[dim].loc[index] directly, or to
+    work on a whole :class:`SimplexBatch` at once.
 
     Parameters
     ----------
@@ -150,6 +195,11 @@ class Simplex(object):
     :math:`X \in \Delta` and :math:`Y \subset X` then
     :math:`Y \in \Delta`. [1]_
 
+    A Simplex that comes from iterating over a :class:`SimplexStratum` or
+    :class:`SimplexBatch` reads from the values of its batch, as they were
+    when the batch was read.  Assigning to any of its attributes writes to the
+    stratum, and from then on it reads from the stratum again.
+
     References
     ----------
     .. [1] D. Feichtner-Kozlov, Combinatorial algebraic topology.
@@ -157,23 +207,48 @@ class Simplex(object):
 
     """
 
-    def __init__(self, cellcomplex, dim, index):
+    def __init__(self, cellcomplex, dim, index, batch=None, offset=None):
         self.cellcomplex = cellcomplex
         self.dim = dim
         self.index = index
         self.shadow_complex = None
-        self.children = pd.Series(dtype=np.float64)
+        self._children = None
+        self._batch = batch
+        self._offset = offset
+
+    @property
+    def children(self):
+        if self._children is None:
+            self._children = pd.Series(dtype=np.float64)
+        return self._children
+
+    @children.setter
+    def children(self, c):
+        self._children = c
+
+    def _get(self, col):
+        r""" The value of one column for this cell. """
+        if self._batch is not None:
+            return self._batch._values(col)[self._offset]
+        stratum = self.cellcomplex.stratum[self.dim]
+        return _column(stratum, col)[_position(stratum, self.index)]
+
+    def _set(self, col, value):
+        r""" Write the value of one column for this cell to the stratum. """
+        self._batch = None
+        stratum = self.cellcomplex.stratum[self.dim]
+        _assign(stratum, col, _position(stratum, self.index), value)
 
     @property
     def height(self):
         r"""
         :return: height (that is, filtered value) of this cell (np.float64)
         """
-        return self.cellcomplex.stratum[self.dim]['height'].loc[self.index]
+        return self._get('height')
 
     @height.setter
     def height(self, v):
-        self.cellcomplex.stratum[self.dim]['height'].loc[self.index] = v
+        self._set('height', v)
 
     @property
     def mass(self):
@@ -181,13 +256,13 @@ class Simplex(object):
         :return: mass of this cell (np.float64 or None)
         """
         if 'mass' in self.cellcomplex.stratum[self.dim]:
-            return self.cellcomplex.stratum[self.dim]['mass'].loc[self.index]
+            return self._get('mass')
         else:
             return None
 
     @mass.setter
     def mass(self, v):
-        self.cellcomplex.stratum[self.dim]['mass'].loc[self.index] = v
+        self._set('mass', v)
 
     @property
     def positive(self):
@@ -195,7 +270,7 @@ class Simplex(object):
 
         :return:
         """
-        return self.cellcomplex.stratum[self.dim]['pos'].loc[self.index]
+        return self._get('pos')
 
     @positive.setter
     def positive(self, b):
@@ -203,7 +278,7 @@ class Simplex(object):
 
         :param b:
         """
-        self.cellcomplex.stratum[self.dim]['pos'].loc[self.index] = b
+        self._set('pos', b)
 
     @property
     def representative(self):
@@ -211,7 +286,7 @@ class Simplex(object):
 
         :return:
         """
-        return self.cellcomplex.stratum[self.dim]['rep'].loc[self.index]
+        return self._get('rep')
 
     @representative.setter
     def representative(self, r):
@@ -219,7 +294,7 @@ class Simplex(object):
 
         :param r:
         """
-        self.cellcomplex.stratum[self.dim]['rep'].loc[self.index] = r
+        self._set('rep', r)
 
     @property
     def boundary(self):
@@ -230,7 +305,7 @@ class Simplex(object):
         parts = []
         if self.dim > 0:
             parts = range(self.dim + 1)
-        return {self.cellcomplex.stratum[self.dim]['bdy{}'.format(j)].loc[self.index] for j in parts}
+        return {self._get('bdy{}'.format(j)) for j in parts}
 
     @boundary.setter
     def boundary(self, s):
@@ -239,8 +314,7 @@ class Simplex(object):
         :param s:
         """
         for i, c in enumerate(sorted(list(s))):
-            self.cellcomplex.stratum[self.dim]['bdy{}'.format(i)].loc[
-                self.index] = c
+            self._set('bdy{}'.format(i), c)
 
     def __hash__(self):
         r"""
@@ -275,7 +349,138 @@ class Simplex(object):
             raise ValueError("These Cells are not in the same SimplicialComplex!")
         if not (self.dim == other.dim):
             raise ValueError("These Cells are not of the same dimension!")
-        return self.height() < other.height()
+        return self.height < other.height
+
+
+class SimplexBatch(object):
+    r""" A batch of :class:`Simplex` objects of one dimension, by their row
+    positions in `SimplicialComplex.stratum`[dim].  Each attribute of
+    :class:`Simplex` is here an array over the whole batch, read from (or
+    written to) the stratum in one step.
+
+    Batches come from selecting many cells of a :class:`SimplexStratum` at
+    once, and iterating over a batch gives its :class:`Simplex` objects.
+
+    Parameters
+    ----------
+    cellcomplex : :class:`SimplicialComplex`
+        The SimplicialComplex to which these cells belong.
+    dim : int
+        The dimension in which these cells live.
+    positions : :class:`numpy.ndarray` or slice
+        Row positions of these cells in the stratum.
+
+    Examples
+    --------
+
+    >>> pc = PointCloud(np.array([[0.0, 0.0], [1.0, 0.0], [0.0, 2.0]]), max_length=-1)
+    >>> edges = pc.cells(1)[:2]
+    >>> len(edges)
+    2
+    >>> edges.height
+    array([1., 2.])
+    >>> edges.boundary
+    array([[0, 1],
+           [0, 2]])
+    >>> edges.positive = False
+    >>> [e.positive for e in pc.cells(1)]
+    [False, False, True]
+    """
+
+    def __init__(self, cellcomplex, dim, positions):
+        self.cellcomplex = cellcomplex
+        self.dim = dim
+        self.positions = positions
+        self._cache = dict()
+
+    @property
+    def stratum(self):
+        return self.cellcomplex.stratum[self.dim]
+
+    def _values(self, col):
+        r""" The values of one column for this batch, read once. """
+        if col not in self._cache:
+            self._cache[col] = _column(self.stratum, col)[self.positions]
+        return self._cache[col]
+
+    def _get(self, col):
+        return _column(self.stratum, col)[self.positions]
+
+    def _set(self, col, value):
+        self._cache.clear()
+        _assign(self.stratum, col, self.positions, value)
+
+    def __len__(self):
+        if isinstance(self.positions, slice):
+            return len(range(*self.positions.indices(len(self.stratum))))
+        return self.positions.shape[0]
+
+    @property
+    def index(self):
+        r""" The abstract indices of these cells. """
+        return np.asarray(self.stratum.index[self.positions])
+
+    @property
+    def height(self):
+        return self._get('height')
+
+    @height.setter
+    def height(self, v):
+        self._set('height', v)
+
+    @property
+    def mass(self):
+        if 'mass' in self.stratum:
+            return self._get('mass')
+        else:
+            return None
+
+    @mass.setter
+    def mass(self, v):
+        self._set('mass', v)
+
+    @property
+    def positive(self):
+        return self._get('pos')
+
+    @positive.setter
+    def positive(self, b):
+        self._set('pos', b)
+
+    @property
+    def representative(self):
+        return self._get('rep')
+
+    @representative.setter
+    def representative(self, r):
+        self._set('rep', r)
+
+    @property
+    def boundary(self):
+        r""" The boundaries of these cells, as an array with one row for each
+        cell and dim+1 columns. """
+        parts = []
+        if self.dim > 0:
+            parts = range(self.dim + 1)
+        cols = [self._get('bdy{}'.format(j)) for j in parts]
+        if not cols:
+            return np.zeros(shape=(len(self), 0), dtype=np.int64)
+        return np.stack(cols, axis=1)
+
+    def __iter__(self):
+        for k, i in enumerate(self.index):
+            yield Simplex(self.cellcomplex, self.dim, i, batch=self, offset=k)
+
+    def __getitem__(self, k):
+        r""" The k-th Simplex of this batch, or a smaller batch. """
+        if np.ndim(k) == 0 and not isinstance(k, slice):
+            return Simplex(self.cellcomplex, self.dim, self.index[k])
+        positions = np.arange(len(self.stratum))[self.positions]
+        return SimplexBatch(self.cellcomplex, self.dim, positions[k])
+
+    def __repr__(self):
+        return "Batch of {} {}-Simplices of SimplicialComplex {}".format(
+            len(self), self.dim, id(self.cellcomplex))
 
 
 class SimplexStratum(object):
@@ -283,21 +488,66 @@ class SimplexStratum(object):
     dimension from a `SimplicialComplex`.  It is an interface to the data in
     `SimplicialComplex.stratum`[dim], which is a `pandas.DataFrame`.  Whenever
     possible, the `pandas.DataFrame` should be called directly, for speed.
+
+    A single index gives one :class:`Simplex`.  A slice or boolean mask (by
+    position, as in NumPy) or an array of indices gives a
+    :class:`SimplexBatch`.  Iteration goes a batch at a time, so that each
+    column is read once per batch rather than once per cell.
+
+    Examples
+    --------
+
+    >>> pc = PointCloud(np.array([[0.0, 0.0], [1.0, 0.0], [0.0, 2.0]]), max_length=-1)
+    >>> pc.cells(1)[2]
+    1+ Simplex 2 of height 2.23606797749979 and mass None
+    >>> pc.cells(1)[np.array([2, 0])].height
+    array([2.23606798, 1.        ])
+    >>> batch = pc.cells(1)[pc.stratum[1]['height'].values > 1.5]
+    >>> batch.index
+    array([1, 2])
+    >>> [cell.index for cell in pc.cells(0)]
+    [0, 1, 2]
     """
 
+    batch_size = 4096
+
     def __init__(self, cell_complex, dim):
         self.cell_complex = cell_complex
         self.dim = dim
         self._cells = dict()
 
+    def __len__(self):
+        return len(self.cell_complex.stratum[self.dim])
+
     def __getitem__(self, i):
+        if isinstance(i, slice) or np.ndim(i) > 0:
+            return self.batch(i)
         if i not in self._cells:
             self._cells[i] = Simplex(self.cell_complex, self.dim, i)
         return self._cells[i]
 
+    def batch(self, key):
+        r""" A :class:`SimplexBatch` of the cells selected by a slice or
+        boolean mask (by position) or by an array of indices. """
+        if isinstance(key, slice):
+            return SimplexBatch(self.cell_complex, self.dim, key)
+        key = np.asarray(key)
+        if key.dtype == bool:
+            return SimplexBatch(self.cell_complex, self.dim, np.flatnonzero(key))
+        return SimplexBatch(self.cell_complex, self.dim,
+                            _positions(self.cell_complex.stratum[self.dim], key))
+
+    def batches(self, size=None):
+        r""" Iterate over consecutive :class:`SimplexBatch` objects of the
+        given size, which is :code:`batch_size` by default. """
+        size = size or self.batch_size
+        for start in range(0, len(self), size):
+            yield SimplexBatch(self.cell_complex, self.dim, slice(start, start + size))
+
     def __iter__(self):
-        for i in self.cell_complex.stratum[self.dim].index:
-            yield self[i]
+        for batch in self.batches():
+            for cell in batch:
+                yield cell
 
     def __repr__(self):
         return "Stratum {} of SimplicialComplex {}".format(self.dim,
@@ -310,7 +560,159 @@ class SimplexStratum(object):
         return type(self) == other(self) and self.__hash__ == other.__hash__
 
 
-def stratum_maker(dim=0):
+class ArrayStratum(object):
+    r"""
+    A struct-of-arrays replacement for the :class:`pandas.DataFrame` in
+    `SimplicialComplex.stratum`[dim].  Each column ('height', 'pos', 'rep',
+    'bdy0', ...) is held as one contiguous :class:`numpy.ndarray`, so building
+    a stratum with tens of millions of cells costs only the arrays themselves.
+
+    An ArrayStratum is indexable like a DataFrame for compatibility:
+    :code:`S['height']` is a :class:`pandas.Series` *view* of the column (so
+    :code:`S['height'].values` is the column array itself, and writes
+    propagate), :code:`S[['bdy0', 'bdy1']].values` stacks columns, and boolean
+    or integer arrays select rows.  Use :func:`to_frame` for anything else.
+
+    Parameters
+    ----------
+    columns : dict
+        Mapping of column name to :class:`numpy.ndarray`.  All arrays must
+        have the same length.  Pass an :class:`collections.OrderedDict` to fix
+        the column order.
+    index : :class:`numpy.ndarray`
+        The abstract index of the cells.  Default: None, meaning
+        :code:`range(n)`.
+
+    See Also
+    --------
+    :func:`stratum_maker`, :class:`SimplicialComplex`
+
+    Examples
+    --------
+
+    >>> S = ArrayStratum(OrderedDict([('height', np.array([0.5, 1.0])),
+    ...                               ('pos', np.array([True, True])),
+    ...                               ('rep', np.array([0, 1])),
+    ...                               ('bdy0', np.array([0, 1])),
+    ...                               ('bdy1', np.array([1, 2]))]))
+    >>> len(S)
+    2
+    >>> S['rep'].values[:] = 7
+    >>> S.to_frame()
+       height   pos  rep  bdy0  bdy1
+    0     0.5  True    7     0     1
+    1     1.0  True    7     1     2
+    >>> S[['bdy0', 'bdy1']].values
+    array([[0, 1],
+           [1, 2]])
+    >>> S[S['height'] > 0.7]
+       height   pos  rep  bdy0  bdy1
+    1     1.0  True    7     1     2
+    """
+
+    def __init__(self, columns, index=None):
+        self._columns = OrderedDict((c, np.ascontiguousarray(v)) for c, v in columns.items())
+        lengths = set(v.shape[0] for v in self._columns.values())
+        assert len(lengths) <= 1, "All columns of an ArrayStratum must have the same length."
+        self._len = lengths.pop() if lengths else 0
+        if index is not None:
+            index = np.asarray(index, dtype=np.int64)
+            assert index.shape == (self._len,), "Index length does not match columns."
+            # a range index need not be stored
+            if np.all(index == np.arange(self._len)):
+                index = None
+        self._index = index
+        self._labels = None
+
+    @property
+    def columns(self):
+        return pd.Index(list(self._columns.keys()))
+
+    @property
+    def index(self):
+        if self._index is None:
+            return pd.RangeIndex(self._len)
+        # keep the pandas.Index, and so its hash table for lookups
+        if self._labels is None or self._labels[0] is not self._index:
+            self._labels = (self._index, pd.Index(self._index))
+        return self._labels[1]
+
+    @property
+    def shape(self):
+        return (self._len, len(self._columns))
+
+    @property
+    def values(self):
+        r""" The columns stacked into one 2-d array, as :code:`DataFrame.values` """
+        return np.column_stack(list(self._columns.values()))
+
+    @property
+    def loc(self):
+        r""" Label-based access via :func:`to_frame`.  This is a *copy*, so
+        assignments do not propagate; assign to :code:`self[col].loc` instead. """
+        return self.to_frame().loc
+
+    @property
+    def iloc(self):
+        r""" Position-based access via :func:`to_frame`.  This is a *copy*. """
+        return self.to_frame().iloc
+
+    def __len__(self):
+        return self._len
+
+    def __contains__(self, col):
+        return col in self._columns
+
+    def __iter__(self):
+        return iter(self._columns)
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            return pd.Series(self._columns[key], index=self.index, name=key, copy=False)
+        if isinstance(key, list) and all(isinstance(k, str) for k in key):
+            return ArrayStratum(OrderedDict((k, self._columns[k]) for k in key),
+                                index=self._index)
+        # otherwise, a row selector: boolean mask or integer positions
+        rows = np.asarray(key)
+        if rows.dtype == bool:
+            rows = np.where(rows)[0]
+        return self.take(rows)
+
+    def __setitem__(self, col, value):
+        value = np.asarray(value)
+        if value.ndim == 0:
+            value = np.full(self._len, value, dtype=value.dtype)
+        assert value.shape == (self._len,), "Column length does not match stratum."
+        self._columns[col] = value
+
+    def __repr__(self):
+        return repr(self.to_frame())
+
+    def take(self, positions):
+        r""" A new ArrayStratum with the rows at the given integer positions. """
+        index = np.arange(self._len)[positions] if self._index is None else self._index[positions]
+        result = ArrayStratum(OrderedDict((c, v[positions]) for c, v in self._columns.items()))
+        result._index = index
+        return result
+
+    def filter(self, regex):
+        r""" Select columns by regular expression, as :func:`pandas.DataFrame.filter` """
+        import re
+        return self[[c for c in self._columns if re.search(regex, c)]]
+
+    def copy(self):
+        result = ArrayStratum(OrderedDict((c, v.copy()) for c, v in self._columns.items()))
+        result._index = None if self._index is None else self._index.copy()
+        return result
+
+    def to_frame(self):
+        r""" Convert to a :class:`pandas.DataFrame` (a copy). """
+        return pd.DataFrame(OrderedDict(self._columns),
+                            columns=list(self._columns.keys()),
+                            index=self.index)
+
+
+def stratum_maker(dim=0, columnar=False):
     r"""
     Make an empty stratum :class:`pandas.DataFrame` of the appropriate dimension.
     This is used to initialize a new dimension of a :class:`SimplicialComplex`.
@@ -319,10 +721,13 @@ def stratum_maker(dim=0):
     ----------
     dim : int
         Dimension of stratum (0, 1, 2, ...)
+    columnar : bool
+        If True, make an empty :class:`ArrayStratum` instead.
+        Default: False
 
     Returns
     -------
-    DataFrame : :class:`pandas.DataFrame`
+    DataFrame : :class:`pandas.DataFrame` or :class:`ArrayStratum`
          pd DataFrame suitable for SimplicialComplex.stratum[dim]
 
     See Also
@@ -333,6 +738,13 @@ def stratum_maker(dim=0):
     bdy_size = 0
     if dim > 0:
         bdy_size = dim + 1
+    if columnar:
+        columns = OrderedDict([('height', np.zeros(0, dtype=np.float64)),
+                               ('pos', np.zeros(0, dtype='bool')),
+                               ('rep', np.zeros(0, dtype=np.int64))])
+        for i in range(bdy_size):
+            columns['bdy{}'.format(i)] = np.zeros(0, dtype=np.int64)
+        return ArrayStratum(columns)
     return pd.DataFrame({},
                         columns=['height', 'pos', 'rep'] + ['bdy{}'.format(i)
                                                          for i in
@@ -340,19 +752,48 @@ def stratum_maker(dim=0):
                         index=range(0))
 
 
-def stratum_from_distances(dists, max_length=-1.0, points=None):
+def stratum_from_arrays(columns, index=None, columnar=False):
+    r"""
+    Make a stratum from a dictionary of equal-length column arrays, as either
+    a :class:`pandas.DataFrame` or an :class:`ArrayStratum`.
+
+    Parameters
+    ----------
+    columns : :class:`collections.OrderedDict`
+        Column name to :class:`numpy.ndarray`, in column order.
+    index : :class:`numpy.ndarray`
+        Index of the cells.  Default: None, meaning :code:`range(n)`.
+    columnar : bool
+        If True, make an :class:`ArrayStratum`, which keeps the arrays as they
+        are.  Default: False
+
+    Returns
+    -------
+    :class:`pandas.DataFrame` or :class:`ArrayStratum`
+    """
+    if columnar:
+        return ArrayStratum(columns, index=index)
+    return pd.DataFrame(columns, columns=list(columns.keys()), index=index)
+
+
+def stratum_from_distances(dists, max_length=-1.0, points=None, columnar=False):
     r""" Construct a stratum dictionary from a symmetric matrix of distances.
 
     Parameters
     ----------
     dists : :class:`numpy.ndarray`
         A symmetric NxN array for distances, as obtained from
-        :class:`scipy.spatial.distances.squareform`
+        :class:`scipy.spatial.distances.squareform`, or the condensed vector
+        of length N(N-1)/2 from :func:`scipy.spatial.distance.pdist`.  This
+        may be a :class:`numpy.memmap`, which is read a piece at a time.
     max_length : int
         If max_length >=0, store only those edges
         of length < max_length. Default: -1.0, store all edges.
     points : :class:`pandas.DataFrame`
         A fully-formed DataFrame of point information for stratum[0].
+    columnar : bool
+        If True, build :class:`ArrayStratum` strata instead of DataFrames.
+        Default: False
 
     Returns
     -------
@@ -362,50 +803,83 @@ def stratum_from_distances(dists, max_length=-1.0, points=None):
     See Also
     --------
     :func:`fast_algorithms.edges_from_dists`
+
+    Examples
+    --------
+    >>> X = np.array([[0.0, 0.0], [3.0, 0.0], [0.0, 4.0]])
+    >>> stratum = stratum_from_distances(pdist(X), max_length=4.5)
+    >>> stratum[1][['height', 'bdy0', 'bdy1']].values.tolist()
+    [[3.0, 0.0, 1.0], [4.0, 0.0, 2.0]]
     """
-    is_valid_dm(dists, throw=True)
+    if np.ndim(dists) == 1:
+        is_valid_y(dists, throw=True)
+        n = num_obs_y(dists)
+    else:
+        is_valid_dm(dists, throw=True)
+        n = dists.shape[0]
 
     if points is None:
-        n = dists.shape[0]
         idx0 = np.arange(n, dtype=np.int64)
         hgt0 = np.zeros(n, dtype=np.float64)
         pos0 = np.ones(shape=(n,), dtype='bool')
-        points = pd.DataFrame({
-            'height': hgt0,
-            'pos': pos0,
-            'rep': idx0,
-        },
-                columns=['height', 'pos', 'rep'],
-                index=idx0)
+        points = stratum_from_arrays(OrderedDict([
+            ('height', hgt0),
+            ('pos', pos0),
+            ('rep', idx0),
+        ]), index=idx0, columnar=columnar)
 
     if max_length == 0:
         # if the cutoff is 0, we don't want to bother to make all the
         # distances.
-        edges = stratum_maker(1)
+        edges = stratum_maker(1, columnar=columnar)
     else:
         hgt1, pos1, bdys = fast_algorithms.edges_from_dists(points.index.values, dists,
                                                             cutoff=np.float64(max_length))
         num_edges = hgt1.shape[0]
         idx1 = np.arange(num_edges, dtype='int64')
-        edges = pd.DataFrame({
-            'height': hgt1,
-            'pos': pos1,
-            'rep': idx1,
-            'bdy0': bdys[:, 0],
-            'bdy1': bdys[:, 1],
-        },
-                columns=['height', 'pos', 'rep', 'bdy0', 'bdy1'],
-                index=idx1)
+        edges = stratum_from_arrays(OrderedDict([
+            ('height', hgt1),
+            ('pos', pos1),
+            ('rep', idx1),
+            ('bdy0', bdys[:, 0]),
+            ('bdy1', bdys[:, 1]),
+        ]), index=idx1, columnar=columnar)
     return {0: points, 1: edges}
 
 
-def lower_star_for_image(img_array):
+def lower_star_for_image(img_array, columnar=False, sort=False):
     """
-    Compute the lower star weighted simplicial complex from a 2d grid/image.
+    Compute the lower star weighted simplicial complex from a 2d grid/image,
+    or a 3d grid of voxels.
+
+    Each pixel is a vertex, with the pixel value as height, and each simplex
+    gets the greatest height of its vertices.  Everything is built with index
+    arithmetic on whole arrays.
+
+    For an image of shape (m, n), there are m*(n-1) horizontal edges, then
+    (m-1)*n vertical edges, then one diagonal edge for each of the (m-1)*(n-1)
+    squares, in row-major order.  The diagonal of each square passes through
+    its highest corner (the first one, in the order nw, ne, se, sw), and
+    splits it into two faces, which are numbered consecutively.
+
+    For a volume of shape (m, n, p), the cubes are split by the Freudenthal
+    triangulation: voxel v is joined to v + d for each of the 7 non-zero
+    d in {0,1}^3, and (v, v + d, v + d') is a face whenever d < d'.  The
+    edges are numbered by direction d, then by row-major order of v, and
+    likewise the faces.  The tetrahedra are not built, as they do not change
+    the persistence in dimensions 0 and 1.
 
     Parameters
     ----------
-    img_array, a `numpy.ndarray` of dimension 2.
+    img_array : :class:`numpy.ndarray`
+        of dimension 2 or 3.
+    columnar : bool
+        If True, store the strata as :class:`ArrayStratum` objects, which
+        is recommended for large images.  Default: False
+    sort : bool
+        If True, sort the edges and the faces by height (stably), as
+        :func:`SimplicialComplex.make_pers0` expects, and renumber the face
+        boundaries to match.  Default: False, use the layout above.
 
     Returns
     -------
@@ -417,205 +891,146 @@ def lower_star_for_image(img_array):
     >>> A = np.random.rand(3,4)
     >>> lower_star_for_image(A)
     A SimplicialComplex with 12 points, 23 edges, and 12 faces.
+    >>> lower_star_for_image(np.random.rand(2,3,4))
+    A SimplicialComplex with 24 points, 81 edges, and 94 faces.
     """
-    assert len(img_array.shape) == 2,\
-        "Lower-star filtration is currently for images (2d arrays) only."
+    assert len(img_array.shape) in (2, 3),\
+        "Lower-star filtration is for images (2d arrays) or volumes (3d arrays) only."
+
+    if len(img_array.shape) == 3:
+        return _lower_star_for_volume(img_array, columnar=columnar, sort=sort)
 
     m = img_array.shape[0]
     n = img_array.shape[1]
 
     # make all vertices, by flattening val_array and indexing in the normal way
     verts_hgt = img_array.flatten()
-    verts_rep = np.arange(m*n)
-    flat_index = verts_rep.reshape(m, n)
-
-    edges_hgt = []
-    edges_rep = []
-    edges_bdy0 = []
-    edges_bdy1 = []
-    # Make all the horizontal edges.
-    for i, j in itertools.product(range(m), range(n-1)):
-        # collect vertices' indices and heights
-        # left=(i,j) -- right=(i,j+1)
-        lf_idx = flat_index[i, j]
-        rt_idx = flat_index[i, j+1]
-        # There is no real reason for these asserts -- just clarification.
-        # assert lf_idx == n*(i) + (j)
-        # assert rt_idx == n*(i) + (j+1)
-
-        lf_hgt = img_array[i, j]
-        rt_hgt = img_array[i, j+1]
-        # There is no real reason for these asserts -- just clarification.
-        # assert lf_hgt == verts_hgt[lf_idx]
-        # assert rt_hgt == verts_hgt[rt_idx]
-
-        edges_hgt.append(np.max([lf_hgt, rt_hgt]))
-        edges_rep.append(len(edges_rep))
-        edges_bdy0.append(lf_idx)
-        edges_bdy1.append(rt_idx)
-
-        # This i,j horizontal edge should have index (n-1)*i + j
-        assert len(edges_hgt) - 1 == (n-1)*i + j
-
-    # did we count all horizontal edges?
-    assert len(edges_hgt) == (n-1)*m
-
-    # Make all the vertical edges
-    for i, j in itertools.product(range(m-1), range(n)):
-        # collect vertices' indices and heights
-        # top=(i,j)
-        #     |
-        # bot=(i+1,j)
-        tp_idx = flat_index[i, j]
-        bt_idx = flat_index[i+1, j]
-        # There is no real reason for these asserts -- just clarification.
-        # assert tp_idx == n*(i) + (j)
-        # assert bt_idx == n*(i+1) + (j)
-        tp_hgt = img_array[i, j]
-        bt_hgt = img_array[i+1, j]
-        # There is no real reason for these asserts -- just clarification.
-        # assert tp_hgt == verts_hgt[tp_idx]
-        # assert bt_hgt == verts_hgt[bt_idx]
-        edges_hgt.append(np.max([tp_hgt, bt_hgt]))
-        edges_rep.append(len(edges_rep))
-        edges_bdy0.append(tp_idx)
-        edges_bdy1.append(bt_idx)
-
-        # This i,j vertical edge should have index n*i + j
-        # AFTER the (n-1)*m horizontal edges
-        assert len(edges_hgt) - 1 == (n-1)*m + n*i + j
-
-    # did we cound all vertical AND horizontal edges?
-    assert len(edges_hgt) == (n-1)*m + n*(m-1)
-
-    faces_hgt = []
-    faces_rep = []
-    faces_bdy0 = []
-    faces_bdy1 = []
-    faces_bdy2 = []
-
-    # Make the diagonal edges, and the faces, too.
-    for i, j in itertools.product(range(m-1), range(n-1)):
-        # collect the vertices' indices and heights
-        #  nw=(i,j)        ne=(i, j+1)
-        #          at (i,j)
-        #  sw=(i+1, j)     se=(i+1, j+1)
-        nw_idx = flat_index[i, j]
-        ne_idx = flat_index[i, j+1]
-        se_idx = flat_index[i+1, j+1]
-        sw_idx = flat_index[i+1, j]
-        # There is no real reason for these asserts -- just clarification.
-        # assert nw_idx == n*(i) + (j)
-        # assert ne_idx == n*(i) + (j+1)
-        # assert se_idx == n*(i+1) + (j+1)
-        # assert sw_idx == n*(i+1) + (j)
-
-        nw_hgt = img_array[i, j]
-        ne_hgt = img_array[i, j+1]
-        se_hgt = img_array[i+1, j+1]
-        sw_hgt = img_array[i+1, j]
-        # There is no real reason for these asserts -- just clarification.
-        # assert nw_hgt == verts_hgt[nw_idx]
-        # assert ne_hgt == verts_hgt[ne_idx]
-        # assert se_hgt == verts_hgt[se_idx]
-        # assert sw_hgt == verts_hgt[sw_idx]
-
-        # determine diagonal
-        cell_max_loc = np.argmax([nw_hgt, ne_hgt, se_hgt, sw_hgt])
-
-        if cell_max_loc % 2 == 0:
-            # Max is either nw or se.
-            # Make edge (nw,se)
-            edges_hgt.append(np.max([nw_hgt, se_hgt]))
-            edges_rep.append(len(edges_rep))
-            edges_bdy0.append(nw_idx)
-            edges_bdy1.append(se_idx)
-
-            # Make face (nw,ne,se).
-            faces_hgt.append(np.max([nw_hgt, ne_hgt, se_hgt]))
-            faces_rep.append(len(faces_rep))
-            faces_bdy0.append((n-1)*i + j)  # horizontal nw-ne
-            # assert edges_bdy0[ (n-1)*i + j ] == nw_idx
-            # assert edges_bdy1[ (n-1)*i + j ] == ne_idx
-            faces_bdy1.append((n-1)*m + n*i + j+1)  # vertical ne|se
-            # assert edges_bdy0[ (n-1)*m + n*i + j+1 ] == ne_idx
-            # assert edges_bdy1[ (n-1)*m + n*i + j+1 ] == se_idx
-            faces_bdy2.append(edges_rep[-1])  # most recent edge is nw\se
-            # assert edges_bdy0[ edges_rep[-1] ] == nw_idx
-            # assert edges_bdy1[ edges_rep[-1] ] == se_idx
-
-            # Make face (sw,se,nw).
-            faces_hgt.append(np.max([sw_hgt, se_hgt, nw_hgt]))
-            faces_rep.append(len(faces_rep))
-            faces_bdy0.append((n-1)*(i+1) + j)  # horizontal sw-se
-            # assert edges_bdy0[ (n-1)*(i+1) + j ] == sw_idx
-            # assert edges_bdy1[ (n-1)*(i+1) + j ] == se_idx
-            faces_bdy1.append((n-1)*m + n*i + j)  # vertical nw|sw
-            # assert edges_bdy0[ (n-1)*m + n*i + j ] == nw_idx
-            # assert edges_bdy1[ (n-1)*m + n*i + j ] == sw_idx
-            faces_bdy2.append(edges_rep[-1])  # most recent edge is nw\se
-            # assert edges_bdy0[ edges_rep[-1] ] == nw_idx
-            # assert edges_bdy1[ edges_rep[-1] ] == se_idx
-
-        else:
-            # Max is either ne or sw.
-            # Make edge (ne,sw)
-            edges_hgt.append(np.max([ne_hgt, sw_hgt]))
-            edges_rep.append(len(edges_rep))
-            edges_bdy0.append(ne_idx)
-            edges_bdy1.append(sw_idx)
-
-            # Make face (nw,ne,sw).
-            faces_hgt.append(np.max([nw_hgt, ne_hgt, sw_hgt]))
-            faces_rep.append(len(faces_rep))
-            faces_bdy0.append((n-1)*i + j)  # horizontal nw-ne
-            # assert edges_bdy0[ (n-1)*i + j ] == nw_idx
-            # assert edges_bdy1[ (n-1)*i + j ] == ne_idx
-            faces_bdy1.append((n-1)*m + n*i + j)  # vertical nw|sw
-            # assert edges_bdy0[ (n-1)*m + n*i + j ] == nw_idx
-            # assert edges_bdy1[ (n-1)*m + n*i + j ] == sw_idx
-            faces_bdy2.append(edges_rep[-1])  # most recent edge is ne\sw
-            # assert edges_bdy0[ edges_rep[-1] ] == ne_idx
-            # assert edges_bdy1[ edges_rep[-1] ] == sw_idx
-
-            # Make face (sw,se,ne).
-            faces_hgt.append(np.max([sw_hgt, se_hgt, ne_hgt]))
-            faces_rep.append(len(faces_rep))
-            faces_bdy0.append((n-1)*(i+1) + j)  # horizontal sw-se
-            # assert edges_bdy0[ (n-1)*(i+1) + j ] == sw_idx
-            # assert edges_bdy1[ (n-1)*(i+1) + j ] == se_idx
-            faces_bdy1.append((n-1)*m + n*i + j+1)  # vertical ne|se
-            # assert edges_bdy0[ (n-1)*m + n*i + j+1 ] == ne_idx
-            # assert edges_bdy1[ (n-1)*m + n*i + j+1 ] == se_idx
-            faces_bdy2.append(edges_rep[-1])  # most recent edge is ne\sw
-            # assert edges_bdy0[ edges_rep[-1] ] == ne_idx
-            # assert edges_bdy1[ edges_rep[-1] ] == sw_idx
-
-    verts_pos = np.ones_like(verts_hgt, dtype='bool')
-    edges_pos = np.ones_like(edges_rep, dtype='bool')
-    faces_pos = np.ones_like(faces_rep, dtype='bool')
-
-    verts = pd.DataFrame({'height': verts_hgt,
-                          'rep': verts_rep,
-                          'pos': verts_pos},
-                         columns=['height', 'pos', 'rep'])
-
-    edges = pd.DataFrame({'height': edges_hgt,
-                          'rep': edges_rep,
-                          'pos': edges_pos,
-                          'bdy0': edges_bdy0,
-                          'bdy1': edges_bdy1},
-                         columns=['height', 'pos', 'rep', 'bdy0', 'bdy1'])
-
-    faces = pd.DataFrame({'height': faces_hgt,
-                          'rep': faces_rep,
-                          'pos': faces_pos,
-                          'bdy0': faces_bdy0,
-                          'bdy1': faces_bdy1,
-                          'bdy2': faces_bdy2},
-                         columns=['height', 'pos', 'rep', 'bdy0', 'bdy1', 'bdy2'])
-
-    return SimplicialComplex(stratum={0: verts, 1: edges, 2: faces})
+    flat_index = np.arange(m*n, dtype=np.int64).reshape(m, n)
+
+    # corners of each square
+    #  nw=(i,j)        ne=(i, j+1)
+    #          at (i,j)
+    #  sw=(i+1, j)     se=(i+1, j+1)
+    nw = flat_index[:-1, :-1].ravel()
+    ne = flat_index[:-1, 1:].ravel()
+    se = flat_index[1:, 1:].ravel()
+    sw = flat_index[1:, :-1].ravel()
+
+    # The i,j horizontal edge has index (n-1)*i + j, and the i,j vertical edge
+    # has index n*i + j AFTER the (n-1)*m horizontal edges.
+    i, j = np.divmod(np.arange((m-1)*(n-1), dtype=np.int64), n-1)
+    horiz_top = (n-1)*i + j
+    horiz_bot = (n-1)*(i+1) + j
+    vert_lf = (n-1)*m + n*i + j
+    vert_rt = (n-1)*m + n*i + j+1
+    diag = (n-1)*m + n*(m-1) + np.arange((m-1)*(n-1), dtype=np.int64)
+
+    # The diagonal is nw\se if the max is either nw or se, else ne\sw.
+    cell_max_loc = np.argmax(np.stack([verts_hgt[nw], verts_hgt[ne],
+                                       verts_hgt[se], verts_hgt[sw]]), axis=0)
+    nw_se = cell_max_loc % 2 == 0
+    diag_bdy0 = np.where(nw_se, nw, ne)
+    diag_bdy1 = np.where(nw_se, se, sw)
+
+    edges_bdy0 = np.concatenate([flat_index[:, :-1].ravel(),
+                                 flat_index[:-1, :].ravel(), diag_bdy0])
+    edges_bdy1 = np.concatenate([flat_index[:, 1:].ravel(),
+                                 flat_index[1:, :].ravel(), diag_bdy1])
+
+    # Faces (nw,ne,se) and (sw,se,nw), or (nw,ne,sw) and (sw,se,ne).
+    faces_bdy0 = np.stack([horiz_top, horiz_bot], axis=1).ravel()
+    faces_bdy1 = np.stack([np.where(nw_se, vert_rt, vert_lf),
+                           np.where(nw_se, vert_lf, vert_rt)], axis=1).ravel()
+    faces_bdy2 = np.repeat(diag, 2)
+    faces_hgt = np.stack([
+        np.maximum(np.maximum(verts_hgt[nw], verts_hgt[ne]), verts_hgt[np.where(nw_se, se, sw)]),
+        np.maximum(np.maximum(verts_hgt[sw], verts_hgt[se]), verts_hgt[np.where(nw_se, nw, ne)]),
+    ], axis=1).ravel()
+
+    return _lower_star_complex(verts_hgt, edges_bdy0, edges_bdy1,
+                               [faces_bdy0, faces_bdy1, faces_bdy2],
+                               faces_hgt, columnar, sort)
+
+
+def _lower_star_for_volume(vol_array, columnar=False, sort=False):
+    r""" The Freudenthal lower-star complex of a 3d array, as described in
+    :func:`lower_star_for_image`. """
+    shape = np.array(vol_array.shape, dtype=np.int64)
+    verts_hgt = vol_array.flatten()
+    flat_index = np.arange(verts_hgt.shape[0], dtype=np.int64).reshape(vol_array.shape)
+    strides = np.array(flat_index.strides, dtype=np.int64)//flat_index.itemsize
+
+    # the 7 directions, in order of the binary number zyx
+    directions = [np.array([(d >> 2) & 1, (d >> 1) & 1, d & 1]) for d in range(1, 8)]
+
+    def base(d):
+        # the voxels v such that v + d is in the volume
+        return flat_index[tuple(slice(0, size - o) for size, o in zip(shape, d))]
+
+    def edge_index(d, v):
+        # the index of the edge (v, v + d), for an array of voxels v
+        t = int(d[0]*4 + d[1]*2 + d[2]) - 1
+        coords = np.stack(np.unravel_index(v, vol_array.shape))
+        sub_shape = shape - d
+        return edge_starts[t] + np.ravel_multi_index(coords, tuple(sub_shape))
+
+    edge_counts = [np.prod(shape - d) for d in directions]
+    edge_starts = np.concatenate([[0], np.cumsum(edge_counts)])
+    edges_bdy0 = np.concatenate([base(d).ravel() for d in directions])
+    edges_bdy1 = np.concatenate([base(d).ravel() + np.dot(d, strides) for d in directions])
+
+    faces_bdy = [[], [], []]
+    for dw in directions:
+        for du in directions:
+            if np.all(du <= dw) and np.any(du != dw):
+                v = base(dw).ravel()
+                u = v + np.dot(du, strides)
+                faces_bdy[0].append(edge_index(du, v))
+                faces_bdy[1].append(edge_index(dw - du, u))
+                faces_bdy[2].append(edge_index(dw, v))
+    faces_bdy = [np.concatenate(b) for b in faces_bdy]
+    faces_hgt = np.maximum(
+        np.maximum(verts_hgt[edges_bdy0[faces_bdy[2]]], verts_hgt[edges_bdy1[faces_bdy[2]]]),
+        verts_hgt[edges_bdy1[faces_bdy[0]]])
+
+    return _lower_star_complex(verts_hgt, edges_bdy0, edges_bdy1, faces_bdy,
+                               faces_hgt, columnar, sort)
+
+
+def _lower_star_complex(verts_hgt, edges_bdy0, edges_bdy1, faces_bdy, faces_hgt,
+                        columnar=False, sort=False):
+    r""" Assemble the strata of a lower-star :class:`SimplicialComplex`. """
+    edges_hgt = np.maximum(verts_hgt[edges_bdy0], verts_hgt[edges_bdy1])
+    if sort:
+        sortby = edges_hgt.argsort(kind='stable')
+        edges_hgt, edges_bdy0, edges_bdy1 = edges_hgt[sortby], edges_bdy0[sortby], edges_bdy1[sortby]
+        renumber = np.empty_like(sortby)
+        renumber[sortby] = np.arange(sortby.shape[0])
+        sortby = faces_hgt.argsort(kind='stable')
+        faces_hgt = faces_hgt[sortby]
+        faces_bdy = [renumber[b[sortby]] for b in faces_bdy]
+    verts = stratum_from_arrays(OrderedDict([
+        ('height', verts_hgt),
+        ('pos', np.ones(shape=verts_hgt.shape, dtype='bool')),
+        ('rep', np.arange(verts_hgt.shape[0], dtype=np.int64)),
+    ]), columnar=columnar)
+    edges = stratum_from_arrays(OrderedDict([
+        ('height', edges_hgt),
+        ('pos', np.ones(shape=edges_hgt.shape, dtype='bool')),
+        ('rep', np.arange(edges_hgt.shape[0], dtype=np.int64)),
+        ('bdy0', edges_bdy0),
+        ('bdy1', edges_bdy1),
+    ]), columnar=columnar)
+    faces = stratum_from_arrays(OrderedDict([
+        ('height', faces_hgt),
+        ('pos', np.ones(shape=faces_hgt.shape, dtype='bool')),
+        ('rep', np.arange(faces_hgt.shape[0], dtype=np.int64)),
+        ('bdy0', faces_bdy[0]),
+        ('bdy1', faces_bdy[1]),
+        ('bdy2', faces_bdy[2]),
+    ]), columnar=columnar)
+
+    return SimplicialComplex(stratum={0: verts, 1: edges, 2: faces}, columnar=columnar)
 
 
 class SimplicialComplex(object):
@@ -644,6 +1059,12 @@ class SimplicialComplex(object):
     stratum : dict
         Dictionary of :class:`pandas.DataFrame` objects holding vertices,
         edges, faces, and so on.  See examples below.
+    columnar : bool
+        If True, new strata are made as :class:`ArrayStratum` objects, which
+        hold each column as a plain :class:`numpy.ndarray`.  This avoids the
+        construction and indexing overhead of pandas on very large complexes.
+        It is turned on automatically if `stratum` contains any
+        :class:`ArrayStratum`.  Default: False
 
     Notes
     -----
@@ -686,13 +1107,17 @@ class SimplicialComplex(object):
     A SimplicialComplex with 3 points, 3 edges, and 1 faces.
     """
 
-    def __init__(self, stratum=None):
+    def __init__(self, stratum=None, columnar=False):
         if stratum is not None:
             assert all(type(k) == int and k >= 0 for k in stratum.keys()), \
                 "The strata of a SimplicialComplex must be indexed by non-negative integers."
-            self.stratum = defaultdict(stratum_maker, stratum)
+            columnar = columnar or any(isinstance(s, ArrayStratum) for s in stratum.values())
+        self.columnar = columnar
+        maker = partial(stratum_maker, columnar=True) if columnar else stratum_maker
+        if stratum is not None:
+            self.stratum = defaultdict(maker, stratum)
         else:
-            self.stratum = defaultdict(stratum_maker)
+            self.stratum = defaultdict(maker)
 
         self._nn = dict()
         self._cellstratum = dict()
@@ -700,7 +1125,7 @@ class SimplicialComplex(object):
         self.pers1 = None
 
     @classmethod
-    def from_distances(cls, dists, max_length=-1.0, points=None):
+    def from_distances(cls, dists, max_length=-1.0, points=None, columnar=False):
         r"""
         Construct a `SimplicialComplex` from a symmetric matrix of distances.
 
@@ -708,7 +1133,8 @@ class SimplicialComplex(object):
         ----------
         dists : `numpy.ndarray`
             An N-by-N symmetric array, with 0s on the diagonal,
-            as obtained from :func:`scipy.spatial.distances.squareform`
+            as obtained from :func:`scipy.spatial.distances.squareform`,
+            or the condensed vector from :func:`scipy.spatial.distance.pdist`.
 
         max_length : float
             If :code:`max_length >= 0`, store only those edges of length less
@@ -719,12 +1145,16 @@ class SimplicialComplex(object):
             stratum[0]. But, if you have that info, you probably want to use
             `PointCloud` instead.
 
+        columnar : bool
+            If True, store the strata as :class:`ArrayStratum` objects.
+            Default: False
+
         Returns
         -------
         `SimplicialComplex`
         """
-        stratum = stratum_from_distances(dists, max_length, points)
-        return cls(stratum=stratum)
+        stratum = stratum_from_distances(dists, max_length, points, columnar=columnar)
+        return cls(stratum=stratum, columnar=columnar)
 
     def check(self):
         r"""Run consistency checks on all simplices in all dimensions.
@@ -758,7 +1188,7 @@ class SimplicialComplex(object):
         self.pers1 = None
         for dim in self.stratum.keys():
             if self.stratum[dim] is None:
-                self.stratum[dim] = stratum_maker(dim)
+                self.stratum[dim] = stratum_maker(dim, columnar=self.columnar)
             self.stratum[dim]['rep'].values[:] = self.stratum[
                 dim].index.values  # identity representation
             self.stratum[dim]['pos'].values[:] = True
@@ -784,7 +1214,50 @@ class SimplicialComplex(object):
         self.pers0 = homology.PersDiag(tbirth_index, tdeath_index, ybirth_index, ydeath_index, mergetree)
         pass
 
-    def sever(self):
+    def components(self):
+        r"""
+        Group the vertices by their connected component, using the known
+        0-dimensional persistence diagram.
+
+        This does one stable argsort of the roots of all vertices, so the
+        cost does not depend on the number of components.
+
+        Returns
+        -------
+        list of :class:`numpy.ndarray`
+            One array of vertex indices (increasing) for each positive vertex,
+            in order of the positive vertices.  The arrays are views into one
+            array of length N.
+
+        Notes
+        -----
+        This uses the 0-dimensional Persistence Diagram; therefore, you should
+        run `self.reset()` and `self.make_pers0(cutoff)` first.
+
+        See Also
+        --------
+        :func:`sever`
+
+        Examples
+        --------
+
+        >>> pc = PointCloud(np.array([[0.,0.],[5.,0.],[0.,0.5],[5.,-0.6]]), max_length=-1.0)
+        >>> pc.make_pers0(cutoff=1.9)
+        >>> [c.tolist() for c in pc.components()]
+        [[0, 2], [1, 3]]
+        """
+        from homology.dim0 import all_roots
+
+        roots = self.stratum[0]['rep'].values.copy()
+        all_roots(roots)
+
+        order = np.argsort(roots, kind='stable')
+        counts = np.bincount(roots, minlength=roots.shape[0])
+        stops = np.cumsum(counts)
+        positive = np.flatnonzero(self.stratum[0]['pos'].values)
+        return [order[stops[i] - counts[i]:stops[i]] for i in positive]
+
+    def sever(self, func=None, parallel=False):
         r"""
         Subdivide a SimplicialComplex or PointCloud into several smaller
         partitions, using the known 0-dimensional persistence diagram.  This is
@@ -793,6 +1266,21 @@ class SimplicialComplex(object):
         Two points end up in the same partition if and only if they are
         connected by a sequence of edges of length < cutoff.
 
+        The partitions are found in one pass by :func:`components`, and the
+        coordinates of each are a view into one re-ordered copy of
+        :code:`self.coords`.
+
+        Parameters
+        ----------
+        func : function
+            If given, yield func(subpointcloud) instead of subpointcloud.
+            To use parallel, func must be picklable, such as a module-level
+            function.  Default: None
+        parallel : bool
+            If True, apply func to the partitions in a
+            :class:`concurrent.futures.ProcessPoolExecutor`.  The results are
+            yielded in the same order.  Default: False
+
         Yields
         ------
         pairs (indices, subpointcloud) of persistently connected
@@ -807,7 +1295,7 @@ class SimplicialComplex(object):
 
         See Also
         --------
-        :func:`make_pers0` :func:`reset`
+        :func:`make_pers0` :func:`reset` :func:`components`
 
 
         Examples
@@ -831,17 +1319,35 @@ class SimplicialComplex(object):
         0  5.0  0.0
         1  6.0  0.0
         2  5.0 -0.6
+        >>> [(indices.tolist(), n) for indices, n in pc.sever(func=lambda sub: sub.coords.shape[0])]
+        [([0, 1, 2], 3), ([3, 4, 5], 3)]
 
         """
+        components = self.components()
+        if len(components) == 0:
+            return
+        order = np.concatenate(components)
+        coords = self.coords.values[order]
+        starts = np.cumsum([0] + [c.shape[0] for c in components])
+        subs = (PointCloud(coords[start:stop], dist=self.dist, columnar=self.columnar)
+                for start, stop in zip(starts[:-1], starts[1:]))
+
+        if func is None:
+            results = subs
+        elif parallel:
+            import os
+            from concurrent.futures import ProcessPoolExecutor
+            workers = os.cpu_count() or 1
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                chunksize = max(1, len(components)//(4*workers))
+                for indices, result in zip(components, pool.map(func, subs, chunksize=chunksize)):
+                    yield indices, result
+            return
+        else:
+            results = map(func, subs)
 
-        from homology.dim0 import all_roots
-
-        roots = self.stratum[0]['rep'].values.copy()
-        all_roots(roots)
-
-        for i in np.where(self.stratum[0]['pos'].values == True)[0]:
-            yield np.where(roots == i)[0], PointCloud(self.coords.values[roots == i, :])
-
+        for indices, result in zip(components, results):
+            yield indices, result
 
     def make_pers1_rca1(self, cutoff=-1.0):
         r""" Run RCA1 and make a 1-dimensional `homology.PersDiag` for the
@@ -944,7 +1450,8 @@ class PointCloud(SimplicialComplex):
     """
 
     def __init__(self, data_array, max_length=0.0, heights=None, masses=None,
-                 dist='euclidean', idx0=None, cache_type=None):
+                 dist='euclidean', idx0=None, cache_type=None, columnar=False,
+                 cache_memory=2**28, cache_file=None):
         r""" Construct a :class:`PointCloud` from a cloud of n points in
         :math:`\mathbb{R}^k.`
 
@@ -977,15 +1484,43 @@ class PointCloud(SimplicialComplex):
             shape==(n,),
             Default: None (index by order given in data_array)
 
-        cache_type : None or "np" or "dict"
+        cache_type : None or "np" or "dict" or "lru" or "condensed"
             What type of distance cache to use.  Often None is actually faster!
             If you really care about speed, remember to use -O
-
-        dist : function
-            If dist is given, it is used as the distance function for computing
-            edge lengths, via scipy.spatial.distance.pdist.  Not used with on-demand caching.
+            The "lru" cache is a bounded "dict" cache that forgets the least
+            recently used distances; see cache_memory.
+            The "condensed" cache is like the "np" cache, but stores each
+            pair only once, in the layout of
+            :func:`scipy.spatial.distance.pdist`, so it uses half the memory.
+            It can be kept on disk; see cache_file.
+
+        cache_memory : int
+            Approximate memory budget in bytes for :code:`cache_type="lru"`.
+            Default: 2**28 (256MB)
+
+        cache_file : str
+            If given with :code:`cache_type="condensed"`, the cache is a
+            :class:`numpy.memmap` backed by this file, which is reused only
+            if it was made for the same coordinates and distance function.
+            Default: None (keep the cache in memory)
+
+        dist : str or :class:`multidim.fast_algorithms.Metric` or function
+            The distance function.  The names "euclidean", "cityblock" (or
+            "manhattan"), "chebyshev", "cosine" and "minkowski", or a
+            :class:`multidim.fast_algorithms.Metric` (for example, for
+            weighted Minkowski distance) use compiled kernels everywhere,
+            including the :class:`multidim.covertree.CoverTree`.  Any other
+            dist is only used for computing edge lengths, via
+            scipy.spatial.distance.pdist, and on-demand distances are
+            Euclidean.
             Default: 'euclidean'
 
+        columnar : bool
+            If True, store the strata as :class:`ArrayStratum` objects instead
+            of :class:`pandas.DataFrame` objects.  Recommended when
+            max_length gives many millions of edges.
+            Default: False
+
 
         """
         assert data_array.dtype == np.float64, "Data must be float64."
@@ -993,17 +1528,13 @@ class PointCloud(SimplicialComplex):
         self.dimension = k
 
         self.cache_type = cache_type
-        self.dist_cache = None
+        self.cache_memory = cache_memory
+        self.cache_file = cache_file
         self.dist = dist
-
-        if self.cache_type is None:
-            self.dist_cache = None
-        elif self.cache_type == "np":
-            self.dist_cache = np.eye(n, dtype=np.float64) - 1.0
-        elif self.cache_type == "dict":
-            self.dist_cache = dict(((i,i), np.float64(0.0)) for i in range(n))
-        else:
-            raise ValueError("cache_type can be None or 'dict' or 'np'")
+        self.metric = fast_algorithms.Metric.from_dist(dist)
+        if self.metric is not None:
+            self.metric.check(k)
+        self.dist_cache = self._make_dist_cache(data_array)
 
         if heights is None:
             heights = np.zeros(n, dtype=np.float64)
@@ -1034,20 +1565,19 @@ class PointCloud(SimplicialComplex):
                    and idx0.dtype == 'int64', \
                    "Wrong type or size for indexing data on pointcloud."
 
-        points = pd.DataFrame({
-            'height': hgt0,
-            'mass': mas0,
-            'pos': pos0,
-            'rep': idx0,
-        },
-                columns=['height', 'mass', 'pos', 'rep'],
-                index=idx0)
+        points = stratum_from_arrays(OrderedDict([
+            ('height', hgt0),
+            ('mass', mas0),
+            ('pos', pos0),
+            ('rep', idx0),
+        ]), index=idx0, columnar=columnar)
 
         self.coords = pd.DataFrame(data_array, index=idx0)
         self.covertree = None
 
-        edges = stratum_maker(1)
-        super(self.__class__, self).__init__(stratum={0: points, 1: edges})
+        edges = stratum_maker(1, columnar=columnar)
+        super(self.__class__, self).__init__(stratum={0: points, 1: edges},
+                                             columnar=columnar)
 
         self.labels = np.zeros(shape=(self.coords.shape[0],), dtype=np.int64)
         self.source = np.zeros(shape=(self.coords.shape[0],), dtype=np.int64)
@@ -1062,29 +1592,288 @@ class PointCloud(SimplicialComplex):
             # use covertree to make all appropriate edges.
             from . import covertree
             self.covertree = covertree.CoverTree(self)
-            bdy0 = []
-            bdy1 = []
-            hgts = []
-            for i, j, d in self.covertree.make_edges(max_distance=self.max_length):
-                bdy0.append(min(i,j))
-                bdy1.append(max(i,j))
-                hgts.append(d)
-            bdy0 = np.array(bdy0, dtype=np.int64)
-            bdy1 = np.array(bdy1, dtype=np.int64)
-            hgts = np.array(hgts)
+            blocks = list(self.covertree.make_edge_blocks(max_distance=self.max_length))
+            if blocks:
+                src, dst, hgts = [np.concatenate(b) for b in zip(*blocks)]
+            else:
+                src = dst = np.zeros(0, dtype=np.int64)
+                hgts = np.zeros(0, dtype=np.float64)
+            del blocks
+            bdy0 = np.minimum(src, dst)
+            bdy1 = np.maximum(src, dst)
+            del src, dst
             sortby = hgts.argsort()
             bdy0 = bdy0[sortby]
             bdy1 = bdy1[sortby]
             hgts = hgts[sortby]
 
-            edges = pd.DataFrame({'height': hgts,
-                                  'pos': np.ones(shape=hgts.shape, dtype='bool'),
-                                  'rep': np.arange(hgts.shape[0], dtype=np.int64),
-                                  'bdy0': bdy0, 'bdy1': bdy1, },
-                                 columns=['height', 'pos', 'rep', 'bdy0', 'bdy1'],
-                                 index=np.arange(hgts.shape[0], dtype=np.int64))
+            edges = stratum_from_arrays(OrderedDict([
+                ('height', hgts),
+                ('pos', np.ones(shape=hgts.shape, dtype='bool')),
+                ('rep', np.arange(hgts.shape[0], dtype=np.int64)),
+                ('bdy0', bdy0),
+                ('bdy1', bdy1),
+            ]), index=np.arange(hgts.shape[0], dtype=np.int64), columnar=columnar)
             self.stratum[1] = edges
 
+    def _make_dist_cache(self, cloud):
+        r""" Make an empty distance cache of type :code:`self.cache_type`
+        for the points with coordinates cloud. """
+        n = cloud.shape[0]
+        if self.cache_type is None:
+            return None
+        elif self.cache_type == "np":
+            return np.eye(n, dtype=np.float64) - 1.0
+        elif self.cache_type == "dict":
+            return dict(((i,i), np.float64(0.0)) for i in range(n))
+        elif self.cache_type == "lru":
+            return fast_algorithms.DistanceLRU(n, self.cache_memory)
+        elif self.cache_type == "condensed":
+            return fast_algorithms.make_condensed_cache(n, self.cache_file, cloud,
+                                                        self.metric or self.dist)
+        else:
+            raise ValueError("cache_type can be None or 'dict' or 'np' or 'lru' or 'condensed'")
+
+    def insert(self, data_array, heights=None, masses=None, labels=None,
+               edges=True):
+        r""" Append points to this :class:`PointCloud`.
+
+        If a :class:`multidim.covertree.CoverTree` has been built, the new
+        points are placed into its levels with
+        :func:`multidim.covertree.CoverTree.insert`, instead of rebuilding it.
+        If edges were computed with max_length, the edges of the new points
+        are found with the CoverTree and merged into the 1-stratum.
+
+        Parameters
+        ----------
+        data_array : :class:`numpy.ndarray`
+            A np array with shape=(m,k) and dtype=='float64', where k is
+            the dimension of the PointCloud.
+        heights : :class:`numpy.ndarray`
+            Heights of the new points, as in :func:`__init__`.
+            Default: None (all have height 0.0)
+        masses : :class:`numpy.ndarray`
+            Masses of the new points, as in :func:`__init__`.
+            Default: None (all have mass 1.0)
+        labels : :class:`numpy.ndarray`
+            Integer labels (see :code:`label_info['int_index']`) of the new
+            points, with dtype=='int64' and shape==(m,).
+            Default: None (all have label 0)
+        edges : bool
+            Whether to add the edges of the new points.  (Default: True)
+
+        Returns
+        -------
+        :class:`numpy.ndarray`
+            The indices of the new points, which follow the old ones.
+
+        Notes
+        -----
+        The new points form a new source.  The distance cache, the cached
+        nearest neighbors, the persistence diagrams and any strata above
+        dimension 1 are discarded.  The index must be range(N).
+
+        Examples
+        --------
+
+        >>> pc = PointCloud(np.array([[0.0, 0.0], [1.0, 0.0]]), max_length=1.5)
+        >>> pc.insert(np.array([[0.0, 1.0]])).tolist()
+        [2]
+        >>> pc.stratum[1][['bdy0', 'bdy1']].values.tolist()
+        [[0, 1], [0, 2], [1, 2]]
+        """
+        assert data_array.dtype == np.float64, "Data must be float64."
+        m, k = data_array.shape
+        assert k == self.dimension, "Wrong dimension for new points."
+        n = self.coords.shape[0]
+        assert np.all(self.coords.index.values == np.arange(n)),\
+            "Inserting requires the pointcloud index to be range(N)."
+        new = np.arange(n, n + m, dtype=np.int64)
+        if m == 0:
+            return new
+
+        if heights is None:
+            heights = np.zeros(m, dtype=np.float64)
+        if masses is None:
+            masses = np.ones(m, dtype=np.float64)
+        if labels is None:
+            labels = np.zeros(m, dtype=np.int64)
+        for values, dtype in [(heights, 'float64'), (masses, 'float64'),
+                              (labels, 'int64')]:
+            assert type(values) == np.ndarray \
+                   and values.shape == (m,) \
+                   and values.dtype == dtype, \
+                   "Wrong type or size for data on new points."
+
+        points = self.stratum[0]
+        self.stratum[0] = stratum_from_arrays(OrderedDict([
+            ('height', np.concatenate([points['height'].values, heights])),
+            ('mass', np.concatenate([points['mass'].values, masses])),
+            ('pos', np.ones(shape=(n + m,), dtype='bool')),
+            ('rep', np.arange(n + m, dtype=np.int64)),
+        ]), index=np.arange(n + m, dtype=np.int64), columnar=self.columnar)
+        self.coords = pd.DataFrame(np.concatenate([self.coords.values, data_array]),
+                                   index=np.arange(n + m, dtype=np.int64))
+
+        self.labels = np.concatenate([self.labels, labels])
+        self.source = np.concatenate([self.source,
+                                      np.repeat(self.source.max() + 1, m)])
+        num_labels = self.label_info.shape[0]
+        self.label_info['points'] += np.bincount(labels, minlength=num_labels)
+        for column in ['tot_mass', 'weight']:
+            if column in self.label_info.columns:
+                self.label_info[column] += np.bincount(labels, weights=masses,
+                                                       minlength=num_labels)
+        try:
+            self.multiplicity = np.concatenate([self.multiplicity,
+                                                np.ones(shape=(m,), dtype=np.int64)])
+        except AttributeError:
+            pass
+
+        self.dist_cache = self._make_dist_cache(self.coords.values)
+        self._nn = dict()
+        self._cellstratum = dict()
+        self.pers0 = None
+        self.pers1 = None
+        for dim in [d for d in self.stratum.keys() if d > 1]:
+            del self.stratum[dim]
+
+        if self.covertree is not None and not self.covertree._place(new):
+            self.covertree._rebuild()
+
+        if edges and (self.max_length > 0.0 or self.max_length == -1.0):
+            r = np.inf if self.max_length == -1.0 else self.max_length
+            found, dists = self.covertree.query_radius(data_array, r,
+                                                       return_distance=True)
+            src = np.repeat(new, [f.shape[0] for f in found])
+            dst = np.concatenate(found)
+            hgts = np.concatenate(dists)
+            keep = np.logical_and(dst < src, hgts > 0.0)
+            src, dst, hgts = src[keep], dst[keep], hgts[keep]
+
+            old_edges = self.stratum[1]
+            hgts = np.concatenate([old_edges['height'].values, hgts])
+            bdy0 = np.concatenate([old_edges['bdy0'].values, dst])
+            bdy1 = np.concatenate([old_edges['bdy1'].values, src])
+            sortby = hgts.argsort(kind='stable')
+            hgts = hgts[sortby]
+            self.stratum[1] = stratum_from_arrays(OrderedDict([
+                ('height', hgts),
+                ('pos', np.ones(shape=hgts.shape, dtype='bool')),
+                ('rep', np.arange(hgts.shape[0], dtype=np.int64)),
+                ('bdy0', bdy0[sortby]),
+                ('bdy1', bdy1[sortby]),
+            ]), index=np.arange(hgts.shape[0], dtype=np.int64), columnar=self.columnar)
+
+        return new
+
+    def remove(self, indices):
+        r""" Remove points from this :class:`PointCloud`.  The remaining
+        points are renumbered in order, so that the index is range(N).
+
+        If a :class:`multidim.covertree.CoverTree` has been built, the points
+        are taken out of it with :func:`multidim.covertree.CoverTree.remove`,
+        instead of rebuilding it.  The edges of the removed points are
+        removed from the 1-stratum.
+
+        Parameters
+        ----------
+        indices : :class:`numpy.ndarray`
+            The indices of the points to remove.
+
+        Returns
+        -------
+        :class:`numpy.ndarray`
+            The new index of each old point, or -1 if it was removed.
+
+        Notes
+        -----
+        The distance cache, the cached nearest neighbors, the persistence
+        diagrams and any strata above dimension 1 are discarded.  The index
+        must be range(N).
+
+        Examples
+        --------
+
+        >>> pc = PointCloud(np.array([[0.0, 0.0], [1.0, 0.0], [0.0, 1.0]]), max_length=1.5)
+        >>> pc.remove(np.array([0])).tolist()
+        [-1, 0, 1]
+        >>> pc.stratum[1][['bdy0', 'bdy1']].values.tolist()
+        [[0, 1]]
+        """
+        n = self.coords.shape[0]
+        assert np.all(self.coords.index.values == np.arange(n)),\
+            "Removing requires the pointcloud index to be range(N)."
+        indices = np.unique(np.asarray(indices, dtype=np.int64))
+        assert np.all(0 <= indices) and np.all(indices < n), "No such points."
+        if indices.shape[0] == n:
+            raise ValueError("Cannot remove all points.")
+        keep = np.ones(shape=(n,), dtype='bool')
+        keep[indices] = False
+        remap = -1*np.ones(shape=(n,), dtype=np.int64)
+        remap[keep] = np.arange(n - indices.shape[0], dtype=np.int64)
+        if indices.shape[0] == 0:
+            return remap
+
+        placed = self.covertree is None or \
+            self.covertree._unplace(indices)
+
+        num_labels = self.label_info.shape[0]
+        masses = self.stratum[0]['mass'].values
+        self.label_info['points'] -= np.bincount(self.labels[indices],
+                                                 minlength=num_labels)
+        for column in ['tot_mass', 'weight']:
+            if column in self.label_info.columns:
+                self.label_info[column] -= np.bincount(self.labels[indices],
+                                                       weights=masses[indices],
+                                                       minlength=num_labels)
+
+        points = self.stratum[0]
+        m = n - indices.shape[0]
+        self.stratum[0] = stratum_from_arrays(OrderedDict([
+            ('height', points['height'].values[keep]),
+            ('mass', masses[keep]),
+            ('pos', np.ones(shape=(m,), dtype='bool')),
+            ('rep', np.arange(m, dtype=np.int64)),
+        ]), index=np.arange(m, dtype=np.int64), columnar=self.columnar)
+        self.coords = pd.DataFrame(self.coords.values[keep],
+                                   index=np.arange(m, dtype=np.int64))
+        self.labels = self.labels[keep]
+        self.source = self.source[keep]
+        try:
+            self.multiplicity = self.multiplicity[keep]
+        except AttributeError:
+            pass
+
+        self.dist_cache = self._make_dist_cache(self.coords.values)
+        self._nn = dict()
+        self._cellstratum = dict()
+        self.pers0 = None
+        self.pers1 = None
+        for dim in [d for d in self.stratum.keys() if d > 1]:
+            del self.stratum[dim]
+
+        edges = self.stratum[1]
+        if len(edges) > 0:
+            bdy0 = edges['bdy0'].values
+            bdy1 = edges['bdy1'].values
+            good = np.logical_and(keep[bdy0], keep[bdy1])
+            hgts = edges['height'].values[good]
+            self.stratum[1] = stratum_from_arrays(OrderedDict([
+                ('height', hgts),
+                ('pos', np.ones(shape=hgts.shape, dtype='bool')),
+                ('rep', np.arange(hgts.shape[0], dtype=np.int64)),
+                ('bdy0', remap[bdy0[good]]),
+                ('bdy1', remap[bdy1[good]]),
+            ]), index=np.arange(hgts.shape[0], dtype=np.int64), columnar=self.columnar)
+
+        if self.covertree is not None:
+            if placed:
+                self.covertree._compact(keep)
+            else:
+                self.covertree._rebuild()
+        return remap
+
     @classmethod
     def from_distances(cls, *args, **kwargs):
         r"""
@@ -1266,20 +2055,60 @@ class PointCloud(SimplicialComplex):
         """
         return fast_algorithms.gaussian_fit(self.coords.values, center)
 
-    def cache_usage(self):
+    def cache_usage(self, stats=False):
         r""" Compute the size of the distance cache.  That is, what
-        fraction of distances have we computed so far? """
+        fraction of distances have we computed so far?
+
+        Parameters
+        ----------
+        stats : bool
+            If True, return a dict with the fraction as 'usage', along with
+            the 'entries' held, and for :code:`cache_type="lru"`, the
+            'capacity' and the 'hits', 'misses' and 'evictions' counters.
+            Default: False
+
+        Examples
+        --------
+
+        >>> pc = PointCloud(np.random.rand(10, 2), cache_type="lru")
+        >>> D = pc.dists(np.arange(10), np.arange(10))
+        >>> D = pc.dists(np.array([0]), np.array([1, 2]))
+        >>> pc.cache_usage()
+        1.0
+        >>> s = pc.cache_usage(stats=True)
+        >>> s['entries'], s['hits'], s['misses'], s['evictions']
+        (45, 47, 45, 0)
+        >>> pc = PointCloud(np.random.rand(10, 2), cache_type="condensed")
+        >>> D = pc.dists(np.array([0, 1]), np.arange(10))
+        >>> pc.cache_usage(stats=True)['entries']
+        17
+        """
         n = self.coords.values.shape[0]
         n_choose_2 = 0.5*n*(n-1)
 
+        info = {'usage': 0.0, 'entries': 0}
         if self.cache_type is None:
-            return 0.0
+            pass
         elif self.cache_type == "np":
             computed = np.count_nonzero(self.dist_cache >= 0)
-            return (computed - n)/n_choose_2
+            info['entries'] = computed - n
         elif self.cache_type == "dict":
             computed = len(self.dist_cache)
-            return (computed - n)/n_choose_2
+            info['entries'] = computed - n
+        elif self.cache_type == "lru":
+            info['entries'] = len(self.dist_cache)
+            info['capacity'] = self.dist_cache.capacity
+            info['hits'] = self.dist_cache.hits
+            info['misses'] = self.dist_cache.misses
+            info['evictions'] = self.dist_cache.evictions
+        elif self.cache_type == "condensed":
+            info['entries'] = np.count_nonzero(self.dist_cache >= 0)
+        if n_choose_2 > 0:
+            info['usage'] = info['entries']/n_choose_2
+
+        if stats:
+            return info
+        return info['usage']
 
     def nearest_neighbors_slow(self, k):
         r""" Compute k nearest-neighbors of the PointCloud, by brute-force.
@@ -1349,6 +2178,10 @@ class PointCloud(SimplicialComplex):
         r""" Compute k nearest-neighbors of the PointCloud, using a clever CoverTree algorithm.
         Answers are cached in `self._nn[k]`
 
+        All points are queried in batches with
+        :func:`multidim.covertree.CoverTree.query`, which descends the tree
+        with compiled distance kernels and bounded heaps.
+
         Parameters
         ----------
         k: int
@@ -1402,38 +2235,22 @@ class PointCloud(SimplicialComplex):
 
         num_points = self.coords.shape[0]
 
-        # -1 means "not found yet"
-        self._nn[k] = -np.ones(shape=(num_points, k+1), dtype=np.int64)
-
-        # Make sure we have the entire covertree.
-        levels = [ level for level in self.covertree ]
-
-        # run backwards:
-        for level in reversed(levels):
-            r = level.radius
-            for ci in level.adults:
-                for x in level.children[ci]:
-                    unknown_neighbors = np.where(self._nn[k][x] < 0)[0]
-                    if len(unknown_neighbors) > 0:
-                        to_find = unknown_neighbors[0]
-
-                        candidates = []
-                        for cj in level.friends1[ci]:
-                            candidates.extend(level.children[cj])
-                        candidates = np.array(candidates)
-
-                        num_found = min(k+1, len(candidates))
-
-                        # don't bother computing lengths if there is nothing to
-                        # learn
-                        if num_found >= to_find:
-
-                            dists = fast_algorithms.distance_cache_None(
-                                        np.array([x]), candidates,
-                                        self.coords.values).flatten()
-                            order = dists.argsort()
-                            self._nn[k][x, to_find:num_found] = candidates[order][to_find:num_found]
-
+        # Every point is its own nearest neighbor, so ask for k+1.  The
+        # queries descend the tree in compiled batches; see CoverTree.query
+        dists, nn = self.covertree.query(self.coords.values, min(k+1, num_points))
+        if nn.shape[1] < k+1:
+            nn = np.hstack([nn, -np.ones(shape=(num_points, k+1-nn.shape[1]),
+                                         dtype=np.int64)])
+
+        # Duplicate points tie at distance 0, so put each point itself first.
+        rows = np.arange(num_points, dtype=np.int64)
+        is_self = nn == rows[:, np.newaxis]
+        nn = np.take_along_axis(nn, np.argsort(~is_self, axis=1, kind='stable'), axis=1)
+        lost = ~is_self.any(axis=1)
+        nn[lost, 1:] = nn[lost, :-1]
+        nn[lost, 0] = rows[lost]
+
+        self._nn[k] = nn
         return self._nn[k]
 
 #
@@ -1442,16 +2259,28 @@ class PointCloud(SimplicialComplex):
 #        self._nn[k] = dists.argsort(axis=1)[:, :k+1]  # 0th entry is always self.
 #        return self._nn[k]
 
-    def witnessed_barycenters(self, k):
+    def witnessed_barycenters(self, k, cutoff=-1.0):
         r""" Build the PointCloud of k-witnessed barycenters, weighted by
         distance-to-measure. This calls :func:`nearest_neighbors` with argument
-        :code:`(k-1)`, which can be slow.
+        :code:`(k-1)`.
+
+        The barycenter of each distinct set of k nearest neighbors has weight
+        :math:`w = -\frac{1}{k}\sum_i |x_i - b|^2` and height
+        :math:`\sqrt{-w}`.  The edge between barycenters at distance
+        :math:`\mu` with weights :math:`w_i, w_j` has height
+        :math:`\sqrt{\mu^2(\mu^2 - 2w_i - 2w_j) + (w_i - w_j)^2}/(2\mu)`,
+        which is at least :math:`\mu/2`.  So, edges up to a cutoff are found
+        with the :class:`multidim.covertree.CoverTree` of the barycenters,
+        among those of length at most twice the cutoff.
 
         Parameters
         ----------
         k : int
             How many vertices for each witnessed barycenter.  That is, use
             the (k-1) nearest neighbors, along with the vertex itself.
+        cutoff : float
+            If :code:`cutoff >= 0`, store only those edges of height at most
+            cutoff.  Default: -1, store all edges.
 
         Returns
         -------
@@ -1459,79 +2288,274 @@ class PointCloud(SimplicialComplex):
             A pointcloud whose 0-cells are the witnessed barycenters, and
             whose 1-cells are the edges between
             those barycenters, all weighted by the notion of distance to a
-            measure.
-        """
+            measure.  The edges are sorted by height.
 
-        n, d = self.coords.values.shape
+        Examples
+        --------
 
+        >>> pc = PointCloud(np.array([[0., 0.], [1., 0.], [1., 1.], [0., 1.]]))
+        >>> wb = pc.witnessed_barycenters(3)
+        >>> np.round(wb.stratum[0]['height'].values, 4).tolist()
+        [0.6667, 0.6667, 0.6667, 0.6667]
+        >>> np.round(wb.stratum[1]['height'].values, 4).tolist()
+        [0.6872, 0.6872, 0.6872, 0.6872, 0.7071, 0.7071]
+        >>> pc.witnessed_barycenters(3, cutoff=0.7)
+        A SimplicialComplex with 4 points, 4 edges, and 0 faces.
+        """
         # First, look at the indices to uniqify
-        polygons_indices = [tuple(np.sort(verts)) for verts in self.nearest_neighbors(k-1)]
-        polygons_indices = np.array(list(set(polygons_indices)))
-
-        p = polygons_indices.shape[0]
-        assert p <= n
-
-        # build the polygons from coordinates
-        polygons = []
-        for points in polygons_indices:
-            polygons.append(self.coords.values[points, :])
-        polygons = np.array(polygons)
-
-        # Find the vertex barycenters
-        assert polygons.shape == (p, k, d)
-        polygons = polygons.swapaxes(0, 1)
-        assert polygons.shape == (k, p, d)
-        barycenters = polygons.mean(axis=0)
-        assert barycenters.shape == (p, d)
-
-        # compute weights
-        diffs = polygons - barycenters
-        assert diffs.shape == (k, p, d)
-        norms = np.linalg.norm(diffs, axis=2)**2
-        assert norms.shape == (k, p)
-        weights = -norms.sum(axis=0)/k
-        assert weights.shape == (p,)
+        polygons_indices = np.unique(np.sort(self.nearest_neighbors(k-1), axis=1), axis=0)
+
+        # Find the vertex barycenters and their weights
+        polygons = self.coords.values[polygons_indices]
+        barycenters = polygons.mean(axis=1)
+        norms = ((polygons - barycenters[:, np.newaxis, :])**2).sum(axis=2)
+        weights = -norms.sum(axis=1)/k
+
+        # Edges of height <= cutoff have length <= 2*cutoff
         pcbc = PointCloud(barycenters,
                           heights=np.sqrt(-weights),
-                          dist=self.dist)
-        pcbc.dists = squareform(pdist(pcbc.coords.values, pcbc.dist))
-
-        # make edges
-        hgt = []
-        pos = []
-        idx = []
-        bdy0 = []
-        bdy1 = []
-        for e, (i, j) in enumerate(itertools.combinations(pcbc.stratum[0].index.values, 2)):
-            idx.append(e)
-            bdy0.append(i)
-            bdy1.append(j)
-            pos.append(True)
-            mu = pcbc.dists[i, j]
-            wi = weights[i]
-            wj = weights[j]
-            r = np.sqrt(mu**2*(mu**2 - 2*wi - 2*wj) + (wi - wj)**2)/2/mu
-            hgt.append(r)
-
-        edges = pd.DataFrame({
-            'height': hgt,
-            'pos': pos,
-            'rep': idx,
-            'bdy0': bdy0,
-            'bdy1': bdy1,
-            },
-                columns=['height', 'pos', 'rep', 'bdy0', 'bdy1'],
-                index=idx)
-        pcbc.stratum[1] = edges
+                          dist=self.dist,
+                          max_length=2.0*cutoff if cutoff >= 0.0 else -1.0,
+                          columnar=self.columnar)
+
+        # re-weight the edges
+        edges = pcbc.stratum[1]
+        mu = edges['height'].values
+        wi = weights[edges['bdy0'].values]
+        wj = weights[edges['bdy1'].values]
+        hgts = np.sqrt(mu**2*(mu**2 - 2*wi - 2*wj) + (wi - wj)**2)/2/mu
+
+        keep = hgts <= cutoff if cutoff >= 0.0 else np.ones(hgts.shape, dtype='bool')
+        sortby = np.flatnonzero(keep)[hgts[keep].argsort(kind='stable')]
+        hgts = hgts[sortby]
+        pcbc.stratum[1] = stratum_from_arrays(OrderedDict([
+            ('height', hgts),
+            ('pos', np.ones(shape=hgts.shape, dtype='bool')),
+            ('rep', np.arange(hgts.shape[0], dtype=np.int64)),
+            ('bdy0', edges['bdy0'].values[sortby]),
+            ('bdy1', edges['bdy1'].values[sortby]),
+        ]), index=np.arange(hgts.shape[0], dtype=np.int64), columnar=self.columnar)
+        pcbc.max_length = cutoff
         return pcbc
 
-    def unique_with_multiplicity(self):
+    def landmarks(self, n=None, level=None):
+        r""" Choose a well-spread subset of the points, from the levels of
+        the :class:`multidim.covertree.CoverTree` (which is built if needed).
+
+        The adults of each level are separated by its radius and cover all
+        points within it, so they form a net.  Points are taken in the order
+        that they are born in the tree, so the first n landmarks are the
+        adults of the coarsest level that has at least n adults, and then
+        some of those born at the next level.
+
+        Parameters
+        ----------
+        n : int
+            How many landmarks to take.  If there are fewer distinct points,
+            they are all returned.
+        level : int
+            Instead of n, take all adults of this level.
+
+        Returns
+        -------
+        :class:`numpy.ndarray` of indices of points.
+
+        See Also
+        --------
+        :func:`witness_complex`
+
+        Examples
+        --------
+
+        >>> pc = PointCloud(np.array([[0.0, 0.0], [0.1, 0.0], [4.0, 0.0],
+        ...                           [0.0, 4.0], [4.0, 4.1], [4.0, 4.0]]))
+        >>> sorted(pc.landmarks(4).tolist())
+        [1, 2, 3, 5]
+        """
+        from . import covertree
+
+        if (n is None) == (level is None):
+            raise ValueError("Give exactly one of n and level.")
+        if self.covertree is None:
+            self.covertree = covertree.CoverTree(self)
+        ct = self.covertree
+
+        if level is not None:
+            return np.array(ct[level].adults, dtype=np.int64)
+
+        num_adults = 0
+        for cl in ct:
+            num_adults = len(cl.adults)
+            if num_adults >= n:
+                break
+        return ct._born[:min(n, num_adults)].copy()
+
+    def witness_complex(self, landmarks, k=3, nu=2):
+        r""" Build the lazy witness complex [WIT]_ on some landmarks, with
+        every point as a witness.
+
+        Each point w finds its k nearest landmarks with a
+        :class:`multidim.covertree.CoverTree` on the landmarks.  For each
+        pair a, b of them, it witnesses the edge [a, b] at height
+        :math:`\max(d(a,w), d(b,w)) - m_\nu(w)`, where :math:`m_\nu(w)` is
+        the distance from w to its nu-th nearest landmark (:math:`m_0 = 0`).
+        Each edge gets the least height over its witnesses.
+
+        Parameters
+        ----------
+        landmarks : int or :class:`numpy.ndarray`
+            The indices of the landmarks, or how many to take with
+            :func:`landmarks`.
+        k : int
+            How many nearest landmarks each point witnesses.  Like
+            max_length for a :class:`PointCloud`, this limits the scale of
+            the edges, so features larger than that scale never die.  Use
+            k equal to the number of landmarks for the full complex.
+            (Default: 3)
+        nu : int
+            0, 1 or 2.  (Default: 2)
+
+        Returns
+        -------
+        :class:`PointCloud` of the landmarks, whose masses are the total
+        masses of the points nearest to each one, and whose 1-stratum holds
+        the witnessed edges, sorted by height.  Use
+        :func:`SimplicialComplex.make_pers0` and
+        :func:`SimplicialComplex.make_pers1_rca1` on it as usual.
+
+        Examples
+        --------
+
+        >>> t = np.linspace(0, 2*np.pi, 400, endpoint=False)
+        >>> pc = PointCloud(np.stack([np.cos(t), np.sin(t)], axis=1))
+        >>> pc.witness_complex(40)
+        A SimplicialComplex with 40 points, 80 edges, and 0 faces.
+        >>> wc = pc.witness_complex(40, k=40)
+        >>> wc.make_pers1_rca1()
+        >>> np.round(wc.pers1.diagram[['birth', 'death']].values, 4).tolist()
+        [[0.0, 0.8389]]
+
+        References
+        ----------
+        .. [WIT] V. de Silva and G. Carlsson, Topological estimation using
+           witness complexes, Symposium on Point-Based Graphics (2004)
+        """
+        from . import covertree
+
+        if nu not in (0, 1, 2):
+            raise ValueError("nu must be 0, 1 or 2.")
+        if np.ndim(landmarks) == 0:
+            landmarks = self.landmarks(int(landmarks))
+        landmarks = np.asarray(landmarks, dtype=np.int64)
+        L = landmarks.shape[0]
+        k = min(k, L)
+        if k < max(nu, 2):
+            raise ValueError("Need k >= max(nu, 2) and at least 2 landmarks.")
+
+        sub = PointCloud(self.coords.values[landmarks], dist=self.dist,
+                         columnar=self.columnar)
+        dists, near = covertree.CoverTree(sub).query(self.coords.values, k)
+
+        masses = np.bincount(near[:, 0], weights=self.stratum[0]['mass'].values,
+                             minlength=L)
+        sub.stratum[0]['mass'] = masses
+        sub.label_info['tot_mass'] = np.array([masses.sum()])
+
+        if nu == 0:
+            m_nu = np.zeros(shape=(dists.shape[0], 1), dtype=np.float64)
+        else:
+            m_nu = dists[:, nu - 1:nu]
+
+        def shortest(keys, hgts):
+            order = np.lexsort((hgts, keys))
+            keys = keys[order]
+            first = np.ones(shape=keys.shape, dtype='bool')
+            first[1:] = keys[1:] != keys[:-1]
+            return keys[first], hgts[order][first]
+
+        i, j = np.triu_indices(k, 1)
+        keys = []
+        hgts = []
+        for start in range(0, dists.shape[0], covertree.query_batch_size):
+            stop = start + covertree.query_batch_size
+            a = near[start:stop, i]
+            b = near[start:stop, j]
+            h = np.maximum(dists[start:stop, i], dists[start:stop, j]) - m_nu[start:stop]
+            key, hgt = shortest((np.minimum(a, b)*L + np.maximum(a, b)).ravel(), h.ravel())
+            keys.append(key)
+            hgts.append(hgt)
+        keys, hgts = shortest(np.concatenate(keys), np.concatenate(hgts))
+
+        sortby = hgts.argsort(kind='stable')
+        hgts = hgts[sortby]
+        keys = keys[sortby]
+        sub.stratum[1] = stratum_from_arrays(OrderedDict([
+            ('height', hgts),
+            ('pos', np.ones(shape=hgts.shape, dtype='bool')),
+            ('rep', np.arange(hgts.shape[0], dtype=np.int64)),
+            ('bdy0', keys // L),
+            ('bdy1', keys % L),
+        ]), index=np.arange(hgts.shape[0], dtype=np.int64), columnar=self.columnar)
+        return sub
+
+    def _duplicate_groups(self, epsilon=0.0, by_label=False):
+        r""" Group the points that are equal, or within epsilon of the same
+        adult of the :class:`multidim.covertree.CoverTree`.
+
+        Returns
+        -------
+        rep, inverse : :class:`numpy.ndarray`
+            rep[g] is the index of the point whose coordinates stand for group
+            g, and inverse[i] is the group of point i.  Groups are numbered in
+            order of their first point.
+        """
+        from . import covertree
+
+        if epsilon > 0.0:
+            if self.covertree is None:
+                self.covertree = covertree.CoverTree(self)
+            for cl in self.covertree:
+                if cl.radius <= epsilon:
+                    break
+            keys = [np.asarray(cl.guardians, dtype=np.float64)[:, np.newaxis]]
+        else:
+            keys = [self.coords.values]
+        if by_label:
+            keys.extend([self.source[:, np.newaxis], self.labels[:, np.newaxis]])
+
+        _, first, inverse = np.unique(np.hstack(keys), axis=0,
+                                      return_index=True, return_inverse=True)
+        order = np.argsort(first)
+        rank = np.empty_like(order)
+        rank[order] = np.arange(order.shape[0])
+        rep = first[order]
+        if epsilon > 0.0:
+            rep = cl.guardians[rep]
+        return rep, rank[inverse.ravel()]
+
+    def unique_with_multiplicity(self, epsilon=0.0):
         r"""
-        Look for duplicate points, and mark their multiplicity.
-        This sets self.multiplicity
+        Look for duplicate points, and count their multiplicity.
 
+        Exact duplicates are found by sorting the rows, in any dimension.
+        If epsilon is positive, points are merged into the adults of the first
+        level of the :class:`multidim.covertree.CoverTree` whose radius is at
+        most epsilon, so every point is within epsilon of its representative.
 
-        ToDo:  Use Covertree.
+        Parameters
+        ----------
+        epsilon : float
+            Merge distance.  (Default: 0.0, exact duplicates only)
+
+        Returns
+        -------
+        coords, counts : :class:`numpy.ndarray`
+            The distinct points (sorted, if epsilon is 0), and how many points
+            each one stands for.
+
+        See Also
+        --------
+        :func:`deduplicate`
 
         Examples
         --------
@@ -1545,28 +2569,62 @@ class PointCloud(SimplicialComplex):
         >>> print(counts)
         [1 2]
         """
+        if epsilon > 0.0:
+            rep, inverse = self._duplicate_groups(epsilon)
+            return self.coords.values[rep], np.bincount(inverse)
+        return np.unique(self.coords.values, axis=0, return_counts=True)
 
-        coords = self.coords.values
-        assert coords.shape[1] == 2,\
-            "This uniqifying method can use only 2-dim data"
-
-        s = coords.shape
-        assert coords.dtype == 'float64'
-        coords.dtype = 'complex128'
-        tmp_coords, tmp_index, tmp_inverse, tmp_counts = np.unique(
-            coords.flatten(),
-            return_index=True,
-            return_inverse=True,
-            return_counts=True)
-        tmp_coords.dtype = 'float64'
-        coords.dtype = 'float64'
-        assert coords.shape == s
-        n = tmp_coords.shape[0]
-        d = coords.shape[1]
-        assert n % d == 0
-        tmp_coords.shape = (n//d, d)
-
-        return tmp_coords, tmp_counts
+    def deduplicate(self, epsilon=0.0):
+        r""" Make a smaller :class:`PointCloud` with one point for each set of
+        duplicates, as in :func:`unique_with_multiplicity`.
+
+        Points are only merged with points of the same label and source.
+        Each merged point keeps the coordinates of its representative, the
+        least height, and the total mass of its group, so that
+        :code:`label_info` keeps its masses.  Its label and source are
+        unchanged, and :code:`label_info['points']` is recounted.
+
+        Parameters
+        ----------
+        epsilon : float
+            Merge distance.  (Default: 0.0, exact duplicates only)
+
+        Returns
+        -------
+        pc, inverse, counts
+            The new :class:`PointCloud`, the index in pc of each point of
+            self, and how many points of self each point of pc stands for.
+
+        Examples
+        --------
+
+        >>> a = np.array([[5.0, 2.0, 1.0], [3.0, 4.0, 1.0], [5.0, 2.0, 1.0],
+        ...               [3.0, 4.0, 1.01]])
+        >>> pc, inverse, counts = PointCloud(a).deduplicate()
+        >>> inverse.tolist(), counts.tolist()
+        ([0, 1, 0, 2], [2, 1, 1])
+        >>> pc.stratum[0]['mass'].values.tolist()
+        [2.0, 1.0, 1.0]
+        >>> pc, inverse, counts = PointCloud(a).deduplicate(epsilon=0.1)
+        >>> inverse.tolist(), counts.tolist()
+        ([0, 1, 0, 1], [2, 2])
+        """
+        rep, inverse = self._duplicate_groups(epsilon, by_label=True)
+        counts = np.bincount(inverse)
+        first = np.empty_like(rep)
+        first[inverse[::-1]] = np.arange(inverse.shape[0])[::-1]
+
+        heights = np.full(rep.shape, np.inf)
+        np.minimum.at(heights, inverse, self.stratum[0]['height'].values)
+        masses = np.bincount(inverse, weights=self.stratum[0]['mass'].values)
+        pc = PointCloud(self.coords.values[rep], heights=heights, masses=masses,
+                        dist=self.dist, cache_type=self.cache_type,
+                        columnar=self.columnar)
+        pc.labels = self.labels[first]
+        pc.source = self.source[first]
+        pc.label_info = self.label_info.copy()
+        pc.label_info['points'] = np.bincount(pc.labels, minlength=len(pc.label_info))
+        return pc, inverse, counts
 
     def dists(self, indices0, indices1):
         r""" Compute distances points indices0 and indices1.
@@ -1588,7 +2646,8 @@ class PointCloud(SimplicialComplex):
         if self.cache_type is None:
             return fast_algorithms.distance_cache_None(indices0,
                                                        indices1,
-                                                       self.coords.values)
+                                                       self.coords.values,
+                                                       self.metric)
         elif self.cache_type == "np":
             N = self.coords.values.shape[0]
             if self.dist_cache is None or self.dist_cache.shape != (N, N):
@@ -1596,7 +2655,8 @@ class PointCloud(SimplicialComplex):
             return fast_algorithms.distance_cache_numpy(indices0,
                                                      indices1,
                                                      self.coords.values,
-                                                     self.dist_cache)
+                                                     self.dist_cache,
+                                                     self.metric)
         elif self.cache_type == "dict":
             N = self.coords.values.shape[0]
             if self.dist_cache is None:
@@ -1604,9 +2664,28 @@ class PointCloud(SimplicialComplex):
             return fast_algorithms.distance_cache_dict(indices0,
                                                        indices1,
                                                        self.coords.values,
-                                                       self.dist_cache)
+                                                       self.dist_cache,
+                                                       self.metric)
+        elif self.cache_type == "lru":
+            N = self.coords.values.shape[0]
+            if self.dist_cache is None or self.dist_cache.N != N:
+                self.dist_cache = fast_algorithms.DistanceLRU(N, self.cache_memory)
+            return fast_algorithms.distance_cache_lru(indices0,
+                                                      indices1,
+                                                      self.coords.values,
+                                                      self.dist_cache,
+                                                      self.metric)
+        elif self.cache_type == "condensed":
+            N = self.coords.values.shape[0]
+            if self.dist_cache is None or self.dist_cache.shape != (N*(N-1)//2,):
+                self.dist_cache = self._make_dist_cache(self.coords.values)
+            return fast_algorithms.distance_cache_condensed(indices0,
+                                                            indices1,
+                                                            self.coords.values,
+                                                            self.dist_cache,
+                                                            self.metric)
         else:
-            raise ValueError("cache_type can be None or 'dict' or 'np'")
+            raise ValueError("cache_type can be None or 'dict' or 'np' or 'lru' or 'condensed'")
 
     def cover_ball(self, point_index=None):
         r""" Find a ball that covers the entire PointCloud.
@@ -1629,7 +2708,10 @@ class PointCloud(SimplicialComplex):
         if point_index is None:
             center = self.coords.values.mean(axis=0)
             center.shape = (1, center.shape[0])  # re-shape for cdist
-            center_dists = cdist(self.coords.values, center, metric=self.dist)
+            if self.metric is not None:
+                center_dists = self.metric.cdist(self.coords.values, center)
+            else:
+                center_dists = cdist(self.coords.values, center, metric=self.dist)
             point_index = center_dists.argmin()
 
         point = np.array([point_index])
@@ -1648,14 +2730,17 @@ class PointCloud(SimplicialComplex):
         Parameters
         ----------
         list_of_samples :
-            A list (or np array) of np arrays.  Each such array is
-            considered to be a sample of N points in R^d.  N can vary between
-            entries, but d cannot.
+            A list (or np array, or iterator) of np arrays.  Each such array
+            is considered to be a sample of N points in R^d.  N can vary
+            between entries, but d cannot.  An iterator, such as a generator
+            that loads the samples from disk, is consumed once, and only the
+            merged array is kept.
 
         list_of_labels :
-            A list of labels.  Labels can be anything, but it is covenient to
-            use strings like "red" and "blue".    list_of_labels[i] is the
-            label for the points in list_of_samples[i].
+            A list (or iterator) of labels.  Labels can be anything sortable,
+            but it is covenient to use strings like "red" and "blue".
+            list_of_labels[i] is the label for the points in
+            list_of_samples[i].
 
         equal_priors:
             Re-normalize weights so that each label is equally likely.
@@ -1667,57 +2752,65 @@ class PointCloud(SimplicialComplex):
             Default: False
 
         """
-        assert len(list_of_labels) == len(list_of_samples),\
-            "list_of_labels must equal list_of arrays. {} != {}".format(
-                len(list_of_labels), len(list_of_samples))
+        list_of_labels = list(list_of_labels)
 
-        ambient_dim = list_of_samples[0].shape[1]
-        assert all([X.shape[1] == ambient_dim for X in list_of_samples]),\
-            "Dimension mismatch among list_of_samples!"
+        # Copy the samples into one array as they arrive, so that an iterator
+        # streaming from disk is never held in memory twice.  If the samples
+        # are a sequence, the array is allocated once.
+        if hasattr(list_of_samples, '__len__'):
+            total = sum(X.shape[0] for X in list_of_samples)
+        else:
+            total = None
+        points = None
+        sizes = []
+        stop = 0
+        for X in list_of_samples:
+            X = np.asarray(X, dtype=np.float64)
+            num = X.shape[0]
+            assert num > 0, "bad? {}".format(X.shape)
+            if points is None:
+                points = np.empty(shape=(total or num, X.shape[1]), dtype=np.float64)
+            assert X.shape[1] == points.shape[1],\
+                "Dimension mismatch among list_of_samples!"
+            if stop + num > points.shape[0]:
+                points.resize((max(2*points.shape[0], stop + num), points.shape[1]),
+                              refcheck=False)
+            points[stop:stop + num] = X
+            stop += num
+            sizes.append(num)
+        assert points is not None, "No samples!"
+        points.resize((stop, points.shape[1]), refcheck=False)
+        sizes = np.array(sizes, dtype=np.int64)
+
+        assert len(list_of_labels) == sizes.shape[0],\
+            "list_of_labels must equal list_of arrays. {} != {}".format(
+                len(list_of_labels), sizes.shape[0])
 
-        label_info = pd.DataFrame(index=sorted(list(set(list(list_of_labels)))))
+        label_info = pd.DataFrame(index=sorted(set(list_of_labels)))
         # ['blue', 'green', 'red']
-        # label_names = list(label_dict.keys())
-        # label_index = np.array
-        # num_labels = len(label_dict)
+        int_index = dict(zip(label_info.index, range(len(label_info))))
+        codes = np.array([int_index[l] for l in list_of_labels], dtype=np.int64)
 
         # count how many times each label occurs.
-        label_info['clouds'] = np.zeros(shape = (len(label_info),), dtype=np.int64)
-        label_info['points'] = np.zeros(shape = (len(label_info),), dtype=np.int64)
-        label_info['weight'] = np.zeros(shape = (len(label_info),), dtype=np.float64)
-        for label in label_info.index:
-            label_bool = np.array([l == label for l in list_of_labels])
-            label_info.loc[label, 'clouds'] = np.count_nonzero(label_bool)
-        label_info['int_index'] = label_info.index.get_indexer(label_info.index)
-
-        # merge the samples into one big dataset
-        # expand the sample-wise labels to point-wise labels
-        points = np.concatenate(list(list_of_samples))
+        num_labels = len(label_info)
+        clouds = np.bincount(codes, minlength=num_labels)
+        if equal_priors:
+            sample_weight = 1.0/sizes/clouds[codes]
+        else:
+            sample_weight = np.ones(shape=sizes.shape, dtype=np.float64)
+        label_info['clouds'] = clouds
+        label_info['points'] = np.bincount(codes, weights=sizes, minlength=num_labels).astype(np.int64)
+        label_info['weight'] = np.bincount(codes, weights=sample_weight*sizes, minlength=num_labels)
+        label_info['int_index'] = np.arange(num_labels, dtype=np.int64)
 
         if normalize_domain:
             m,s,v = fast_algorithms.gaussian_fit(points)
             points = np.dot((points - m), v.T)/s
 
-        pointwise_labels = []  # keep track of labels, pointwise
-        pointwise_source = []
-        pointwise_weight = []
-        for i, X in enumerate(list_of_samples):
-            l = list_of_labels[i]
-            num = X.shape[0]
-            assert num > 0, "bad? {}".format(X.shape)
-            pointwise_labels.extend([label_info['int_index'].loc[l]]*num)
-            pointwise_source.extend([i]*num)
-            if equal_priors:
-                wt = 1.0/num/label_info.loc[l, 'clouds']
-            else:
-                wt = 1.0
-            pointwise_weight.extend([wt]*num)
-            label_info.loc[l, 'points'] = np.int64(label_info.loc[l, 'points']) + np.int64(num)
-            label_info.loc[l, 'weight'] += wt*num
-
-        pointwise_labels = np.array(pointwise_labels)
-        pointwise_source = np.array(pointwise_source)
-        pointwise_weight = np.array(pointwise_weight)
+        # expand the sample-wise labels to point-wise labels
+        pointwise_labels = np.repeat(codes, sizes)
+        pointwise_source = np.repeat(np.arange(sizes.shape[0], dtype=np.int64), sizes)
+        pointwise_weight = np.repeat(sample_weight, sizes)
 
         pc = cls(points, masses=pointwise_weight)
         pc.label_info = label_info
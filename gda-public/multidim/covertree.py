@@ -4,10 +4,17 @@ friends" algorithm, namely:
     - :class:`CoverTree`
     - :class:`CoverLevel`
 
+and the compact containers used by :class:`CoverLevel`
+
+    - :class:`PackedRelation`
+    - :class:`PackedValues`
+
 This module also defines the constants
 
     - :code:`ratio_Ag` :math:`=\sqrt{2} - 1=0.414\ldots`, the inverse of the silver ratio
     - :code:`ratio_Au` :math:`=\frac{\sqrt{5} - 1}{2}=0.618\ldots`, the inverse of the golden ratio
+    - :code:`query_batch_size`, the number of query points that descend the
+      tree together in :func:`CoverTree.query` and :func:`CoverTree.query_radius`
 
 Copyright
 ---------
@@ -18,21 +25,31 @@ Copyright
 
 from __future__ import print_function
 
-from copy import deepcopy
 import numpy as np
 import pandas as pd
-from . import PointCloud
+from . import PointCloud, stratum_from_arrays
 from . import fast_algorithms
 
 from scipy.spatial.distance import cdist, pdist, squareform
 
 from collections import OrderedDict
+try:
+    from collections.abc import Mapping
+except ImportError:  # Python 2
+    from collections import Mapping
 
 import collections
 import logging
+import os
 
 ratio_Ag = np.float64(0.41421356237309504880168872420969807857)  
 ratio_Au = np.float64(0.61803398874989484820458683436563811772)
+
+# Number of query points that descend the tree together in CoverTree.query
+query_batch_size = 8192
+
+# Version of the file layout written by CoverTree.save
+_save_format = 1
 assert ratio_Ag**2 + 2*ratio_Ag == np.float64(1.0),\
     """pre-defined ratio_Ag does not match artithmetic.
     Try using some form of sqrt(2) - 1, which is the positive root of x**2 + 2*x == 1."""
@@ -74,6 +91,12 @@ class CoverTree(object):
         score of the :class:`multidim.models.CDER` classifier.  Disable for
         speed ordering of adults is irrelevant for your needs.
         Default: :code:`True`
+    parallel : bool
+        Should the orphans and teens of each level be handled in bulk?  Their
+        distances are then computed together in compiled kernels, across
+        OpenMP threads (see :code:`OMP_NUM_THREADS`), and the assignments are
+        resolved in the same order as the one-at-a-time algorithm, so the
+        tree is identical.  Default: :code:`False`
 
     Yields
     ------
@@ -109,6 +132,17 @@ class CoverTree(object):
         The number of points in :code:`self.pointcloud`
     allpoints : :class:`numpy.ndarray`
         The raw NumPY array underlying :code:`self.pointcloud`.
+    _born : :class:`numpy.ndarray`
+        The adults of the deepest level computed so far, in birth order,
+        followed by unused space.  The adults of every level are a prefix
+        of this array.
+    _slot : :class:`numpy.ndarray`
+        The position of each point in :code:`_born`, or -1 if it has not been
+        born as an adult yet.  This is the slot of an adult in the
+        :class:`PackedRelation` and :class:`PackedValues` of every level.
+    _children_pool : :class:`numpy.ndarray`
+        The blocks of children of all levels.  A block that does not change
+        from one level to the next is stored once.
     
 
     Notes
@@ -310,7 +344,7 @@ class CoverTree(object):
 
 
     def __init__(self, pointcloud, ratio=ratio_Ag, exchange_teens=True, 
-                 sort_orphans_by_mean=True):
+                 sort_orphans_by_mean=True, parallel=False):
 
         self.pointcloud = pointcloud
         self.pointcloud.covertree = self
@@ -322,6 +356,11 @@ Consider setting masses with PointCloud.stratum[0]['mass']=1.0.""")
 
         self.label_set = self.pointcloud.label_info['int_index'].values
         self.coords = self.pointcloud.coords.values
+        self.metric = self.pointcloud.metric
+        if self.metric is None:
+            logging.warning("""
+Your distance {} has no compiled kernel, so the CoverTree uses Euclidean distance.
+See multidim.fast_algorithms.Metric.""".format(self.pointcloud.dist))
         try:
             self.pointcloud.multiplicity
         except AttributeError:
@@ -335,6 +374,7 @@ Consider setting masses with PointCloud.stratum[0]['mass']=1.0.""")
 
         self.exchange_teens = exchange_teens
         self.sort_orphans_by_mean = sort_orphans_by_mean
+        self.parallel = parallel
 
         # more initialization happens in __next__()
         ball = self.pointcloud.cover_ball()
@@ -344,6 +384,10 @@ Consider setting masses with PointCloud.stratum[0]['mass']=1.0.""")
         self.N = self.pointcloud.coords.index.shape[0]
         self.allpoints = self.pointcloud.coords.index.values
         self.cohort = -1*np.ones(shape=(self.N,), dtype=np.int64)
+        self._born = -1*np.ones(shape=(self.N,), dtype=np.int64)
+        self._slot = -1*np.ones(shape=(self.N,), dtype=np.int64)
+        self._children_pool = np.zeros(shape=(2*self.N,), dtype=np.int64)
+        self._children_used = 0
         assert np.all(self.pointcloud.coords.index.values == np.arange(self.N)),\
             "So far, out methods require the pointcloud index to be range(N)."
         level0 = CoverLevel(self, 0)
@@ -358,6 +402,7 @@ Consider setting masses with PointCloud.stratum[0]['mass']=1.0.""")
         level0.successors = OrderedDict()
         level0.guardians = self._adult0*np.ones(shape=(self.N,), dtype=np.int64)
         self.cohort[self._adult0] = 0
+        level0.pack()
         
         self._levels[0] = level0
         self.level_pointer = -1
@@ -405,8 +450,13 @@ level\tadults\n""".format(
         prev_level = self._levels[level.exponent - 1]
         
         # STEP 1: Promote
-        level.guardians = deepcopy(prev_level.guardians)
-        level.children = deepcopy(prev_level.children)
+        # Start from a copy of the guardians array, which the previous level
+        # then drops and recomputes from its children when asked.  Children
+        # blocks are shared with the previous level until they are replaced.
+        level.guardians = prev_level.guardians.copy()
+        prev_level._guardians = None
+        level.children = OrderedDict(prev_level.children.items())
+        level._shared = dict(level.children)
         level.adults = []
         level.adults.extend(prev_level.adults)
         for ca in level.adults:
@@ -423,7 +473,7 @@ level\tadults\n""".format(
         for ci in level.adults:
             center_a = np.array([ci], dtype=np.int64)
             #children_ids = np.where(level.children[ci])[0]
-            children_dists = fast_algorithms.distance_cache_None(center_a, level.children[ci], self.coords).flatten()
+            children_dists = fast_algorithms.distance_cache_None(center_a, level.children[ci], self.coords, self.metric).flatten()
             # since we have computed children_dists, let's take a moment to count
             # duplicate points of new adults.
             if self.cohort[ci] == prev_level.exponent:
@@ -446,8 +496,12 @@ level\tadults\n""".format(
                                                 self.label_set)
                 
                 label_ordering = label_weights.argsort()[::-1]  # big-to-small
-                dist_to_labelmean_by_orphan = cdist(label_means[label_ordering, :],
-                                                    self.coords[my_orphans, :])
+                if self.metric is not None:
+                    dist_to_labelmean_by_orphan = self.metric.cdist(
+                        label_means[label_ordering, :], self.coords[my_orphans, :])
+                else:
+                    dist_to_labelmean_by_orphan = cdist(label_means[label_ordering, :],
+                                                        self.coords[my_orphans, :])
                 # get closet-to-each-label until all orphans are used
                 orphan_order = np.concatenate([
                     my_orphans[dist_to_labelmean_by_orphan.argsort(axis=1).T.flatten()], 
@@ -469,6 +523,9 @@ level\tadults\n""".format(
         # STEP 3: Adopt or Liberate
         # Use type-1 friends to re-assign or promote orphans.
         # This is where most distances are computed, so it is the slowest.
+        if self.parallel:
+            self._adopt_or_liberate_batch(level, prev_level, orphans)
+            orphans = []
         for orphan_index in orphans:
             assert orphan_index not in level.adults
             assert orphan_index in level.children[level.guardians[orphan_index]], "{} not in {}".format(orphan_index, level.children[level.guardians[orphan_index]])
@@ -491,7 +548,9 @@ level\tadults\n""".format(
 
         # STEP 4: Exchange teens
         # re-assign "teen" children to nearest adult using type-2 friends
-        if self.exchange_teens:
+        if self.exchange_teens and self.parallel:
+            self._exchange_teens_batch(level, prev_level)
+        elif self.exchange_teens:
             for ci in level.adults:
                 fast_algorithms.covertree_exchange_teens(level, prev_level, ci)
         
@@ -502,11 +561,363 @@ level\tadults\n""".format(
                                                   np.array(prev_level.friends3[pre_i], dtype=np.int64))
         
         level.cleanup()
+        level.pack()
+        prev_level.successors = PackedRelation.from_blocks(
+            prev_level.adults, self._slot, prev_level.successors)
         
         # assert level.check()
         self._levels[level.exponent] = level
         return level
 
+    def _store_children(self, flat):
+        r"""Append to :code:`_children_pool`, growing it (for all levels) if
+        needed.  Returns the position of flat in the pool."""
+        used = self._children_used
+        if used + flat.shape[0] > self._children_pool.shape[0]:
+            old = self._children_pool
+            self._children_pool = np.zeros(
+                shape=(max(2*old.shape[0], used + flat.shape[0]),), dtype=np.int64)
+            self._children_pool[:used] = old[:used]
+            for level in self._levels.values():
+                if level.children.flat is old:
+                    level.children.flat = self._children_pool
+        self._children_pool[used:used + flat.shape[0]] = flat
+        self._children_used = used + flat.shape[0]
+        return used
+
+    def _adopt_or_liberate_batch(self, level, prev_level, orphans):
+        r"""STEP 3 of :func:`__next__` for all orphans at once, giving the
+        same result as :func:`fast_algorithms.covertree_adopt_or_liberate`
+        on each orphan in turn.
+
+        The fosters of an orphan are the old adults among the type-1 friends
+        of its old guardian, and the orphans liberated before it under those
+        friends.  The nearest old adults are found in bulk.  Only the orphans
+        that none of them claim can be liberated, and
+        :func:`fast_algorithms.covertree_liberate` decides which, in order.
+        Finally, the liberated fosters are compared in bulk.
+        """
+        orphans = np.array(orphans, dtype=np.int64)
+        n = orphans.shape[0]
+        if n == 0:
+            return
+        R = level.radius
+        deadbeats = level.guardians[orphans]
+        table, group = np.unique(deadbeats, return_inverse=True)
+        group = group.astype(np.int64).reshape(-1)
+        position = -np.ones(shape=(self.N,), dtype=np.int64)
+        position[table] = np.arange(table.shape[0], dtype=np.int64)
+
+        # So far, each old adult is its own only successor.
+        friend_offsets, friend_flat = _pack(
+            [np.unique(prev_level.friends1[g]) for g in table])
+        rows, fosters = _gather(friend_offsets, friend_flat, group)
+        dists = fast_algorithms.distance_pairs(orphans[rows], fosters,
+                                               self.coords, self.metric)
+        best_dists, best_fosters = fast_algorithms.group_k_smallest(
+            rows, dists, fosters, 1, n)
+
+        # friends among the old guardians that have orphans
+        rows, friends = _gather(friend_offsets, friend_flat,
+                                np.arange(table.shape[0], dtype=np.int64))
+        keep = position[friends] >= 0
+        rows, friends = rows[keep], position[friends[keep]]
+        friend_offsets = np.zeros(shape=(table.shape[0] + 1,), dtype=np.int64)
+        np.cumsum(np.bincount(rows, minlength=table.shape[0]), out=friend_offsets[1:])
+
+        unclaimed = np.flatnonzero(best_dists[:, 0] > R)
+        liberated = unclaimed[fast_algorithms.covertree_liberate(
+            orphans[unclaimed], group[unclaimed], friend_offsets, friends,
+            self.coords, self.metric, R)]
+
+        # the liberated fosters of each orphan that comes later
+        by_group = np.argsort(group, kind='stable')
+        group_offsets = np.zeros(shape=(table.shape[0] + 1,), dtype=np.int64)
+        np.cumsum(np.bincount(group, minlength=table.shape[0]), out=group_offsets[1:])
+        befriended = np.argsort(friends, kind='stable')
+        befriended_offsets = np.zeros(shape=(table.shape[0] + 1,), dtype=np.int64)
+        np.cumsum(np.bincount(friends, minlength=table.shape[0]), out=befriended_offsets[1:])
+        rows, friend_groups = _gather(befriended_offsets, rows[befriended], group[liberated])
+        more, later = _gather(group_offsets, by_group, friend_groups)
+        foster = liberated[rows[more]]
+        is_liberated = np.zeros(shape=(n,), dtype='bool')
+        is_liberated[liberated] = True
+        keep = np.logical_and(later > foster, ~is_liberated[later])
+        foster, later = foster[keep], later[keep]
+        dists = fast_algorithms.distance_pairs(orphans[later], orphans[foster],
+                                               self.coords, self.metric)
+
+        rows = np.concatenate([np.arange(n, dtype=np.int64), later])
+        order = np.argsort(rows, kind='stable')
+        best_dists, best_fosters = fast_algorithms.group_k_smallest(
+            rows[order],
+            np.concatenate([best_dists[:, 0], dists])[order],
+            np.concatenate([best_fosters[:, 0], orphans[foster]])[order],
+            1, n)
+        parents = np.where(best_dists[:, 0] <= R, best_fosters[:, 0], orphans)
+        parents[liberated] = orphans[liberated]
+        level.guardians[orphans] = parents
+
+        for i in liberated:
+            orphan_index = orphans[i]
+            old_parent = deadbeats[i]
+            prev_level.successors[old_parent] = np.append(prev_level.successors[old_parent], orphan_index)
+            level.predecessor[orphan_index] = old_parent
+            level.adults.append(orphan_index)
+            level.friends1[orphan_index] = [orphan_index]
+            level.friends2[orphan_index] = [orphan_index]
+            level.friends3[orphan_index] = [orphan_index]
+            self.cohort[orphan_index] = level.exponent
+
+        _regroup(level, np.unique(np.concatenate([deadbeats, parents])))
+
+    def _exchange_teens_batch(self, level, prev_level):
+        r"""STEP 4 of :func:`__next__` for all adults at once, giving the
+        same result as :func:`fast_algorithms.covertree_exchange_teens` on
+        each adult in turn.
+
+        The nearest possible guardian of every teen is found in bulk, and
+        :func:`fast_algorithms.covertree_resolve_teens` makes the
+        reassignments in order.
+        """
+        R = level.radius
+        adults = np.array(level.adults, dtype=np.int64)
+        pos = -np.ones(shape=(self.N,), dtype=np.int64)
+        pos[adults] = np.arange(adults.shape[0], dtype=np.int64)
+        old_guardians = level.guardians.copy()
+
+        dists = fast_algorithms.distance_pairs(old_guardians, self.allpoints,
+                                               self.coords, self.metric)
+        teens = np.flatnonzero(dists > 0.5*R)
+        teens = teens[np.argsort(pos[old_guardians[teens]], kind='stable')]
+        teen_pos = pos[old_guardians[teens]]
+        teen_offsets = np.zeros(shape=(adults.shape[0] + 1,), dtype=np.int64)
+        np.cumsum(np.bincount(teen_pos, minlength=adults.shape[0]), out=teen_offsets[1:])
+
+        # The possible guardians of the teens of an adult are the successors
+        # of the type-2 friends of its predecessor, in order.
+        prev_slot = -np.ones(shape=(self.N,), dtype=np.int64)
+        prev_slot[prev_level.adults] = np.arange(len(prev_level.adults), dtype=np.int64)
+        f2_offsets, f2_flat = prev_level.friends2.compact()
+        succ_offsets, succ_flat = _pack([prev_level.successors[a] for a in prev_level.adults])
+        pre = np.array([level.predecessor[a] for a in level.adults], dtype=np.int64)
+        rows, f2s = _gather(f2_offsets, f2_flat, prev_slot[pre])
+        more, grd = _gather(succ_offsets, succ_flat, prev_slot[f2s])
+        rows = rows[more]
+        order = np.lexsort((grd, rows))
+        grd = grd[order]
+        grd_offsets = np.zeros(shape=(adults.shape[0] + 1,), dtype=np.int64)
+        np.cumsum(np.bincount(rows, minlength=adults.shape[0]), out=grd_offsets[1:])
+
+        rows, cand = _gather(grd_offsets, grd, teen_pos)
+        dists = fast_algorithms.distance_pairs(teens[rows], cand,
+                                               self.coords, self.metric)
+        _, teen_guardians = fast_algorithms.group_k_smallest(
+            rows, dists, cand, 1, teens.shape[0])
+
+        fast_algorithms.covertree_resolve_teens(
+            adults, pos, teen_offsets, teens, teen_guardians[:, 0],
+            grd_offsets, grd, self.coords, self.metric, R, level.guardians)
+
+        changed = np.flatnonzero(old_guardians != level.guardians)
+        _regroup(level, np.unique(np.concatenate([old_guardians[changed],
+                                                  level.guardians[changed]])))
+
+    def insert(self, points, **kwargs):
+        r"""Append points to the underlying :class:`multidim.PointCloud`,
+        and place them into the levels computed so far.  The keyword
+        arguments are passed to :func:`multidim.PointCloud.insert`.
+
+        Each new point descends the levels like an orphan of
+        :func:`__next__`: it keeps its guardian while it is close enough, is
+        adopted by the nearest successor of the type-1 friends of its
+        guardian, or else is liberated as a new adult, which is then
+        befriended at every later level.  Finally, the levels are re-packed
+        with the new adults in birth order.  Levels below the computed ones
+        are computed as usual, if the new points are not separated yet.
+
+        The old points keep their guardians, so the tree is a valid cover
+        tree, but not necessarily the one that a rebuild would give.  If a
+        new point lies outside of the ball of level 0, the tree is rebuilt.
+
+        Parameters
+        ----------
+        points : :class:`numpy.ndarray`
+            The new points, with shape (m, d)
+
+        Returns
+        -------
+        :class:`numpy.ndarray`
+            The indices of the new points.
+
+        Examples
+        --------
+
+        >>> pc = PointCloud(np.array([[0.0, 0.0], [1.0, 0.0], [0.0, 2.0], [3.0, 3.0]]))
+        >>> ct = CoverTree(pc, ratio=0.5)
+        >>> ct.insert(np.array([[1.0, 1.0]])).tolist()
+        [4]
+        >>> all(cl.check() for cl in ct)
+        True
+        >>> ct.query(np.array([[0.9, 1.2]]))[1].tolist()
+        [[4]]
+        """
+        return self.pointcloud.insert(points, **kwargs)
+
+    def remove(self, indices):
+        r"""Remove points from the underlying :class:`multidim.PointCloud`,
+        and take them out of the levels computed so far.  The remaining
+        points are renumbered in order.  See :func:`multidim.PointCloud.remove`
+
+        A removed adult is demoted from its cohort on, and the points below
+        it are placed again, with the rules of
+        :func:`multidim.fast_algorithms.covertree_adopt_or_liberate`: each
+        keeps its guardian while it is close enough, or is adopted by the
+        nearest successor of the type-1 friends of its guardian, or else is
+        liberated.  If the adult of level 0 is removed, the tree is rebuilt.
+
+        Parameters
+        ----------
+        indices : :class:`numpy.ndarray`
+            The indices of the points to remove.
+
+        Returns
+        -------
+        :class:`numpy.ndarray`
+            The new index of each old point, or -1 if it was removed.
+
+        Examples
+        --------
+
+        >>> pc = PointCloud(np.array([[0.0, 0.0], [1.0, 0.0], [0.0, 2.0], [3.0, 3.0]]))
+        >>> ct = CoverTree(pc, ratio=0.5)
+        >>> ct.remove(np.array([1])).tolist()
+        [0, -1, 1, 2]
+        >>> all(cl.check() for cl in ct)
+        True
+        >>> ct.query(np.array([[0.9, 0.1]]))[1].tolist()
+        [[0]]
+        """
+        return self.pointcloud.remove(indices)
+
+    def _place(self, new):
+        r"""Place the new points of :code:`self.pointcloud` into the levels
+        computed so far.  See :func:`insert`.
+
+        Returns False if the tree has to be rebuilt instead, because a new
+        point lies outside of the ball of level 0.
+
+        The work is done by a :class:`_Placement`: the new points start below
+        the adult of level 0 and descend the levels, and then the levels are
+        re-packed.
+        """
+        old_N = self.N
+        self._extend(new.shape[0])
+        outside = fast_algorithms.distance_pairs(
+            self._adult0*np.ones(shape=new.shape, dtype=np.int64),
+            new.astype(np.int64), self.coords, self.metric) > self._r0
+        if np.any(outside):
+            return False
+
+        placement = _Placement(self, old_N)
+        placement.adopt_new(new)
+        placement.place_pending()
+        placement.repack()
+        return True
+
+    def _unplace(self, removed):
+        r"""Take the removed points of :code:`self.pointcloud` out of the
+        levels computed so far.  See :func:`remove`.  The points keep their
+        indices until :func:`_compact` is called.
+
+        Returns False if the tree has to be rebuilt instead, because the
+        adult of level 0 is removed.
+
+        The work is done by a :class:`_Placement`: the points that were
+        guarded by removed adults are re-guarded, and then the levels are
+        re-packed.
+        """
+        removed = np.asarray(removed, dtype=np.int64)
+        self._extend(0)
+        if self._adult0 in removed:
+            return False
+
+        placement = _Placement(self, self.N)
+        placement.reguard(removed)
+        placement.repack()
+        return True
+
+    def _extend(self, m):
+        r"""Follow :code:`self.pointcloud`, which has m new points (maybe
+        none) at the end, leaving them without a cohort."""
+        pc = self.pointcloud
+        self.N = pc.coords.index.shape[0]
+        self.allpoints = pc.coords.index.values
+        self.coords = pc.coords.values
+        self.cohort = np.concatenate([self.cohort, -1*np.ones(shape=(m,), dtype=np.int64)])
+        try:
+            del self._search_cache
+        except AttributeError:
+            pass
+        self.reset()
+
+    def _compact(self, keep):
+        r"""Renumber the points, after :func:`_unplace` has taken out those
+        that are not marked in the boolean array keep, to follow
+        :code:`self.pointcloud`, which has been renumbered already.
+        """
+        pc = self.pointcloud
+        remap = -1*np.ones(shape=keep.shape, dtype=np.int64)
+        remap[keep] = np.arange(np.count_nonzero(keep), dtype=np.int64)
+        levels = [self._levels[e] for e in range(len(self))]
+        num_adults = levels[-1].adults.shape[0]
+
+        self.N = pc.coords.index.shape[0]
+        self.allpoints = pc.coords.index.values
+        self.coords = pc.coords.values
+        self.cohort = self.cohort[keep]
+        self._adult0 = remap[self._adult0]
+        born = remap[self._born[:num_adults]]
+        self._born = -1*np.ones(shape=(self.N,), dtype=np.int64)
+        self._born[:num_adults] = born
+        self._slot = self._slot[keep]
+        slot = self._slot
+        used = self._children_used
+        self._children_pool[:used] = remap[self._children_pool[:used]]
+        try:
+            del self._search_cache
+        except AttributeError:
+            pass
+
+        for level in levels:
+            n = level.adults.shape[0]
+            adults = self._born[:n]
+            adults.flags.writeable = False
+            level.adults = adults
+            children = level.children
+            level.children = PackedRelation(adults, slot, children.starts,
+                                            self._children_pool, stops=children.stops)
+            for name in ["friends1", "friends2", "friends3", "successors"]:
+                relation = getattr(level, name)
+                if isinstance(relation, PackedRelation):
+                    offsets, flat = relation.compact()
+                    setattr(level, name, PackedRelation(adults, slot, offsets, remap[flat]))
+            if isinstance(level.predecessor, PackedValues):
+                level.predecessor = PackedValues(adults, slot, remap[level.predecessor.data])
+            else:
+                level.predecessor = OrderedDict({self._adult0: None})
+            level.weights = PackedValues(adults, slot, level.weights.data)
+            if level._guardians is not None:
+                level.guardians = remap[level._guardians[keep]]
+        self.reset()
+
+    def _rebuild(self):
+        r"""Start over from level 0, with the same parameters."""
+        self.__init__(self.pointcloud, ratio=self.ratio,
+                      exchange_teens=self.exchange_teens,
+                      sort_orphans_by_mean=self.sort_orphans_by_mean,
+                      parallel=self.parallel)
+
     def reset(self):
         """
         Go to level -1.  Used internally to re-compute levels.
@@ -558,25 +969,504 @@ level\tadults\n""".format(
         """ 
         return max(self._levels.keys())+1
 
-    def sparse_complex(self, level=-1):
-        r""" Make a sparse complex from this CoverTree, using the type-4 friends 
-        algorithm. 
-      
+    def save(self, dirname):
+        r"""Save all levels computed so far, with the cohort and multiplicity
+        arrays, as a directory of :code:`.npy` files that can be memory-mapped
+        by :func:`load`.
+
+        The adults of all levels are concatenated in :code:`adults.npy`, with
+        :code:`adult_offsets.npy` marking the levels.  The predecessor and
+        weights of the adults are aligned with them, and their children,
+        friends and successors are packed as CSR arrays (for example,
+        :code:`children.npy` and :code:`children_offsets.npy`).  The
+        guardians are one row per level of :code:`guardians.npy`.
+
+        Parameters
+        ----------
+        dirname : str
+            Directory to write, which is created if necessary.
+
+        See Also
+        --------
+        :func:`load`
+        """
+        if not os.path.isdir(dirname):
+            os.makedirs(dirname)
+        levels = [self._levels[e] for e in range(len(self))]
+        adults = [cl.adults for cl in levels]
+        arrays = dict()
+        arrays['header'] = np.array([_save_format, self.N, self._r0, self.ratio,
+                                     self._adult0, self.exchange_teens,
+                                     self.sort_orphans_by_mean],
+                                    dtype=np.float64)
+        arrays['adult_offsets'], arrays['adults'] = _pack(adults)
+        arrays['guardians'] = np.array([cl.guardians for cl in levels], dtype=np.int64)
+        arrays['predecessor'] = np.array(
+            [-1 if cl.predecessor[a] is None else cl.predecessor[a]
+             for cl in levels for a in cl.adults], dtype=np.int64)
+        arrays['weights'] = np.array([cl.weights[a] for cl in levels for a in cl.adults],
+                                     dtype=np.float64)
+        for name in ['children', 'friends1', 'friends2', 'friends3', 'successors']:
+            offsets, flat, total = [np.zeros(shape=(1,), dtype=np.int64)], [], 0
+            for cl in levels:
+                relation = getattr(cl, name)
+                if isinstance(relation, PackedRelation):
+                    o, f = relation.compact()
+                else:
+                    o, f = _pack([relation.get(a, []) for a in cl.adults])
+                offsets.append(o[1:] + total)
+                flat.append(f)
+                total += f.shape[0]
+            arrays[name + '_offsets'] = np.concatenate(offsets).astype(np.int64)
+            arrays[name] = np.concatenate(flat).astype(np.int64)
+        arrays['cohort'] = self.cohort
+        arrays['multiplicity'] = self.pointcloud.multiplicity
+        for name, array in arrays.items():
+            np.save(os.path.join(dirname, name + ".npy"), array)
+
+    @classmethod
+    def load(cls, pointcloud, dirname, mmap_mode='r', **kwargs):
+        r"""Load a CoverTree written by :func:`save`, without recomputing
+        any distances between levels.
+
+        Parameters
+        ----------
+        pointcloud : :class:`multidim.PointCloud`
+            The same `PointCloud` (and distance) that the tree was built on.
+        dirname : str
+            Directory written by :func:`save`.
+        mmap_mode : str or None
+            Passed to :func:`numpy.load`.  With the default :code:`'r'`, the
+            guardians, children, friends and successors of each `CoverLevel`
+            are read-only views into memory-mapped files, which several
+            processes can share.  Use :code:`None` to read everything into
+            memory.  Default: :code:`'r'`
+        kwargs
+            Other arguments of :class:`CoverTree`, such as :code:`parallel`.
+
+        Returns
+        -------
+        :class:`CoverTree`
+
         Notes
         -----
-        This is a *placeholder*.  Sparse Complexes are not currently
-        implemented in the stable codebase. 
+        Levels after the last saved one are computed as usual.
+
+        Examples
+        --------
+
+        >>> import tempfile
+        >>> pc = PointCloud(np.load("tests/circle.npy"))
+        >>> ct = CoverTree(pc)
+        >>> levels = list(ct)
+        >>> dirname = tempfile.mkdtemp()
+        >>> ct.save(dirname)
+        >>> ct2 = CoverTree.load(pc, dirname)
+        >>> len(ct2) == len(ct)
+        True
+        >>> np.all(ct2[-1].guardians == ct[-1].guardians)
+        True
+        >>> import shutil
+        >>> shutil.rmtree(dirname)
+
+        """
+        def read(name):
+            # plain views of the memory map are much quicker to slice
+            return np.asarray(np.load(os.path.join(dirname, name + ".npy"),
+                                      mmap_mode=mmap_mode))
+
+        header = read('header')
+        version, N, r0, ratio, adult0, exchange_teens, sort_orphans_by_mean = header
+        if version != _save_format:
+            raise ValueError("Unknown CoverTree format {} in {}".format(version, dirname))
+        if N != pointcloud.coords.shape[0]:
+            raise ValueError("The CoverTree in {} has {} points, but the PointCloud has {}.".format(
+                dirname, int(N), pointcloud.coords.shape[0]))
+
+        kwargs.setdefault('exchange_teens', bool(exchange_teens))
+        kwargs.setdefault('sort_orphans_by_mean', bool(sort_orphans_by_mean))
+        tree = cls(pointcloud, ratio=ratio, **kwargs)
+        tree._r0 = r0
+        tree._adult0 = int(adult0)
+        tree.cohort = np.array(read('cohort'))
+        tree.pointcloud.multiplicity = np.array(read('multiplicity'))
+
+        adult_offsets = read('adult_offsets').tolist()
+        adults = read('adults')
+        guardians = read('guardians')
+        predecessor = read('predecessor')
+        weights = read('weights')
+        packed = dict((name, (read(name + '_offsets'), read(name)))
+                      for name in ['children', 'friends1', 'friends2', 'friends3', 'successors'])
+
+        # the adults of each level are a prefix of those of the last level
+        bottom = adults[adult_offsets[-2]:adult_offsets[-1]]
+        tree._born[:bottom.shape[0]] = bottom
+        tree._slot[bottom] = np.arange(bottom.shape[0], dtype=np.int64)
+        tree._levels = dict()
+        for exponent in range(len(adult_offsets) - 1):
+            level = CoverLevel(tree, exponent)
+            first, last = adult_offsets[exponent], adult_offsets[exponent + 1]
+            level.adults = tree._born[:last - first]
+            level.adults.flags.writeable = False
+            level.guardians = guardians[exponent]
+            for name, (offsets, flat) in packed.items():
+                if name == 'successors' and offsets[first] == offsets[last]:
+                    continue
+                setattr(level, name, PackedRelation(
+                    level.adults, tree._slot, offsets[first:last + 1], flat))
+            if exponent == 0:
+                level.predecessor[level.adults[0]] = None
+            else:
+                level.predecessor = PackedValues(level.adults, tree._slot,
+                                                 predecessor[first:last])
+            level.weights = PackedValues(level.adults, tree._slot, weights[first:last])
+            tree._levels[exponent] = level
+        tree.reset()
+        return tree
+
+    def _search_index(self):
+        r"""Compute all levels, and pack the successors of each level and the
+        children of the bottom level as CSR arrays for :func:`query` and
+        :func:`query_radius`.  The result is cached in
+        :code:`self._search_cache`.
+
+        Returns
+        -------
+        list of (reach, count, slot, offsets, flat) tuples, one per level,
+        where the successors (or, at the bottom level, the children) of adult
+        :code:`a` are :code:`flat[offsets[slot[a]]:offsets[slot[a]+1]]`,
+        :code:`reach[slot[a]]` is the largest distance from :code:`a`
+        to any point below it in the tree, and :code:`count[slot[a]]` is
+        the number of those points.
+        """
+        try:
+            return self._search_cache
+        except AttributeError:
+            pass
+
+        for bottom in self:
+            pass
+
+        # ancestor[x] is the adult above the point x, from the bottom up.
+        ancestor = bottom.guardians.copy()
+        index = []
+        for exponent in range(bottom.exponent, -1, -1):
+            level = self._levels[exponent]
+            adults = level.adults
+            if exponent < bottom.exponent:
+                offsets, flat = level.successors.compact()
+                predecessor = self._levels[exponent + 1].predecessor
+                pre = np.zeros(shape=(self.N,), dtype=np.int64)
+                pre[predecessor.adults] = predecessor.data
+                ancestor = pre[ancestor]
+            else:
+                offsets, flat = level.children.compact()
+            slot = self._slot
+            reach = np.zeros(shape=(adults.shape[0],), dtype=np.float64)
+            np.maximum.at(reach, slot[ancestor],
+                          fast_algorithms.distance_pairs(self.allpoints, ancestor,
+                                                         self.coords, self.metric))
+            count = np.bincount(slot[ancestor], minlength=adults.shape[0])
+            index.append((reach, count, slot, offsets, flat))
+
+        index.reverse()
+        self._search_cache = index
+        return index
+
+    def _descend(self, points, bound, depth=None):
+        r"""Find all (query, point) pairs that can satisfy a distance bound,
+        by descending the levels along the successors.
+
+        An adult :code:`a` can only lie above a point within
+        :code:`bound(q)` of :code:`q` if :code:`d(q, a) <= bound(q) + reach`,
+        where :code:`reach` is the largest distance from :code:`a` to the
+        points below it.  All other adults are pruned.
 
         Parameters
         ----------
-        level: int
-            Level to use.  (Default: -1, meaning len(self)
-            
+        points : :class:`numpy.ndarray`
+            Query points, with shape (m, d)
+        bound : function
+            Takes the query indices (in non-decreasing order), distances,
+            reaches and counts of the candidate pairs at one level, and
+            returns an upper bound of the wanted distance for each query,
+            with shape (m,).
+        depth : int or None
+            If given, stop at the adults of this level, instead of the
+            children of the bottom level.  (Default: None)
+
         Returns
         -------
-        PointCloud object, with edge values coming from sparse complex algorithm.
+        query, index, dists : :class:`numpy.ndarray`
+            The candidate pairs among the children of the bottom level (or
+            the adults of level depth), with their distances.  The pairs
+            are grouped by query, in order.
         """
-        raise NotImplementedError
+        m = points.shape[0]
+        index = self._search_index()
+        if depth is not None:
+            index = index[:depth]
+
+        query = np.arange(m, dtype=np.int64)
+        cand = self._adult0*np.ones(shape=(m,), dtype=np.int64)
+        for reach, count, slot, offsets, flat in index:
+            dists = fast_algorithms.distance_pairs(query, cand, self.coords,
+                                                   self.metric, points)
+            s = slot[cand]
+            keep = dists <= bound(query, dists, reach[s], count[s])[query] + reach[s]
+            query = query[keep]
+            s = s[keep]
+
+            # gather the successors (or children) of each remaining candidate
+            rows, cand = _gather(offsets, flat, s)
+            query = query[rows]
+
+        dists = fast_algorithms.distance_pairs(query, cand, self.coords,
+                                               self.metric, points)
+        return query, cand, dists
+
+    def query(self, points, k=1):
+        r"""Find the k nearest neighbors in the underlying `PointCloud` of
+        each query point, which need not belong to the `PointCloud`.
+
+        The levels are computed once, and each batch of
+        :code:`query_batch_size` queries descends them together, keeping only
+        the adults that may lie above a point nearer than the k-th nearest
+        neighbor is known to be.  Distances use
+        :code:`self.metric`, like the rest of the tree.
+
+        Parameters
+        ----------
+        points : :class:`numpy.ndarray`
+            Query points, with shape (m, d) or (d,), where d is the
+            dimension of the `PointCloud`.  Raises ValueError otherwise.
+        k : int
+            Number of neighbors.  (Default: 1)
+
+        Returns
+        -------
+        dists, indices : :class:`numpy.ndarray`
+            Arrays of shape (m, k), giving the neighbors of each query point
+            in increasing order of distance (ties by increasing index).
+
+        See Also
+        --------
+        :func:`query_radius`
+
+        Examples
+        --------
+
+        >>> pc = PointCloud(np.array([[0.0, 0.0], [1.0, 0.0], [0.0, 2.0], [3.0, 3.0]]))
+        >>> ct = CoverTree(pc, ratio=0.5)
+        >>> dists, indices = ct.query(np.array([[0.9, 0.1], [2.0, 2.0]]), k=2)
+        >>> indices.tolist()
+        [[1, 0], [3, 2]]
+        >>> np.round(dists, 4).tolist()
+        [[0.1414, 0.9055], [1.4142, 2.0]]
+        """
+        points = np.atleast_2d(np.asarray(points, dtype=np.float64))
+        if points.ndim != 2 or points.shape[1] != self.coords.shape[1]:
+            raise ValueError("Query points must have {} coordinates, not {}.".format(
+                self.coords.shape[1], points.shape[-1]))
+        m = points.shape[0]
+        if not 0 < k <= self.N:
+            raise ValueError("k must be between 1 and {}.".format(self.N))
+
+        dists = np.ndarray(shape=(m, k), dtype=np.float64)
+        indices = np.ndarray(shape=(m, k), dtype=np.int64)
+        for start in range(0, m, query_batch_size):
+            stop = min(start + query_batch_size, m)
+            batch = points[start:stop]
+
+            # The k nearest neighbors lie within d(q, a) + reach of the
+            # nearest adults a that have at least k points below them.
+            def kth_bound(query, found, reach, count):
+                return fast_algorithms.group_kth_weighted(
+                    query, found + reach, count, k, stop - start)
+
+            query, cand, found = self._descend(batch, kth_bound)
+            dists[start:stop], indices[start:stop] = \
+                fast_algorithms.group_k_smallest(query, found, cand, k, stop - start)
+        return dists, indices
+
+    def query_radius(self, points, r, return_distance=False):
+        r"""Find the points of the underlying `PointCloud` within distance r
+        of each query point, which need not belong to the `PointCloud`.
+
+        Parameters
+        ----------
+        points : :class:`numpy.ndarray`
+            Query points, with shape (m, d) or (d,), where d is the
+            dimension of the `PointCloud`.  Raises ValueError otherwise.
+        r : float or :class:`numpy.ndarray`
+            Radius, or an array of shape (m,) giving one radius per query.
+        return_distance : bool
+            Also return the distances.  (Default: False)
+
+        Returns
+        -------
+        indices : list of :class:`numpy.ndarray`
+            For each query point, the indices of the points within distance r,
+            in increasing order of distance (ties by increasing index).
+        dists : list of :class:`numpy.ndarray`
+            The matching distances, if :code:`return_distance` is True.
+
+        See Also
+        --------
+        :func:`query`
+
+        Examples
+        --------
+
+        >>> pc = PointCloud(np.array([[0.0, 0.0], [1.0, 0.0], [0.0, 2.0], [3.0, 3.0]]))
+        >>> ct = CoverTree(pc, ratio=0.5)
+        >>> [i.tolist() for i in ct.query_radius(np.array([[0.0, 0.5], [5.0, 5.0]]), 1.5)]
+        [[0, 1, 2], []]
+        """
+        points = np.atleast_2d(np.asarray(points, dtype=np.float64))
+        if points.ndim != 2 or points.shape[1] != self.coords.shape[1]:
+            raise ValueError("Query points must have {} coordinates, not {}.".format(
+                self.coords.shape[1], points.shape[-1]))
+        m = points.shape[0]
+        radii = np.broadcast_to(np.asarray(r, dtype=np.float64), (m,))
+
+        indices = []
+        dists = []
+        for start in range(0, m, query_batch_size):
+            stop = min(start + query_batch_size, m)
+            batch_radii = radii[start:stop]
+            query, cand, found = self._descend(points[start:stop],
+                                               lambda *pairs: batch_radii)
+            good = found <= batch_radii[query]
+            query, cand, found = query[good], cand[good], found[good]
+            order = np.lexsort((cand, found, query))
+            splits = np.cumsum(np.bincount(query, minlength=stop - start))[:-1]
+            indices.extend(np.split(cand[order], splits))
+            dists.extend(np.split(found[order], splits))
+        if return_distance:
+            return indices, dists
+        return indices
+
+    def sparse_complex(self, epsilon=0.5):
+        r""" Make a sparse approximation of the Rips filtration of the
+        underlying `PointCloud`, with a linear number of edges, following
+        [SPARSE1]_ and [SPARSE2]_.
+
+        The cohorts play the role of a greedy permutation: a point born at
+        level :math:`\ell` gets the insertion radius
+        :math:`\lambda_p = r_{\ell-1}` (and :code:`_adult0` gets
+        :math:`\infty`), so that the adults of each level cover all points
+        within the insertion radius of the next one.  The ball of p stops
+        growing at scale :math:`\lambda_p (1+\epsilon)/\epsilon` and p
+        leaves the filtration at :math:`\lambda_p (1+\epsilon)^2/\epsilon`.
+        An edge is kept if the balls of its ends meet before either end
+        leaves, and its height is the diameter at which they meet.  With
+        :math:`\lambda = \min(\lambda_p, \lambda_q)`, that is
+        :math:`d(p,q)` if :math:`d(p,q) \leq 2\lambda(1+\epsilon)/\epsilon`,
+        and :math:`2(d(p,q) - \lambda(1+\epsilon)/\epsilon)` otherwise.
+        The candidate edges of each point are found by descending the levels
+        down to its cohort.
+
+        Parameters
+        ----------
+        epsilon : float
+            Approximation factor, between 0 and 1.  Smaller is more
+            accurate, but gives more edges.  (Default: 0.5)
+
+        Returns
+        -------
+        :class:`multidim.PointCloud` with the same points, heights, masses
+        and labels, whose 1-stratum holds the sparse edges, sorted by
+        height.  Use :func:`multidim.SimplicialComplex.make_pers0` and
+        :func:`multidim.SimplicialComplex.make_pers1_rca1` on it as usual.
+
+        Notes
+        -----
+        For fixed epsilon, ratio and dimension, the number of edges is
+        linear in the number of points.  The persistence diagrams
+        approximate those of :code:`PointCloud(..., max_length=-1)` up to a
+        multiplicative factor that tends to 1 as epsilon tends to 0.
+        Points that are never born (duplicates) are joined to their
+        guardians by edges of length 0.
+
+        Examples
+        --------
+
+        >>> pc = PointCloud(np.array([[0., 0.], [1., 0.], [0., 1.], [1., 1.]]))
+        >>> sc = CoverTree(pc).sparse_complex(epsilon=0.5)
+        >>> sc.make_pers1_rca1()
+        >>> sc.pers1.diagram[['birth', 'death']].values.tolist()
+        [[1.0, 1.4142135623730951]]
+
+        References
+        ----------
+        .. [SPARSE1] D. Sheehy, Linear-size approximations to the
+           Vietoris-Rips filtration, Discrete Comput. Geom. 49 (2013)
+        .. [SPARSE2] N. Cavanna, M. Jahanseir and D. Sheehy, A geometric
+           perspective on sparse filtrations, CCCG 2015
+        """
+        if not 0.0 < epsilon < 1.0:
+            raise ValueError("epsilon must be between 0 and 1.")
+        for bottom in self:
+            pass
+
+        pc = self.pointcloud
+        E0 = (1.0 + epsilon)/epsilon
+        E1 = (1.0 + epsilon)**2/epsilon
+        lam = self._r0 * self.ratio**(self.cohort - 1.0)
+        lam[self.cohort < 0] = 0.0
+        lam[self._adult0] = np.inf
+
+        src = []
+        dst = []
+        dists = []
+        for exponent in range(1, len(self)):
+            points = np.flatnonzero(self.cohort == exponent)
+            for start in range(0, points.shape[0], query_batch_size):
+                batch = points[start:start + query_batch_size]
+                radius = (E0 + E1)*lam[batch]
+                query, cand, found = self._descend(
+                    self.coords[batch], lambda *args: radius, depth=exponent)
+                q = batch[query]
+                keep = np.logical_and(found <= radius[query], np.logical_or(
+                    self.cohort[cand] < exponent, cand < q))
+                src.append(q[keep])
+                dst.append(cand[keep])
+                dists.append(found[keep])
+
+        unborn = np.flatnonzero(self.cohort < 0)
+        src.append(unborn)
+        dst.append(bottom.guardians[unborn])
+        dists.append(fast_algorithms.distance_pairs(unborn, dst[-1],
+                                                    self.coords, self.metric))
+        src, dst, dists = [np.concatenate(x) for x in [src, dst, dists]]
+
+        # keep the edges whose balls meet before either end leaves, and
+        # stretch those that meet after a ball stops growing
+        min_lam = np.minimum(lam[src], lam[dst])
+        max_lam = np.maximum(lam[src], lam[dst])
+        keep = dists <= np.minimum((E0 + E1)*min_lam, E0*(min_lam + max_lam))
+        src, dst, dists, min_lam = src[keep], dst[keep], dists[keep], min_lam[keep]
+        hgts = np.where(dists <= 2.0*E0*min_lam, dists, 2.0*(dists - E0*min_lam))
+        sortby = hgts.argsort(kind='stable')
+        hgts = hgts[sortby]
+
+        sc = PointCloud(self.coords.copy(),
+                        heights=pc.stratum[0]['height'].values.copy(),
+                        masses=pc.stratum[0]['mass'].values.copy(),
+                        dist=pc.dist, columnar=pc.columnar)
+        sc.labels = pc.labels.copy()
+        sc.source = pc.source.copy()
+        sc.label_info = pc.label_info.copy()
+        sc.stratum[1] = stratum_from_arrays(OrderedDict([
+            ('height', hgts),
+            ('pos', np.ones(shape=hgts.shape, dtype='bool')),
+            ('rep', np.arange(hgts.shape[0], dtype=np.int64)),
+            ('bdy0', np.minimum(src, dst)[sortby]),
+            ('bdy1', np.maximum(src, dst)[sortby]),
+        ]), index=np.arange(hgts.shape[0], dtype=np.int64), columnar=pc.columnar)
+        return sc
 
     def make_edges(self, min_distance=0.0, max_distance=-1.0):
         r"""Iterate over the edges between the points of the underlying
@@ -596,6 +1486,44 @@ level\tadults\n""".format(
         ------
         triples (a,b,r), where a,b are the indices of points, and r is the
         distance.
+
+        See Also
+        --------
+        :func:`make_edge_blocks`, which yields the same edges as arrays.
+        """
+        for bdy0, bdy1, hgts in self.make_edge_blocks(min_distance, max_distance):
+            for e in range(hgts.shape[0]):
+                yield (bdy0[e], bdy1[e], hgts[e])
+
+    def make_edge_blocks(self, min_distance=0.0, max_distance=-1.0):
+        r"""Iterate over the edges between the points of the underlying
+        `PointCloud`, where min_distance < length <= max_distance, one block of
+        arrays per pair of type-1 friends.
+
+        This is the array version of :func:`make_edges`, which avoids
+        any per-edge Python work.  The edges and their order are identical.
+
+        Parameters
+        ----------
+        min_distance: float
+            Minimum length.  (Default: 0.0)  Inequality means no self-edges!
+        max_distance: float
+            Maximum length.  (Default: -1.0, meaning 2*self._r0, for all edges)
+
+        Yields
+        ------
+        triples (a,b,r) of :class:`numpy.ndarray`, where a,b are
+        :class:`numpy.int64` arrays of the indices of points, and r is a
+        :class:`numpy.float64` array of the distances.
+
+        Examples
+        --------
+
+        >>> pc = PointCloud(np.array([[0., 0.], [1., 0.], [0., 2.]]))
+        >>> ct = CoverTree(pc)
+        >>> bdy0, bdy1, hgts = map(np.concatenate, zip(*ct.make_edge_blocks()))
+        >>> sorted(zip(bdy0.tolist(), bdy1.tolist()))
+        [(0, 1), (0, 2), (1, 2)]
         """
 
         if max_distance == -1.0:
@@ -621,13 +1549,19 @@ level\tadults\n""".format(
                     kids_i = level.children[ci]
                     total += int(len(kids_i)*(len(kids_i)-1)/2)
                     if len(kids_i) > 1:
-                        dists = squareform(pdist(self.coords[kids_i,:], self.pointcloud.dist))
-                        good_pairs = (min_distance < dists) & (dists <= max_distance)
-                        good_edges = np.where(good_pairs)
-                        for index_i, index_j in np.array(good_edges).T:
-                            # don't double_count on symmetric square matrix!
-                            if index_i < index_j:
-                                yield (kids_i[index_i], kids_i[index_j], dists[index_i,index_j])
+                        # don't double_count on symmetric square matrix!
+                        index_i, index_j = np.triu_indices(len(kids_i), k=1)
+                        if self.metric is None:
+                            dists = pdist(self.coords[kids_i,:], self.pointcloud.dist)
+                        elif self.metric.code == 0:
+                            dists = pdist(self.coords[kids_i,:], 'euclidean')
+                        else:
+                            dists = fast_algorithms.distance_cache_None(
+                                kids_i, kids_i, self.coords, self.metric)[index_i, index_j]
+                        good = (min_distance < dists) & (dists <= max_distance)
+                        yield (kids_i[index_i[good]].astype(np.int64),
+                               kids_i[index_j[good]].astype(np.int64),
+                               dists[good].astype(np.float64))
 
                 # friends is reflexive, so don't double-count by parent
                 elif ci < cj:
@@ -636,11 +1570,11 @@ level\tadults\n""".format(
                     total += len(kids_i)*len(kids_j)
                     dists = fast_algorithms.distance_cache_None(kids_i,
                                                                 kids_j,
-                                                                self.coords)
+                                                                self.coords,
+                                                                self.metric)
                     good_pairs = (min_distance < dists) & (dists <= max_distance)
-                    good_edges = np.where(good_pairs)
-                    for index_i, index_j in np.array(good_edges).T:
-                        yield (kids_i[index_i], kids_j[index_j], dists[index_i,index_j])
+                    index_i, index_j = np.where(good_pairs)
+                    yield (kids_i[index_i], kids_j[index_j], dists[index_i, index_j])
         if total > 0:
             logging.info("Examined {} possible edge distances using level {}.".format(total, ell-1))
 
@@ -751,6 +1685,588 @@ level\tadults\n""".format(
         pass
 
 
+def _pack(blocks):
+    r"""Pack a list of arrays as CSR (offsets, flat) arrays."""
+    offsets = np.zeros(shape=(len(blocks) + 1,), dtype=np.int64)
+    np.cumsum([len(b) for b in blocks], out=offsets[1:])
+    if offsets[-1] == 0:
+        return offsets, np.zeros(shape=(0,), dtype=np.int64)
+    return offsets, np.concatenate(blocks).astype(np.int64)
+
+
+def _gather(offsets, flat, rows):
+    r"""Expand the CSR rows :code:`rows`, returning the position in
+    :code:`rows` and the value of each entry, grouped by position."""
+    counts = offsets[rows + 1] - offsets[rows]
+    total = counts.sum()
+    within = np.arange(total, dtype=np.int64) \
+        - np.repeat(np.cumsum(counts) - counts, counts)
+    return (np.repeat(np.arange(rows.shape[0], dtype=np.int64), counts),
+            flat[np.repeat(offsets[rows], counts) + within])
+
+
+def _merge(relation, adults, slot, dropped, edits):
+    r"""Re-pack a :class:`PackedRelation` for new adults and slots.  The
+    arrays of the adults marked in the boolean array dropped are left out,
+    and those of the adults in the dictionary edits are replaced by the
+    given lists.  Each array is sorted."""
+    offsets, flat = relation.compact()
+    keys = np.repeat(relation.adults, np.diff(offsets))
+    drop = dropped.copy()
+    drop[list(edits.keys())] = True
+    keep = ~drop[keys]
+    edited = np.array(list(edits.keys()), dtype=np.int64)
+    keys = np.concatenate([slot[keys[keep]],
+                           np.repeat(slot[edited], [len(f) for f in edits.values()])])
+    values = np.concatenate([flat[keep], np.array(
+        [a for f in edits.values() for a in f], dtype=np.int64)])
+    sortby = np.lexsort((values, keys))
+    offsets = np.zeros(shape=(adults.shape[0] + 1,), dtype=np.int64)
+    np.cumsum(np.bincount(keys, minlength=adults.shape[0]), out=offsets[1:])
+    return PackedRelation(adults, slot, offsets, values[sortby])
+
+
+def _regroup(level, adults):
+    r"""Reset the children of the given (sorted, unique) adults from the
+    guardians of the level, as sorted arrays."""
+    members = np.flatnonzero(np.in1d(level.guardians, adults))
+    members = members[np.argsort(level.guardians[members], kind='stable')]
+    blocks = np.split(members, np.searchsorted(level.guardians[members], adults[1:]))
+    for a, block in zip(adults, blocks):
+        level.children[a] = block
+
+
+class _Placement(object):
+    r"""Points being placed into the levels of a :class:`CoverTree`, or
+    taken out of them, by :func:`CoverTree._place` and
+    :func:`CoverTree._unplace`.
+
+    The packed relations of the levels are only read while the points are
+    placed.  The changes are kept in the attributes below, keyed by adult,
+    and merged into new packed relations by :func:`repack`.  If an adult
+    would lie within the radius of an adult born at an earlier level, it is
+    demoted: it and the points below it are taken out of the levels from
+    its cohort on, and placed again.
+
+    Parameters
+    ----------
+    covertree : :class:`CoverTree`
+        The tree, already extended to any new points.
+    old_N : int
+        The number of points before the new ones.
+
+    Attributes
+    ----------
+    moved : list of dict
+        For each level, the new guardian of each point that was placed, or -1
+        while it is unplaced.
+    moved_in : list of dict
+        For each level, the points that were placed under each guardian.
+    succ : list of dict
+        For each level, the changed successors, as lists.
+    fr : dict
+        For k in 1, 2, 3, and each level, the changed type-k friends, as
+        lists.
+    births : :class:`collections.OrderedDict`
+        The adults born during the placement, in birth order.
+    pred : dict
+        The predecessors of those adults.
+    stripped : set
+        The old adults that were demoted.
+    pending : dict
+        The first level at which each queued point is still to be placed.
+    removed : :class:`numpy.ndarray`
+        The points taken out, which are left unplaced.
+    """
+
+    def __init__(self, covertree, old_N):
+        self.covertree = covertree
+        self.cohort = covertree.cohort
+        self.levels = [covertree._levels[e] for e in range(len(covertree))]
+        self.L = len(self.levels)
+        self.old_N = old_N
+        self.old_slot = covertree._slot
+        self.old_counts = [level.adults.shape[0] for level in self.levels]
+        self.old_guardians = dict()
+
+        self.stripped = set()
+        self.births = OrderedDict()
+        self.pred = dict()
+        self.moved = [dict() for _ in self.levels]
+        self.moved_in = [collections.defaultdict(set) for _ in self.levels]
+        self.succ = [dict() for _ in self.levels]
+        self.fr = dict((k, [dict() for _ in self.levels]) for k in [1, 2, 3])
+        self.queue = collections.deque()
+        self.pending = dict()
+        self.removed = np.zeros(shape=(0,), dtype=np.int64)
+
+    # Lookups, which see the changes made so far over the packed levels.
+
+    def dists(self, x, cand):
+        r"""The distances from the point x to the points cand."""
+        cand = np.asarray(cand, dtype=np.int64)
+        return fast_algorithms.distance_pairs(
+            x*np.ones(shape=cand.shape, dtype=np.int64), cand,
+            self.covertree.coords, self.covertree.metric)
+
+    def was_adult(self, exponent, a):
+        r"""Whether a was an adult of the level before the placement."""
+        return a < self.old_N and 0 <= self.old_slot[a] < self.old_counts[exponent]
+
+    def successors(self, exponent, a):
+        if a in self.succ[exponent]:
+            return self.succ[exponent][a]
+        if self.was_adult(exponent, a) and a not in self.stripped:
+            return list(self.levels[exponent].successors[a])
+        return [a]
+
+    def friends(self, k, exponent, a):
+        if a in self.fr[k][exponent]:
+            return self.fr[k][exponent][a]
+        return list(getattr(self.levels[exponent], "friends{}".format(k))[a])
+
+    def predecessor(self, exponent, a):
+        if a in self.pred:
+            return self.pred[a] if self.cohort[a] == exponent else a
+        return self.levels[exponent].predecessor[a]
+
+    def candidates(self, k, exponent, a):
+        r"""The successors of the type-k friends of a at the level above."""
+        return np.unique(np.array(
+            [s for f in self.friends(k, exponent - 1, a)
+             for s in self.successors(exponent - 1, f)], dtype=np.int64))
+
+    def guardian(self, exponent, z):
+        if z in self.moved[exponent]:
+            return self.moved[exponent][z]
+        if exponent not in self.old_guardians:
+            self.old_guardians[exponent] = self.levels[exponent].guardians
+        return self.old_guardians[exponent][z]
+
+    def children(self, exponent, a):
+        found = set(self.moved_in[exponent][a])
+        if self.was_adult(exponent, a):
+            found.update(z for z in self.levels[exponent].children[a]
+                         if self.moved[exponent].get(z, a) == a)
+        return found
+
+    # Changes.
+
+    def assign(self, exponent, z, g):
+        r"""Make g the guardian of z at the level, or leave z unplaced there
+        if g is -1."""
+        old = self.moved[exponent].get(z, -1)
+        if old >= 0:
+            self.moved_in[exponent][old].discard(z)
+        self.moved[exponent][z] = g
+        if g >= 0:
+            self.moved_in[exponent][g].add(z)
+
+    def demote(self, b):
+        r"""Take the adult b, and everything below it from its cohort on, out
+        of the levels, and queue those points to be placed again."""
+        L = self.L
+        start = {b: self.cohort[b]}
+        todo = [b]
+        while todo:
+            a = todo.pop()
+            for exponent in range(self.cohort[a], L):
+                for z in self.children(exponent, a):
+                    if z != a and start.get(z, L) > exponent:
+                        if z not in start and self.cohort[z] >= 0:
+                            todo.append(z)
+                        start[z] = exponent
+        for a in [z for z in start if self.cohort[z] >= 0]:
+            c = self.cohort[a]
+            p = self.predecessor(c, a)
+            self.succ[c - 1][p] = [s for s in self.successors(c - 1, p) if s != a]
+            for exponent in range(c, L):
+                for k in [1, 2, 3]:
+                    for f in self.friends(k, exponent, a):
+                        if f != a:
+                            self.fr[k][exponent][f] = [y for y in self.friends(k, exponent, f)
+                                                       if y != a]
+                    self.fr[k][exponent][a] = []
+                self.succ[exponent].pop(a, None)
+            self.cohort[a] = -1
+            self.stripped.add(a)
+            self.pred.pop(a, None)
+            self.births.pop(a, None)
+        for z in sorted(start):
+            for exponent in range(start[z], L):
+                self.assign(exponent, z, -1)
+            if z not in self.pending:
+                self.queue.append(z)
+            self.pending[z] = min(start[z], self.pending.get(z, L))
+
+    def befriend(self, exponent, x):
+        r"""Repair the friends of the level for the adult x.  Adults born at
+        the same level within its radius are demoted first."""
+        level = self.levels[exponent]
+        while True:
+            cand = self.candidates(3, exponent, self.predecessor(exponent, x))
+            cand = cand[cand != x]
+            d = self.dists(x, cand)
+            clash = cand[np.logical_and(d <= level.radius,
+                                        self.cohort[cand] == exponent)]
+            if self.cohort[x] == exponent or clash.shape[0] == 0:
+                break
+            for c in clash:
+                if self.cohort[c] == exponent:
+                    self.demote(c)
+        for k, T in [(1, level.T1), (2, level.T2), (3, level.T3)]:
+            near = cand[d <= T]
+            self.fr[k][exponent][x] = [x] + list(near)
+            for f in near:
+                self.fr[k][exponent][f] = self.friends(k, exponent, f) + [x]
+
+
+    def place(self, x, start):
+        r"""Let the point x descend the levels from start on, below its
+        guardian at the level above.  It keeps its guardian while it is close
+        enough, is adopted by the nearest successor of the type-1 friends of
+        its guardian, or else is born as an adult and befriended."""
+        g = self.guardian(start - 1, x)
+        for exponent in range(start, self.L):
+            R = self.levels[exponent].radius
+            if 0 <= self.cohort[x] < exponent:
+                g = x
+                self.befriend(exponent, x)
+            elif self.dists(x, [g])[0] > R:
+                cand = self.candidates(1, exponent, g)
+                d = self.dists(x, cand)
+                j = d.argmin()
+                if d[j] <= R:
+                    g = cand[j]
+                else:
+                    self.cohort[x] = exponent
+                    self.births[x] = True
+                    self.pred[x] = g
+                    self.succ[exponent - 1][g] = self.successors(exponent - 1, g) + [x]
+                    self.befriend(exponent, x)
+                    g = x
+            if self.cohort[x] < 0 and self.covertree.exchange_teens \
+                    and self.dists(x, [g])[0] > 0.5*R:
+                cand = self.candidates(2, exponent, self.predecessor(exponent, g))
+                g = cand[self.dists(x, cand).argmin()]
+            self.assign(exponent, x, g)
+
+    def adopt_new(self, new):
+        r"""Queue the new points, below the adult of level 0."""
+        adult0 = self.covertree._adult0
+        for x in new:
+            self.assign(0, x, adult0)
+            self.queue.append(x)
+            self.pending[x] = 1
+
+    def reguard(self, removed):
+        r"""Take the removed points out.  A removed adult is demoted, and the
+        points below it are placed again, like the orphans of an adult that
+        moved away.  The removed points are left unplaced at every level."""
+        self.removed = removed
+        for z in removed:
+            if self.cohort[z] >= 0:
+                self.demote(z)
+        for z in removed:
+            self.pending.pop(z, None)
+            for exponent in range(self.L):
+                self.assign(exponent, z, -1)
+        self.place_pending()
+
+    def place_pending(self):
+        r"""Place the queued points, including those queued by demotions on
+        the way."""
+        while self.queue:
+            x = self.queue.popleft()
+            if x not in self.pending:
+                continue
+            self.place(x, self.pending.pop(x))
+        self.old_guardians = None
+
+    # Re-packing, from the deepest level up, so that the successors of a
+    # level can be read from the predecessors of the level below.
+
+    def repack(self):
+        r"""Re-number the adults in birth order, where the adults born here
+        follow the old adults of their cohort, and re-pack every level."""
+        ct = self.covertree
+        old_born = ct._born[:self.old_counts[-1]]
+        self.is_stripped = np.zeros(shape=(ct.N,), dtype='bool')
+        self.is_stripped[list(self.stripped)] = True
+        self.alive = np.ones(shape=(ct.N,), dtype='bool')
+        self.alive[self.removed] = False
+        self.born_here = np.array(list(self.births), dtype=np.int64)
+        everyone = np.concatenate([old_born[~self.is_stripped[old_born]], self.born_here])
+        everyone = everyone[np.argsort(self.cohort[everyone], kind='stable')]
+        ct._born = -1*np.ones(shape=(ct.N,), dtype=np.int64)
+        ct._born[:everyone.shape[0]] = everyone
+        ct._slot = -1*np.ones(shape=(ct.N,), dtype=np.int64)
+        ct._slot[everyone] = np.arange(everyone.shape[0], dtype=np.int64)
+        counts = np.searchsorted(self.cohort[everyone], np.arange(self.L), side='right')
+
+        for exponent in range(self.L - 1, -1, -1):
+            level = self.levels[exponent]
+            adults = ct._born[:counts[exponent]]
+            adults.flags.writeable = False
+            kept = ~self.is_stripped[level.adults]
+            affected, blocks, guardians = self.repack_children(exponent, adults, kept)
+            self.repack_friends(exponent, adults)
+            self.repack_lineage(exponent, adults, kept)
+            self.reweight(exponent, adults, kept, affected, blocks)
+            level.entropy = OrderedDict()
+            if level._guardians is not None:
+                level.guardians = guardians
+            level.adults = adults
+            if exponent == self.L - 1:
+                self.recount(exponent, affected, blocks)
+
+    def repack_children(self, exponent, adults, kept):
+        r"""The children of the level.  The blocks of kept adults stay where
+        they are in :code:`CoverTree._children_pool`, and those of the
+        affected adults, whose children changed, are appended.  Returns the
+        affected adults, their blocks, and the new guardians."""
+        ct = self.covertree
+        level = self.levels[exponent]
+        old = level.adults
+        slot = ct._slot
+        guardians = -1*np.ones(shape=(ct.N,), dtype=np.int64)
+        guardians[:self.old_N] = level.guardians[:self.old_N]
+        points = np.array(list(self.moved[exponent].keys()), dtype=np.int64)
+        before = guardians[points]
+        guardians[points] = list(self.moved[exponent].values())
+        assert np.all(guardians[self.alive] >= 0), "Points left unplaced."
+        affected = np.unique(np.concatenate([before, guardians[points]]))
+        affected = affected[affected >= 0]
+        affected = affected[np.logical_and(self.cohort[affected] >= 0,
+                                           self.cohort[affected] <= exponent)]
+
+        relation = level.children
+        if relation.flat is not ct._children_pool:
+            offsets, flat = relation.compact()
+            first = ct._store_children(flat)
+            relation = PackedRelation(old, relation.slot, first + offsets[:-1],
+                                      ct._children_pool, stops=first + offsets[1:])
+        n = adults.shape[0]
+        starts = np.zeros(shape=(n,), dtype=np.int64)
+        stops = np.zeros(shape=(n,), dtype=np.int64)
+        starts[slot[old[kept]]] = relation.starts[kept]
+        stops[slot[old[kept]]] = relation.stops[kept]
+        members = np.flatnonzero(np.in1d(guardians, affected))
+        members = members[np.argsort(guardians[members], kind='stable')]
+        blocks = np.split(members, np.searchsorted(guardians[members], affected[1:]))
+        offsets, flat = _pack(blocks)
+        first = ct._store_children(flat)
+        starts[slot[affected]] = first + offsets[:-1]
+        stops[slot[affected]] = first + offsets[1:]
+        level.children = PackedRelation(adults, slot, starts,
+                                        ct._children_pool, stops=stops)
+        return affected, blocks, guardians
+
+    def repack_friends(self, exponent, adults):
+        r"""Merge the changed friends of the level."""
+        level = self.levels[exponent]
+        for k in [1, 2, 3]:
+            name = "friends{}".format(k)
+            edits = dict((a, f) for a, f in self.fr[k][exponent].items()
+                         if 0 <= self.cohort[a] <= exponent)
+            setattr(level, name, _merge(getattr(level, name), adults,
+                                        self.covertree._slot, self.is_stripped, edits))
+
+    def repack_lineage(self, exponent, adults, kept):
+        r"""The successors of the level, from the predecessors of the level
+        below, which is re-packed already, and the predecessors of the
+        level."""
+        level = self.levels[exponent]
+        slot = self.covertree._slot
+        n = adults.shape[0]
+        if exponent < self.L - 1:
+            below = self.levels[exponent + 1]
+            rows = slot[below.predecessor.data]
+            order = np.argsort(rows, kind='stable')
+            offsets = np.zeros(shape=(n + 1,), dtype=np.int64)
+            np.cumsum(np.bincount(rows, minlength=n), out=offsets[1:])
+            level.successors = PackedRelation(adults, slot, offsets,
+                                              below.adults[order])
+        if exponent > 0:
+            fresh = self.born_here[self.cohort[self.born_here] <= exponent]
+            data = np.zeros(shape=(n,), dtype=np.int64)
+            data[slot[level.adults[kept]]] = level.predecessor.data[kept]
+            data[slot[fresh]] = [self.pred[a] if self.cohort[a] == exponent else a
+                                 for a in fresh]
+            level.predecessor = PackedValues(adults, slot, data)
+
+    def reweight(self, exponent, adults, kept, affected, blocks):
+        r"""The label weights of the level.  Those of the affected adults are
+        counted again from their children."""
+        ct = self.covertree
+        level = self.levels[exponent]
+        labels = ct.pointcloud.labels
+        masses = ct.pointcloud.stratum[0]['mass'].values
+        num_labels = ct.label_set.shape[0]
+        data = np.zeros(shape=(adults.shape[0], num_labels), dtype=np.float64)
+        data[ct._slot[level.adults[kept]]] = level.weights.data[kept]
+        for a, block in zip(affected, blocks):
+            data[ct._slot[a]] = np.bincount(labels[block], weights=masses[block],
+                                            minlength=num_labels)
+        level.weights = PackedValues(adults, ct._slot, data)
+
+    def recount(self, exponent, affected, blocks):
+        r"""Count the duplicates of the affected adults of the deepest level,
+        which are counted already."""
+        multiplicity = self.covertree.pointcloud.multiplicity
+        multiplicity[list(self.stripped)] = 1
+        for a, block in zip(affected, blocks):
+            if self.cohort[a] < exponent:
+                multiplicity[a] = np.count_nonzero(self.dists(a, block) == 0.0)
+
+
+class _PackedMapping(Mapping):
+    r""" Lookup of adults by slot, shared by :class:`PackedRelation` and
+    :class:`PackedValues`. """
+    def __init__(self, adults, slot):
+        self.adults = adults
+        self.slot = slot
+
+    def _find(self, adult):
+        if not 0 <= adult < self.slot.shape[0]:
+            return -1
+        s = self.slot[adult]
+        return s if s < self.adults.shape[0] else -1
+
+    def __contains__(self, adult):
+        return self._find(adult) >= 0
+
+    def __iter__(self):
+        return iter(self.adults)
+
+    def __len__(self):
+        return self.adults.shape[0]
+
+
+class PackedRelation(_PackedMapping):
+    r"""
+    A read-only mapping from the adults of a :class:`CoverLevel` to arrays of
+    indices (children, friends or successors), packed as CSR arrays.
+
+    The adult in slot :code:`s` maps to :code:`flat[offsets[s]:offsets[s+1]]`,
+    or to :code:`flat[offsets[s]:stops[s]]` if stops are given, so that
+    blocks of a shared flat array can be reused by several levels.
+    The slots come from :code:`CoverTree._slot`, which is shared by all
+    levels, so a level needs no dictionary of its own.  Iteration follows
+    the adults, in birth order.
+
+    Parameters
+    ----------
+    adults : :class:`numpy.ndarray`
+        The adults of the level, in birth order.
+    slot : :class:`numpy.ndarray`
+        The slot of each point.  Slots :code:`0, ..., len(adults)-1` belong to
+        the adults.
+    offsets : :class:`numpy.ndarray`
+        Array of :code:`len(adults)+1` positions in flat, or of
+        :code:`len(adults)` starting positions if stops are given.
+    flat : :class:`numpy.ndarray`
+        The concatenated arrays.
+    stops : :class:`numpy.ndarray` or None
+        Array of :code:`len(adults)` end positions in flat.  Default: None
+
+    Examples
+    --------
+
+    >>> adults = np.array([4, 1])
+    >>> slot = np.array([-1, 1, -1, -1, 0])
+    >>> rel = PackedRelation.from_blocks(adults, slot, {4: [4, 0], 1: [1, 2, 3]})
+    >>> rel[1].tolist()
+    [1, 2, 3]
+    >>> list(rel.keys())
+    [4, 1]
+    >>> 0 in rel
+    False
+
+    """
+    def __init__(self, adults, slot, offsets, flat, stops=None):
+        _PackedMapping.__init__(self, adults, slot)
+        if stops is None:
+            self.offsets = offsets
+            self.starts = offsets[:-1]
+            self.stops = offsets[1:]
+        else:
+            self.offsets = None
+            self.starts = offsets
+            self.stops = stops
+        self.flat = flat
+
+    @classmethod
+    def from_blocks(cls, adults, slot, blocks):
+        r""" Pack a dictionary of arrays (or lists), keyed by the adults. """
+        offsets, flat = _pack([blocks[a] for a in adults])
+        return cls(adults, slot, offsets, flat)
+
+    def compact(self):
+        r""" The (offsets, flat) arrays of this relation alone, with
+        :code:`offsets[0] == 0`. """
+        if self.offsets is not None:
+            first, last = self.offsets[0], self.offsets[-1]
+            return self.offsets - first, self.flat[first:last]
+        counts = self.stops - self.starts
+        offsets = np.zeros(shape=(counts.shape[0] + 1,), dtype=np.int64)
+        np.cumsum(counts, out=offsets[1:])
+        within = np.arange(offsets[-1], dtype=np.int64) - np.repeat(offsets[:-1], counts)
+        return offsets, self.flat[np.repeat(self.starts, counts) + within]
+
+    def __getitem__(self, adult):
+        s = self._find(adult)
+        if s < 0:
+            raise KeyError(adult)
+        return self.flat[self.starts[s]:self.stops[s]]
+
+    def __sizeof__(self):
+        return object.__sizeof__(self) + self.starts.nbytes + self.stops.nbytes \
+            + (self.stops - self.starts).sum()*self.flat.itemsize
+
+    def __repr__(self):
+        return "PackedRelation of {} adults and {} entries".format(
+            len(self), (self.stops - self.starts).sum())
+
+
+class PackedValues(_PackedMapping):
+    r"""
+    A read-only mapping from the adults of a :class:`CoverLevel` to one value
+    (or one row) each, such as predecessors or label weights.  The adult in
+    slot :code:`s` maps to :code:`data[s]`.
+
+    Parameters
+    ----------
+    adults : :class:`numpy.ndarray`
+        The adults of the level, in birth order.
+    slot : :class:`numpy.ndarray`
+        The slot of each point, as in :class:`PackedRelation`
+    data : :class:`numpy.ndarray`
+        One entry (or row) per adult, in birth order.
+
+    """
+    def __init__(self, adults, slot, data):
+        _PackedMapping.__init__(self, adults, slot)
+        self.data = data
+
+    @classmethod
+    def from_blocks(cls, adults, slot, blocks):
+        r""" Pack a dictionary of values (or rows), keyed by the adults. """
+        return cls(adults, slot, np.array([blocks[a] for a in adults]))
+
+    def __getitem__(self, adult):
+        s = self._find(adult)
+        if s < 0:
+            raise KeyError(adult)
+        return self.data[s]
+
+    def __sizeof__(self):
+        return object.__sizeof__(self) + self.data.nbytes
+
+    def __repr__(self):
+        return "PackedValues of {} adults".format(len(self))
+
+
 class CoverLevel(object):
     r"""
     A thin class to represent one level of the filtration in a :class:`CoverTree`.
@@ -760,6 +2276,13 @@ class CoverLevel(object):
     The various attributes have different orderings, optimized for typical
     usage and minimal algorithmic complexity.
 
+    While a level is being computed, its attributes are dictionaries of
+    lists and arrays.  Once it is complete, :func:`pack` replaces them by
+    :class:`PackedRelation` and :class:`PackedValues` objects, which are
+    read-only mappings keyed by the adults with the same access patterns,
+    but with a few flat arrays per relation instead of one Python object
+    per adult.
+
     Notes
     -----
     The user should never create a CoverLevel directly.  Instead, create a
@@ -784,36 +2307,42 @@ class CoverLevel(object):
         The type-2 friends radius
     T3 : :class:`numpy.float64`
         The type-3 friends radius
-    adults : `list`
-        List of adult indices, in order they were born
-    friends1 : :class:`collections.OrderedDict`
-        An ordered dictionary to keep track of type-1 friends. Keyed by the
-        adults, in birth order.  The values are lists, in index order.
-    friends2 : :class:`collections.OrderedDict`
-        An ordered dictionary to keep track of type-2 friends. Keyed by the
-        adults, in birth order.  The values are lists, in index order.
-    friends3 : :class:`collections.OrderedDict`
-        An ordered dictionary to keep track of type-3 friends. Keyed by the
-        adults, in birth order. The values are lists, in index order.
+    adults : :class:`numpy.ndarray`
+        Array of adult indices, in order they were born.  This is a read-only
+        view of :code:`CoverTree._born`.
+    friends1 : :class:`PackedRelation`
+        Keeps track of type-1 friends. Keyed by the
+        adults, in birth order.  The values are arrays, in index order.
+    friends2 : :class:`PackedRelation`
+        Keeps track of type-2 friends. Keyed by the
+        adults, in birth order.  The values are arrays, in index order.
+    friends3 : :class:`PackedRelation`
+        Keeps track of type-3 friends. Keyed by the
+        adults, in birth order. The values are arrays, in index order.
     guardians : :class:`numpy.ndarray` 
         An array of :class:`numpy.int64`, which keeps track of the guardians
         of each point in the underlying `PointCloud`.  Adults are their own
-        guardians.
-    predecessor : :class:`collections.OrderedDict`
-        An ordered dictionary to keep track of predecessors of the adults.
+        guardians.  The next level starts from a copy of this array, after
+        which this level drops it.  On first access it is rebuilt from the
+        children, once, as a read-only array, which is kept until the
+        children are replaced.
+    predecessor : :class:`PackedValues`
+        Keeps track of predecessors of the adults.
         Keyed by the adults, in birth order.  The values are
-        the indices of adults at the previous `CoverLevel`.
-    successors : :class:`collections.OrderedDict`
-        An ordered dictionary to keep track of predecessors of the adults.
+        the indices of adults at the previous `CoverLevel`.  At level 0, this
+        is an ordered dictionary, whose only value is None.
+    successors : :class:`PackedRelation`
+        Keeps track of successors of the adults.
         Keyed by the adults, in birth order.  The values are
         NumPy arrays of indices of adults in the next `CoverLevel`.  This is
-        computed only at the next level!
-    children : :class:`collections.OrderedDict`
-        An ordered dictionary to keep track of children1 friends, keyed by the
-        adults, in birth order.  The values are NumPy boolean arrays, which
-        allows for easy extraction of subsets of children. 
-    weights : :class:`collections.OrderedDict`
-        An ordered dictionary to keep track of total weight of children, keyed 
+        computed only at the next level!  Until then, it is an empty
+        ordered dictionary.
+    children : :class:`PackedRelation`
+        Keeps track of children, keyed by the
+        adults, in birth order.  The values are sorted NumPy arrays of
+        indices.
+    weights : :class:`PackedValues`
+        Keeps track of total weight of children, keyed 
         by the adults, in birth order.  The values are NumPy arrays, with one
         entry per label.  This is computed as part of :func:`cleanup`
     entropy : :class:`collections.OrderedDict`
@@ -821,7 +2350,7 @@ class CoverLevel(object):
         by the adults, in birth order.  The values are :class:`numpy.float64` 
         numbers, of overall entropy of weights across labels.  This is computed
         and stored via :class:`multidim.models.CDER`, but it otherwise
-        unused.
+        unused.  It is filled lazily, so it stays an ordered dictionary.
     """
     def __init__(self, covertree, exponent):
         self.covertree = covertree
@@ -839,28 +2368,59 @@ class CoverLevel(object):
         self.friends3 = OrderedDict()  # each entry should be a LIST
 
         self.guardians = None
+        self._shared = None
         self.predecessor = OrderedDict()  # each entry an ARRAY
         self.successors = OrderedDict()   # each entry an ARRAY
         self.children = OrderedDict()  # each entry a np.uint8 ARRAY
         self.weights = OrderedDict()  # each entry a np array by label
         self.entropy = OrderedDict()  # each entry a np.float64
 
+    @property
+    def guardians(self):
+        r""" The adult guarding each point.  Once a level is packed and its
+        array has been handed to the next level, this is rebuilt from the
+        children, once, as a read-only array. """
+        if self._guardians is None and isinstance(self.children, PackedRelation):
+            if self._rebuilt is None:
+                offsets, flat = self.children.compact()
+                guardians = -1*np.ones(shape=(self.covertree.N,), dtype=np.int64)
+                guardians[flat] = np.repeat(self.adults, np.diff(offsets))
+                guardians.flags.writeable = False
+                self._rebuilt = guardians
+            return self._rebuilt
+        return self._guardians
+
+    @guardians.setter
+    def guardians(self, value):
+        self._guardians = value
+
+    @property
+    def children(self):
+        return self._children
+
+    @children.setter
+    def children(self, value):
+        self._children = value
+        self._rebuilt = None
+
     def check(self):
         r""" Perform basic sanity checks on children, friends, etc. 
         Throws `AssertionError` if anyhting fails.
         """
         
-        assert type(self.adults) == list
-        assert type(self.friends1) == OrderedDict
-        assert type(self.friends2) == OrderedDict
-        assert type(self.friends3) == OrderedDict
-        assert type(self.predecessor) == OrderedDict
-        assert type(self.successors) == OrderedDict
-        assert type(self.weights) == OrderedDict
+        assert type(self.adults) == np.ndarray
+        assert type(self.children) == PackedRelation
+        assert type(self.friends1) == PackedRelation
+        assert type(self.friends2) == PackedRelation
+        assert type(self.friends3) == PackedRelation
+        assert type(self.predecessor) in [PackedValues, OrderedDict]
+        assert type(self.successors) in [PackedRelation, OrderedDict]
+        assert type(self.weights) == PackedValues
         assert type(self.entropy) == OrderedDict
 
-        assert type(self.guardians) == np.ndarray\
-            and self.guardians.shape == (self.covertree.N, )
+        guardians = self.guardians
+        assert type(guardians) in [np.ndarray, np.memmap]\
+            and guardians.shape == (self.covertree.N, )
 
         adult_set = set(self.adults)
         assert len(adult_set) == len(self.adults)
@@ -877,15 +2437,15 @@ class CoverLevel(object):
         assert set(self.entropy.keys()) == set() or set(self.entropy.keys()) == adult_set,\
             "Mismatched adults and entropy keys"
 
-        assert set(list(self.guardians)) == adult_set, "Mismatched guardians and adults."
+        assert set(list(guardians)) == adult_set, "Mismatched guardians and adults."
 
         # cannot check successors without violating something..
 
         union = np.array([], dtype=np.int64)
         for ci in self.adults:
-            assert type(self.friends1[ci]) == list
-            assert type(self.friends2[ci]) == list
-            assert type(self.friends3[ci]) == list
+            assert type(self.friends1[ci]) == np.ndarray
+            assert type(self.friends2[ci]) == np.ndarray
+            assert type(self.friends3[ci]) == np.ndarray
             assert type(self.children[ci]) == np.ndarray\
                 and self.children[ci].dtype == 'int64'\
                 and self.children[ci].shape[0] <= self.covertree.N
@@ -897,7 +2457,7 @@ class CoverLevel(object):
             assert ci in self.friends1[ci]
             assert ci in self.friends2[ci]
             assert ci in self.friends3[ci]
-            assert self.guardians[ci] == ci
+            assert guardians[ci] == ci
             assert ci in self.children[ci]
 
             assert np.intersect1d(union, self.children[ci]).shape[0] == 0,\
@@ -935,6 +2495,32 @@ class CoverLevel(object):
         return "Level {} using {} adults at radius {}".format(
             self.exponent, len(self.adults), self.radius)
 
+    def _pack_children(self):
+        r""" Pack the children into :code:`CoverTree._children_pool`,
+        reusing the blocks that are still shared with the previous level.
+        """
+        tree = self.covertree
+        n = self.adults.shape[0]
+        starts = np.zeros(shape=(n,), dtype=np.int64)
+        stops = np.zeros(shape=(n,), dtype=np.int64)
+        reuse = np.zeros(shape=(n,), dtype='bool')
+        if self._shared is not None:
+            prev = tree._levels[self.exponent - 1].children
+            m = len(prev)
+            if prev.flat is tree._children_pool:
+                reuse[:m] = [self._shared[a] is self.children[a] for a in prev.adults]
+            starts[:m][reuse[:m]] = prev.starts[reuse[:m]]
+            stops[:m][reuse[:m]] = prev.stops[reuse[:m]]
+        self._shared = None
+
+        new = np.flatnonzero(~reuse)
+        offsets, flat = _pack([self.children[a] for a in self.adults[new]])
+        first = tree._store_children(flat)
+        starts[new] = first + offsets[:-1]
+        stops[new] = first + offsets[1:]
+        return PackedRelation(self.adults, tree._slot, starts, tree._children_pool,
+                              stops=stops)
+
     def find_label_weights(self, adult):
         r""" Compute the weights of labelled children of an adult. 
         Store it in self.weights[adult].
@@ -1022,6 +2608,31 @@ class CoverLevel(object):
             self.friends2[ca] = sorted(list(set(self.friends2[ca])))
             self.friends3[ca] = sorted(list(set(self.friends3[ca])))
             self.find_label_weights(ca)
+
+    def pack(self):
+        r""" Internal method -- once the level is complete, record its new
+        adults in :code:`CoverTree._born`, and pack its children, friends,
+        predecessors and weights.  The successors are packed by the next
+        level.
+        """
+        tree = self.covertree
+        adults = np.array(self.adults, dtype=np.int64)
+        new = adults[tree._slot[adults] < 0]
+        n = adults.shape[0]
+        n0 = n - new.shape[0]
+        assert np.all(tree._born[:n0] == adults[:n0]), "Adults out of birth order."
+        tree._born[n0:n] = new
+        tree._slot[new] = np.arange(n0, n, dtype=np.int64)
+        self.adults = tree._born[:n]
+        self.adults.flags.writeable = False
+
+        self.children = self._pack_children()
+        self.friends1 = PackedRelation.from_blocks(self.adults, tree._slot, self.friends1)
+        self.friends2 = PackedRelation.from_blocks(self.adults, tree._slot, self.friends2)
+        self.friends3 = PackedRelation.from_blocks(self.adults, tree._slot, self.friends3)
+        if self.exponent > 0:
+            self.predecessor = PackedValues.from_blocks(self.adults, tree._slot, self.predecessor)
+        self.weights = PackedValues.from_blocks(self.adults, tree._slot, self.weights)
  
     def plot(self, canvas, show_balls=True, show_adults=True, show_hulls=False, color='purple'):
         """
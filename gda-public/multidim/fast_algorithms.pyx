@@ -1,6 +1,8 @@
 # coding=utf-8
 # cython: boundscheck=True, linetrace=True
 # distutils: define_macros=CYTHON_TRACE_NOGIL=1
+# distutils: extra_compile_args=-fopenmp
+# distutils: extra_link_args=-fopenmp
 
 r""" 
 This Cython module contains core algorithms for multidimensional data.
@@ -27,6 +29,17 @@ for further information. For this module, these C-only functions include
 
  - :func:`is_partition_bool`
  - :func:`is_partition_list`
+ - :func:`euclidean_kernel`
+ - :func:`metric_pair`
+ - :func:`metric_kernel`
+ - :func:`pairs_kernel`
+ - :func:`pair_greater`
+ - :func:`heap_sift_down`
+ - :func:`group_k_smallest_kernel`
+ - :func:`group_k_smallest_row`
+ - :func:`heap_sift_up`
+ - :func:`group_kth_weighted_kernel`
+ - :func:`group_kth_weighted_row`
 
 Copyright
 ---------
@@ -49,8 +62,28 @@ ctypedef np.int64_t NINT_t
 ctypedef np.float64_t NDBL_t
 ctypedef np.uint8_t NBIT_t
 
+cimport cython
+from cython.parallel cimport prange
+from libc.math cimport sqrt, fabs, pow, INFINITY
+
 # For convenient indexing
 import itertools
+import collections
+
+# Blocks with at least this many pairs are computed in parallel threads.
+PARALLEL_MIN_PAIRS = 4096
+# Blocks with at least this many pairs AND at least this many coordinates use
+# the squared-norm/Gram-matrix expansion, which hands the work to BLAS.
+GRAM_MIN_PAIRS = 65536
+GRAM_MIN_DIM = 16
+
+# Codes of the compiled metrics.  See :class:`Metric`.
+cdef enum:
+    METRIC_EUCLIDEAN = 0
+    METRIC_CITYBLOCK = 1
+    METRIC_CHEBYSHEV = 2
+    METRIC_COSINE = 3
+    METRIC_MINKOWSKI = 4
 
 from scipy.spatial.distance import euclidean, cdist
 
@@ -275,30 +308,85 @@ cpdef np.ndarray[NDBL_t, ndim=1] gaussian(
     return np.exp(exponent)/denom
 
 
-cpdef edges_from_dists(np.ndarray[NINT_t] idx, np.ndarray[NDBL_t, ndim=2] dists, NDBL_t cutoff):
+cpdef edges_from_dists(np.ndarray[NINT_t] idx, object dists, NDBL_t cutoff,
+                       NINT_t chunk=1048576):
+    r""" All edges between points of a distance matrix, sorted by length.
+
+    The distances are read `chunk` entries at a time, and those not below
+    the cutoff are dropped before anything is sorted, so a memory-mapped
+    matrix is never loaded whole.  Ties keep the order of
+    :func:`itertools.combinations`.
+
+    Parameters
+    ----------
+    idx : :class:`numpy.ndarray`
+        Index of each point, as used for the boundaries of the edges.
+    dists : :class:`numpy.ndarray`
+        Either a symmetric NxN array, or the condensed vector of length
+        N(N-1)/2 from :func:`scipy.spatial.distance.pdist`.
+    cutoff : float
+        If cutoff >= 0, keep only the edges of length < cutoff.
+    chunk : int
+        Number of distances to read at a time.  Default: 1048576
+
+    Returns
+    -------
+    val, pos, bdy : :class:`numpy.ndarray`
+        Lengths, positivity, and Nx2 boundaries of the edges.
+    """
     cdef NINT_t n = idx.shape[0]
-    cdef NINT_t n2 = n*(n-1)/2
-    cdef np.ndarray[NINT_t, ndim=2] bdy = np.ndarray(shape=(n2,2), dtype=np.int64)
-    cdef np.ndarray[NDBL_t] val = np.ndarray(shape=(n2,), dtype=np.float64)
-    cdef np.ndarray[NBIT_t, cast=True] pos = np.ndarray(shape=(n2,), dtype=np.uint8)
-    cdef NINT_t ct, i,j
-    for ct,(i,j) in enumerate(itertools.combinations(range(n),2)):
-        bdy[ct][0]=idx[i]
-        bdy[ct][1]=idx[j]
-        val[ct]=dists[i,j]
-        pos[ct]=True
-    
-    cdef np.ndarray[NINT_t] sortby = val.argsort()
-    val = val[sortby]
-    
-    cdef NINT_t end
+    cdef NINT_t a, b, step
+    # condensed index of each pair (i, i+1)
+    cdef np.ndarray[NINT_t] starts = np.arange(n)*n - np.arange(n)*(np.arange(n) + 1)//2
+
+    # without a cutoff, the edges are gathered in order of condensed index,
+    # so the sorting order is the condensed index.
+    vals = [np.zeros(shape=(0,), dtype=np.float64)]
+    keys = [np.zeros(shape=(0,), dtype=np.int64)]
+    if dists.ndim == 2:
+        step = max(1, chunk//max(n, 1))
+        for a in range(0, n, step):
+            b = min(a + step, n)
+            block = np.asarray(dists[a:b], dtype=np.float64)
+            keep = np.arange(n) > np.arange(a, b)[:, np.newaxis]
+            if cutoff >= 0.0:
+                keep &= block < cutoff
+            i, j = np.nonzero(keep)
+            vals.append(block[i, j])
+            if cutoff >= 0.0:
+                keys.append(starts[i + a] + j - i - a - 1)
+    else:
+        for a in range(0, dists.shape[0], chunk):
+            block = np.asarray(dists[a:a + chunk], dtype=np.float64)
+            if cutoff >= 0.0:
+                k = np.flatnonzero(block < cutoff)
+                vals.append(block[k])
+                keys.append(k + a)
+            else:
+                vals.append(block.copy())
+
+    val = np.concatenate(vals)
+    del vals
+    order = np.argsort(val, kind='stable')
+    val = val[order]
     if cutoff >= 0.0:
-        end = np.searchsorted(val,cutoff)
-        sortby = sortby[:end]
-        val = val[:end]
-    pos = pos[sortby]
-    bdy = bdy[sortby]
-    return val,pos,bdy #pass #return src,dst,val,pos
+        key = np.concatenate(keys)[order]
+        del order
+    else:
+        key = order
+    del keys
+
+    # recover the pairs from the condensed index, a chunk at a time.
+    cdef np.ndarray[NINT_t, ndim=2] bdy = np.ndarray(shape=(key.shape[0], 2), dtype=np.int64)
+    for a in range(0, key.shape[0], chunk):
+        k = key[a:a + chunk]
+        i = np.searchsorted(starts, k, side='right') - 1
+        bdy[a:a + chunk, 0] = idx[i]
+        bdy[a:a + chunk, 1] = idx[k - starts[i] + i + 1]
+    del key
+    pos = np.ones(shape=val.shape, dtype='bool')
+    return val, pos, bdy
+
 
 cpdef NBIT_t covertree_befriend321(object coverlevel, object prev_level,
                                  NINT_t pre_i, 
@@ -329,7 +417,8 @@ cpdef NBIT_t covertree_befriend321(object coverlevel, object prev_level,
             suc_j = prev_level.successors[pre_j]
 
             #assert suc_i.size > 0 and suc_j.size > 0
-            dists = distance_cache_None(suc_i, suc_j, coverlevel.covertree.coords) 
+            dists = distance_cache_None(suc_i, suc_j, coverlevel.covertree.coords,
+                                        coverlevel.covertree.metric)
             pairs3 = np.array(np.where(dists <= T3)).T
             #assert dists.shape[0] == suc_i.shape[0]
             #assert dists.shape[1] == suc_j.shape[0]
@@ -384,7 +473,8 @@ cpdef np.ndarray[NINT_t] covertree_adopt_or_liberate(object coverlevel,
     for old_f1 in prev_level.friends1[old_guardian]:
         fosters.extend(prev_level.successors[old_f1])
 
-    fosters = list(set(fosters))
+    # ties go to the lowest index
+    fosters = sorted(set(fosters))
 
     cdef np.ndarray[NINT_t] orphan_array = np.array([orphan_index], dtype=np.int64)
     cdef np.ndarray[NINT_t] fosters_array = np.array(fosters, dtype=np.int64)
@@ -395,7 +485,7 @@ cpdef np.ndarray[NINT_t] covertree_adopt_or_liberate(object coverlevel,
     cdef np.ndarray[NBIT_t, cast=True] npc 
     if fosters_array.size > 0:
         new_dists = distance_cache_None(orphan_array, fosters_array,
-            coverlevel.covertree.coords).flatten()
+            coverlevel.covertree.coords, coverlevel.covertree.metric, False).flatten()
 #pointcloud.dists(suc_i, suc_j)
         #new_dists = coverlevel.pointcloud.dists(orphan_array, fosters_array)[0,:] 
         i = new_dists.argmin()
@@ -423,7 +513,8 @@ cpdef np.ndarray[NINT_t, ndim=2] covertree_exchange_teens(object coverlevel, obj
     """
     cdef NDBL_t R = coverlevel.radius
     cdef np.ndarray[NDBL_t] childrenR  = distance_cache_None(
-        np.array([ci], dtype=np.int64), coverlevel.children[ci], coverlevel.covertree.coords).flatten()
+        np.array([ci], dtype=np.int64), coverlevel.children[ci], coverlevel.covertree.coords,
+        coverlevel.covertree.metric, False).flatten()
     cdef np.ndarray[NINT_t] teens = coverlevel.children[ci][childrenR > 0.5*R]
     
     cdef np.ndarray[NINT_t] old_f2s = np.array(
@@ -436,9 +527,11 @@ cpdef np.ndarray[NINT_t, ndim=2] covertree_exchange_teens(object coverlevel, obj
     new_grd = []
     for f2 in old_f2s:
         new_grd.extend(prev_level.successors[f2])
-    cdef np.ndarray[NINT_t] new_guardians = np.array(new_grd)
+    # ties go to the lowest index
+    cdef np.ndarray[NINT_t] new_guardians = np.sort(np.array(new_grd, dtype=np.int64))
      
-    cdef np.ndarray[NDBL_t, ndim=2] teen_dists = distance_cache_None(teens, new_guardians, coverlevel.covertree.coords) 
+    cdef np.ndarray[NDBL_t, ndim=2] teen_dists = distance_cache_None(teens, new_guardians, coverlevel.covertree.coords,
+                                                                     coverlevel.covertree.metric, False)
     cdef np.ndarray[NINT_t] teen_reassignments = teen_dists.argmin(axis=1)
    
     cdef np.ndarray[NINT_t] cgs = coverlevel.guardians
@@ -457,30 +550,957 @@ cpdef np.ndarray[NINT_t, ndim=2] covertree_exchange_teens(object coverlevel, obj
         results[i,1] = cj
     return results
         
+@cython.boundscheck(False)
+@cython.wraparound(False)
+@cython.linetrace(False)
+@cython.profile(False)
+cdef int liberate_kernel(const NINT_t[:] orphans,
+                         const NINT_t[:] group,
+                         const NINT_t[:] friend_offsets,
+                         const NINT_t[:] friends,
+                         const NDBL_t[:, :] cloud,
+                         int code,
+                         NDBL_t p,
+                         const NDBL_t[:] w,
+                         NDBL_t R,
+                         NINT_t[:] head,
+                         NINT_t[:] link,
+                         NBIT_t[:] liberated) nogil:
+    """ The loop of :func:`covertree_liberate`.  The orphans liberated so far
+    are kept in one linked list per group, starting at head. """
+    cdef Py_ssize_t i, q
+    cdef NINT_t j
+    cdef bint claimed
+    for i in range(orphans.shape[0]):
+        claimed = False
+        for q in range(friend_offsets[group[i]], friend_offsets[group[i] + 1]):
+            j = head[friends[q]]
+            while j >= 0:
+                if metric_pair(cloud, orphans[i], cloud, orphans[j], code, p, w) <= R:
+                    claimed = True
+                    break
+                j = link[j]
+            if claimed:
+                break
+        if not claimed:
+            liberated[i] = True
+            link[i] = head[group[i]]
+            head[group[i]] = i
+    return 0
+
+
+cpdef np.ndarray[NBIT_t, cast=True] covertree_liberate(
+                                   np.ndarray[NINT_t] orphans,
+                                   np.ndarray[NINT_t] group,
+                                   np.ndarray[NINT_t] friend_offsets,
+                                   np.ndarray[NINT_t] friends,
+                                   np.ndarray[NDBL_t, ndim=2] cloud,
+                                   object metric,
+                                   NDBL_t R):
+    r""" Decide, in order, which orphans are liberated, exactly as repeated
+    calls to :func:`covertree_adopt_or_liberate` would.
+
+    Only orphans with no old adult within R among their fosters are given.
+    Such an orphan is liberated unless an orphan liberated before it, among
+    its fosters, is within R.
+
+    Parameters
+    ----------
+    orphans : :class:`numpy.ndarray`
+        The orphans, in the order that they are resolved.
+    group : :class:`numpy.ndarray`
+        For each orphan, the position of its old guardian in a table of
+        old guardians.
+    friend_offsets, friends : :class:`numpy.ndarray`
+        The type-1 friends of the old guardian at position g in that table
+        are the positions :code:`friends[friend_offsets[g]:friend_offsets[g+1]]`
+    cloud : :class:`numpy.ndarray`
+        The coordinates.
+    metric : :class:`Metric` or None
+        The distance (Euclidean if None).
+    R : float
+        Radius of the level.
+
+    Returns
+    -------
+    liberated : :class:`numpy.ndarray`
+        Boolean array, True for orphans that become adults.
+
+    Examples
+    --------
+
+    >>> cloud = np.array([[0.0], [3.0], [3.5], [6.0], [9.0]])
+    >>> orphans = np.array([1, 2, 3, 4])
+    >>> group = np.array([0, 0, 0, 1])
+    >>> friend_offsets = np.array([0, 1, 2])
+    >>> friends = np.array([0, 1])
+    >>> covertree_liberate(orphans, group, friend_offsets, friends, cloud, None, 1.0).tolist()
+    [True, False, True, True]
+
+    """
+    cdef NINT_t n = orphans.shape[0]
+    cdef NINT_t m = friend_offsets.shape[0] - 1
+    cdef np.ndarray[NINT_t] head = -np.ones(shape=(m,), dtype=np.int64)
+    cdef np.ndarray[NINT_t] link = -np.ones(shape=(n,), dtype=np.int64)
+    cdef np.ndarray[NBIT_t, cast=True] liberated = np.zeros(shape=(n,), dtype='bool')
+    cdef const NINT_t[:] view_orphans = orphans
+    cdef const NINT_t[:] view_group = group
+    cdef const NINT_t[:] view_friend_offsets = friend_offsets
+    cdef const NINT_t[:] view_friends = friends
+    cdef const NDBL_t[:, :] view_cloud = cloud
+    cdef NINT_t[:] view_head = head
+    cdef NINT_t[:] view_link = link
+    cdef NBIT_t[:] view_liberated = liberated.view(np.uint8)
+    cdef const NDBL_t[:] view_w
+    cdef int code = METRIC_EUCLIDEAN
+    cdef NDBL_t p = 2.0
+    if metric is None:
+        view_w = np.empty(shape=(0,), dtype=np.float64)
+    else:
+        code = metric.code
+        p = metric.p
+        metric.check(cloud.shape[1])
+        view_w = metric.w
+    with nogil:
+        liberate_kernel(view_orphans, view_group, view_friend_offsets, view_friends,
+                        view_cloud, code, p, view_w, R,
+                        view_head, view_link, view_liberated)
+    return liberated
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cpdef NINT_t covertree_resolve_teens(np.ndarray[NINT_t] adults,
+                                     np.ndarray[NINT_t] pos,
+                                     np.ndarray[NINT_t] teen_offsets,
+                                     np.ndarray[NINT_t] teens,
+                                     np.ndarray[NINT_t] teen_guardians,
+                                     np.ndarray[NINT_t] grd_offsets,
+                                     np.ndarray[NINT_t] grd,
+                                     np.ndarray[NDBL_t, ndim=2] cloud,
+                                     object metric,
+                                     NDBL_t R,
+                                     np.ndarray[NINT_t] guardians):
+    r""" Exchange teens between adults, in order, exactly as repeated calls to
+    :func:`covertree_exchange_teens` would, from distances that were
+    computed in bulk beforehand.
+
+    A teen that moves to an adult that comes later in the order is
+    reconsidered by that adult, if it is a teen there too.  Those few
+    distances are computed here.
+
+    Parameters
+    ----------
+    adults : :class:`numpy.ndarray`
+        The adults, in order.
+    pos : :class:`numpy.ndarray`
+        The position of each point in adults, or -1.
+    teen_offsets, teens : :class:`numpy.ndarray`
+        The teens of the adult at position a are :code:`teens[teen_offsets[a]:teen_offsets[a+1]]`
+    teen_guardians : :class:`numpy.ndarray`
+        For each teen, the nearest possible guardian, with ties going to the
+        lowest index.
+    grd_offsets, grd : :class:`numpy.ndarray`
+        The possible guardians of the teens of the adult at position a are
+        :code:`grd[grd_offsets[a]:grd_offsets[a+1]]`
+    cloud : :class:`numpy.ndarray`
+        The coordinates.
+    metric : :class:`Metric` or None
+        The distance.
+    R : float
+        Radius of the level.
+    guardians : :class:`numpy.ndarray`
+        The guardian of each point, updated in place.
+
+    Returns
+    -------
+    moves : int
+        The number of reassignments.
+    """
+    cdef Py_ssize_t a, t, q
+    cdef NINT_t ci, x, g, best, moves = 0
+    cdef NDBL_t d, best_d
+    cdef const NDBL_t[:, :] view_cloud = cloud
+    cdef const NDBL_t[:] view_w
+    cdef int code = METRIC_EUCLIDEAN
+    cdef NDBL_t p = 2.0
+    if metric is None:
+        view_w = np.empty(shape=(0,), dtype=np.float64)
+    else:
+        code = metric.code
+        p = metric.p
+        metric.check(cloud.shape[1])
+        view_w = metric.w
+
+    moved = {}
+    for a in range(adults.shape[0]):
+        ci = adults[a]
+        for t in range(teen_offsets[a], teen_offsets[a + 1]):
+            g = teen_guardians[t]
+            if g != ci:
+                x = teens[t]
+                guardians[x] = g
+                moves += 1
+                if pos[g] > a:
+                    moved.setdefault(pos[g], []).append(x)
+        for x in moved.pop(a, []):
+            if not metric_pair(view_cloud, ci, view_cloud, x, code, p, view_w) > 0.5*R:
+                continue
+            best = -1
+            best_d = INFINITY
+            for q in range(grd_offsets[a], grd_offsets[a + 1]):
+                g = grd[q]
+                d = metric_pair(view_cloud, x, view_cloud, g, code, p, view_w)
+                if best < 0 or d < best_d or (d == best_d and g < best):
+                    best = g
+                    best_d = d
+            if best != ci:
+                guardians[x] = best
+                moves += 1
+                if pos[best] > a:
+                    moved.setdefault(pos[best], []).append(x)
+    return moves
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef int check_indices(const NINT_t[:] indices, NINT_t N) except -1:
+    """ Raise IndexError unless every index is in range(N).  The kernels
+    below read the cloud without bounds checking, so call this first. """
+    cdef Py_ssize_t i
+    for i in range(indices.shape[0]):
+        if indices[i] < 0 or indices[i] >= N:
+            raise IndexError("Index {} is out of range for {} points.".format(indices[i], N))
+    return 0
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+@cython.linetrace(False)
+@cython.profile(False)
+cdef int euclidean_kernel(const NINT_t[:] indices0,
+                          const NINT_t[:] indices1,
+                          const NDBL_t[:, :] cloud,
+                          NDBL_t[:, :] output,
+                          bint parallel) nogil:
+    """ Fill output[i0, i1] with the distance between cloud[indices0[i0],:]
+    and cloud[indices1[i1],:], summing the squared differences directly.
+    Rows are spread across OpenMP threads if parallel is set. """
+    cdef Py_ssize_t i0, i1, k, a, b
+    cdef Py_ssize_t n0 = indices0.shape[0]
+    cdef Py_ssize_t n1 = indices1.shape[0]
+    cdef Py_ssize_t d = cloud.shape[1]
+    cdef NDBL_t total, diff
+    if parallel:
+        for i0 in prange(n0, schedule='static'):
+            a = indices0[i0]
+            for i1 in range(n1):
+                b = indices1[i1]
+                total = 0.0
+                for k in range(d):
+                    diff = cloud[a, k] - cloud[b, k]
+                    total = total + diff*diff
+                output[i0, i1] = sqrt(total)
+    else:
+        for i0 in range(n0):
+            a = indices0[i0]
+            for i1 in range(n1):
+                b = indices1[i1]
+                total = 0.0
+                for k in range(d):
+                    diff = cloud[a, k] - cloud[b, k]
+                    total = total + diff*diff
+                output[i0, i1] = sqrt(total)
+    return 0
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+@cython.cdivision(True)
+@cython.linetrace(False)
+@cython.profile(False)
+cdef inline NDBL_t metric_pair(const NDBL_t[:, :] cloud0,
+                               Py_ssize_t a,
+                               const NDBL_t[:, :] cloud1,
+                               Py_ssize_t b,
+                               int code,
+                               NDBL_t p,
+                               const NDBL_t[:] w) nogil:
+    """ The distance between cloud0[a,:] and cloud1[b,:] in the metric with the
+    given code, exponent p and weights w (or no weights, if w is empty),
+    matching :func:`scipy.spatial.distance.cdist`. """
+    cdef Py_ssize_t k
+    cdef Py_ssize_t d = cloud0.shape[1]
+    cdef bint weighted = w.shape[0] > 0
+    cdef NDBL_t total = 0.0
+    cdef NDBL_t xx = 0.0
+    cdef NDBL_t yy = 0.0
+    cdef NDBL_t diff, wk
+    if code == METRIC_EUCLIDEAN:
+        for k in range(d):
+            diff = cloud0[a, k] - cloud1[b, k]
+            total = total + diff*diff
+        return sqrt(total)
+    elif code == METRIC_CITYBLOCK:
+        for k in range(d):
+            diff = fabs(cloud0[a, k] - cloud1[b, k])
+            if weighted:
+                diff = diff*w[k]
+            total = total + diff
+        return total
+    elif code == METRIC_CHEBYSHEV:
+        for k in range(d):
+            if weighted and w[k] <= 0.0:
+                continue
+            diff = fabs(cloud0[a, k] - cloud1[b, k])
+            if diff > total:
+                total = diff
+        return total
+    elif code == METRIC_COSINE:
+        for k in range(d):
+            wk = w[k] if weighted else 1.0
+            total = total + wk*cloud0[a, k]*cloud1[b, k]
+            xx = xx + wk*cloud0[a, k]*cloud0[a, k]
+            yy = yy + wk*cloud1[b, k]*cloud1[b, k]
+        total = 1.0 - total/sqrt(xx*yy)
+        if total < 0.0:
+            total = 0.0
+        return total
+    else:
+        for k in range(d):
+            diff = pow(fabs(cloud0[a, k] - cloud1[b, k]), p)
+            if weighted:
+                diff = diff*w[k]
+            total = total + diff
+        return pow(total, 1.0/p)
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+@cython.linetrace(False)
+@cython.profile(False)
+cdef int metric_kernel(const NINT_t[:] indices0,
+                       const NINT_t[:] indices1,
+                       const NDBL_t[:, :] cloud,
+                       NDBL_t[:, :] output,
+                       int code,
+                       NDBL_t p,
+                       const NDBL_t[:] w,
+                       bint parallel) nogil:
+    """ Like :func:`euclidean_kernel`, but for any compiled metric. """
+    cdef Py_ssize_t i0, i1
+    cdef Py_ssize_t n0 = indices0.shape[0]
+    cdef Py_ssize_t n1 = indices1.shape[0]
+    if parallel:
+        for i0 in prange(n0, schedule='static'):
+            for i1 in range(n1):
+                output[i0, i1] = metric_pair(cloud, indices0[i0], cloud, indices1[i1],
+                                             code, p, w)
+    else:
+        for i0 in range(n0):
+            for i1 in range(n1):
+                output[i0, i1] = metric_pair(cloud, indices0[i0], cloud, indices1[i1],
+                                             code, p, w)
+    return 0
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+@cython.linetrace(False)
+@cython.profile(False)
+cdef int pairs_kernel(const NINT_t[:] indices0,
+                      const NINT_t[:] indices1,
+                      const NDBL_t[:, :] cloud0,
+                      const NDBL_t[:, :] cloud1,
+                      NDBL_t[:] output,
+                      int code,
+                      NDBL_t p,
+                      const NDBL_t[:] w,
+                      bint parallel) nogil:
+    """ Fill output[i] with the distance between cloud0[indices0[i],:] and
+    cloud1[indices1[i],:], in any compiled metric.
+    Pairs are spread across OpenMP threads if parallel is set. """
+    cdef Py_ssize_t i
+    if parallel:
+        for i in prange(indices0.shape[0], schedule='static'):
+            output[i] = metric_pair(cloud0, indices0[i], cloud1, indices1[i], code, p, w)
+    else:
+        for i in range(indices0.shape[0]):
+            output[i] = metric_pair(cloud0, indices0[i], cloud1, indices1[i], code, p, w)
+    return 0
+
+
+class Metric(object):
+    """ A distance function with a compiled kernel, for use by
+    :class:`multidim.PointCloud` and :class:`multidim.covertree.CoverTree`.
+
+    The cover tree relies on the triangle inequality, so it is only exact for
+    true metrics: "cosine" is not one, and "minkowski" needs p >= 1.
+
+    Parameters
+    ----------
+    name : str
+        One of "euclidean", "cityblock" (or "manhattan"), "chebyshev",
+        "cosine" or "minkowski", as in :func:`scipy.spatial.distance.cdist`.
+    p : float
+        Exponent for "minkowski".  Default: 2.0
+    w : :class:`numpy.ndarray`
+        Optional non-negative weight per coordinate, as in
+        :func:`scipy.spatial.distance.cdist`.  Default: None (unweighted)
+
+    Attributes
+    ----------
+    code : int
+        Which compiled kernel to use.  Unweighted "minkowski" with p of 1, 2,
+        or infinity uses the "cityblock", "euclidean" or "chebyshev" kernel,
+        and weighted "euclidean" uses the "minkowski" kernel with p=2.
+
+    Examples
+    --------
+
+    >>> from scipy.spatial.distance import cdist
+    >>> cloud = np.random.rand(40, 3)
+    >>> i = np.arange(40)
+    >>> w = np.array([1.0, 0.5, 2.0])
+    >>> for m in [Metric("cityblock"), Metric("chebyshev"), Metric("cosine"),
+    ...           Metric("minkowski", p=3, w=w)]:
+    ...     kwargs = {'p': m.p, 'w': m.w} if m.code == 4 else {}
+    ...     print(m.name, np.allclose(distance_cache_None(i, i, cloud, m),
+    ...                               cdist(cloud, cloud, m.name, **kwargs)))
+    cityblock True
+    chebyshev True
+    cosine True
+    minkowski True
+    >>> Metric("minkowski", p=1).name
+    'cityblock'
+    >>> Metric.from_dist(lambda u, v: 0.0) is None
+    True
+
+    """
+
+    CODES = {'euclidean': METRIC_EUCLIDEAN,
+             'cityblock': METRIC_CITYBLOCK,
+             'chebyshev': METRIC_CHEBYSHEV,
+             'cosine': METRIC_COSINE,
+             'minkowski': METRIC_MINKOWSKI}
+
+    def __init__(self, name='euclidean', p=2.0, w=None):
+        if name == 'manhattan':
+            name = 'cityblock'
+        if name not in self.CODES:
+            raise ValueError("No compiled metric {}.".format(name))
+        if w is None:
+            w = np.empty(shape=(0,), dtype=np.float64)
+        w = np.ascontiguousarray(w, dtype=np.float64)
+        if np.any(w < 0):
+            raise ValueError("Metric weights must be non-negative.")
+        p = float(p)
+        if not p > 0:
+            raise ValueError("Metric exponent p must be positive.")
+
+        if name == 'minkowski' and w.shape[0] == 0:
+            if p == 1.0:
+                name = 'cityblock'
+            elif p == 2.0:
+                name = 'euclidean'
+            elif p == np.inf:
+                name = 'chebyshev'
+        elif name == 'euclidean' and w.shape[0] > 0:
+            name = 'minkowski'
+            p = 2.0
+
+        self.name = name
+        self.code = self.CODES[name]
+        self.p = p
+        self.w = w
+
+    @classmethod
+    def from_dist(cls, dist):
+        """ The :class:`Metric` for dist, which may be a :class:`Metric`,
+        a metric name, or None (meaning "euclidean").  Returns None if
+        there is no compiled kernel, such as for a Python function. """
+        if isinstance(dist, cls):
+            return dist
+        if dist is None:
+            return cls()
+        if isinstance(dist, str) and (dist in cls.CODES or dist == 'manhattan'):
+            return cls(dist)
+        return None
+
+    def check(self, dimension):
+        """ Raise ValueError unless the weights, if any, have one entry per
+        coordinate of points in the given dimension.
+
+        Examples
+        --------
+
+        >>> Metric("minkowski", p=3, w=np.ones(3)).check(3)
+        >>> Metric("minkowski", p=3, w=np.ones(2)).check(3)
+        Traceback (most recent call last):
+            ...
+        ValueError: Metric has 2 weights, but the points have 3 coordinates.
+
+        """
+        if self.w.shape[0] > 0 and self.w.shape[0] != dimension:
+            raise ValueError("Metric has {} weights, but the points have {} coordinates.".format(
+                self.w.shape[0], dimension))
+
+    def cdist(self, XA, XB):
+        """ All distances between the rows of XA and XB, like
+        :func:`scipy.spatial.distance.cdist`, but with the compiled kernel. """
+        cdef NINT_t nA = XA.shape[0]
+        cdef NINT_t nB = XB.shape[0]
+        cloud = np.concatenate([XA, XB]).astype(np.float64)
+        return distance_cache_None(np.arange(nA, dtype=np.int64),
+                                   np.arange(nA, nA+nB, dtype=np.int64),
+                                   cloud, self)
+
+    def __call__(self, u, v):
+        """ The distance between two vectors, so that a :class:`Metric` can be
+        passed to :func:`scipy.spatial.distance.pdist`. """
+        return self.cdist(np.atleast_2d(u), np.atleast_2d(v))[0, 0]
+
+    def __repr__(self):
+        if self.code == METRIC_MINKOWSKI:
+            return "Metric('{}', p={}, w={})".format(self.name, self.p, self.w)
+        return "Metric('{}')".format(self.name)
+
+
+cdef np.ndarray[NDBL_t, ndim=2] distance_gram(
+                          np.ndarray[NINT_t] indices0,
+                          np.ndarray[NINT_t] indices1,
+                          np.ndarray[NDBL_t, ndim=2] cloud):
+    """ Get bulk distances from the expansion
+    :math:`\\|x-y\\|^2 = \\|x\\|^2 + \\|y\\|^2 - 2\\langle x, y\\rangle`,
+    so that the work is one matrix product.
+
+    The expansion loses precision to cancellation when x and y are nearly
+    equal, so those pairs are recomputed directly.  In particular, duplicate
+    points still have distance exactly 0.0.
+    """
+    cdef np.ndarray[NDBL_t, ndim=2] X = cloud[indices0, :]
+    cdef np.ndarray[NDBL_t, ndim=2] Y = cloud[indices1, :]
+    cdef np.ndarray[NDBL_t] XX = np.einsum('ij,ij->i', X, X)
+    cdef np.ndarray[NDBL_t] YY = np.einsum('ij,ij->i', Y, Y)
+    cdef np.ndarray[NDBL_t, ndim=2] output = np.dot(X, Y.T)
+    output *= -2.0
+    output += XX[:, np.newaxis]
+    output += YY[np.newaxis, :]
+    np.maximum(output, 0.0, out=output)
+
+    # relative error of the expansion is about eps*(|x|^2 + |y|^2)/|x-y|^2
+    cdef np.ndarray[NINT_t] near0, near1
+    cdef np.ndarray[NDBL_t, ndim=2] exact
+    cdef NINT_t p
+    near0, near1 = np.where(output <= 1e-6*(XX[:, np.newaxis] + YY[np.newaxis, :]))
+    np.sqrt(output, out=output)
+    exact = np.empty(shape=(1, 1), dtype=np.float64)
+    for p in range(near0.shape[0]):
+        euclidean_kernel(indices0[near0[p]:near0[p]+1],
+                         indices1[near1[p]:near1[p]+1],
+                         cloud, exact, False)
+        output[near0[p], near1[p]] = exact[0, 0]
+    return output
+
+
 cpdef np.ndarray[NDBL_t, ndim=2] distance_cache_None(
                           np.ndarray[NINT_t] indices0, 
                           np.ndarray[NINT_t] indices1, 
-                          np.ndarray[NDBL_t, ndim=2] cloud):
-    """ Get bulk distances, using no storage cache. """
-#    cdef np.ndarray[NDBL_t, ndim=2] cloud0 = cloud[indices0,:]
-#    cdef np.ndarray[NDBL_t, ndim=2] cloud1 = cloud[indices1,:]
-#    return cdist(cloud0, cloud1)
-
-#cpdef np.ndarray[NDBL_t, ndim=2] distE(
-#                         np.ndarray[NINT_t] indices0, 
-#                         np.ndarray[NINT_t] indices1, 
-#                         np.ndarray[NDBL_t, ndim=2] cloud):
-#   """ Get bulk distances, using no storage cache. """
-#    #cdef np.ndarray[NDBL_t, ndim=2] cloud0 = cloud[indices0,:]
-#    #cdef np.ndarray[NDBL_t, ndim=2] cloud1 = cloud[indices1,:]
-    cdef NINT_t i0, i1, k
+                          np.ndarray[NDBL_t, ndim=2] cloud,
+                          object metric=None,
+                          bint gram=True):
+    """ Get bulk distances, using no storage cache.
+
+    The distance is Euclidean, unless another :class:`Metric` is given.
+
+    Small blocks are computed directly in compiled code, without the GIL.
+    Blocks of at least :code:`PARALLEL_MIN_PAIRS` pairs are spread across
+    OpenMP threads (see :code:`OMP_NUM_THREADS`).  High-dimensional blocks of
+    at least :code:`GRAM_MIN_PAIRS` pairs use the Gram-matrix expansion,
+    unless gram is False.  The direct kernels give bit-identical results to
+    :func:`distance_pairs`, whatever the shape of the block.  The kernels do
+    no bounds checking, so the indices are checked first, raising IndexError.
+
+    Examples
+    --------
+
+    >>> cloud = np.random.rand(300, 3)
+    >>> i0 = np.arange(0, 300, 3, dtype=np.int64)
+    >>> i1 = np.arange(300, dtype=np.int64)
+    >>> np.allclose(distance_cache_None(i0, i1, cloud), cdist(cloud[i0], cloud[i1]))
+    True
+    >>> cloud = np.random.rand(300, 20)
+    >>> cloud[1] = cloud[0]
+    >>> D = distance_cache_None(i1, i1, cloud)
+    >>> np.allclose(D, cdist(cloud, cloud)), D[0, 1], D[5, 5]
+    (True, 0.0, 0.0)
+    >>> distance_cache_None(np.array([0, 1]), np.array([2, 300]), cloud)
+    Traceback (most recent call last):
+        ...
+    IndexError: Index 300 is out of range for 300 points.
+
+    """
     cdef NINT_t n0 = indices0.shape[0]
     cdef NINT_t n1 = indices1.shape[0]
+    cdef NINT_t d = cloud.shape[1]
+    cdef int code = METRIC_EUCLIDEAN if metric is None else metric.code
+    check_indices(indices0, cloud.shape[0])
+    check_indices(indices1, cloud.shape[0])
+    if gram and code == METRIC_EUCLIDEAN and n0*n1 >= GRAM_MIN_PAIRS and d >= GRAM_MIN_DIM:
+        return distance_gram(indices0, indices1, cloud)
     cdef np.ndarray[NDBL_t, ndim=2] output = np.ndarray(
         shape=(n0, n1), dtype=np.float64)
-    for i0 in range(n0):
-        for i1 in range(n1):
-            output[i0, i1] = np.sqrt(np.sum((cloud[indices0[i0],:] - cloud[indices1[i1],:])**2))
+    cdef bint parallel = n0 > 1 and n0*n1 >= PARALLEL_MIN_PAIRS
+    # acquire the memoryviews while we still hold the GIL
+    cdef const NINT_t[:] view0 = indices0
+    cdef const NINT_t[:] view1 = indices1
+    cdef const NDBL_t[:, :] view_cloud = cloud
+    cdef NDBL_t[:, :] view_output = output
+    cdef const NDBL_t[:] view_w
+    cdef NDBL_t p
+    if n0 == 0 or n1 == 0:
+        return output
+    if code == METRIC_EUCLIDEAN:
+        with nogil:
+            euclidean_kernel(view0, view1, view_cloud, view_output, parallel)
+    else:
+        metric.check(d)
+        view_w = metric.w
+        p = metric.p
+        with nogil:
+            metric_kernel(view0, view1, view_cloud, view_output,
+                          code, p, view_w, parallel)
+    return output
+
+
+cpdef distance_pairs(np.ndarray[NINT_t] indices0,
+                     np.ndarray[NINT_t] indices1,
+                     np.ndarray[NDBL_t, ndim=2] cloud,
+                     object metric=None,
+                     object cloud0=None):
+    """ The distances between cloud[indices0[i],:] and cloud[indices1[i],:]
+    for each i, so the result has the shape of indices0.  The distance is
+    Euclidean, unless another :class:`Metric` is given.  If cloud0 is given,
+    then indices0 refer to the rows of cloud0 instead, such as for points
+    outside of the cloud.  The kernel does no bounds checking, so mismatched
+    lengths or dimensions raise ValueError, and indices out of range raise
+    IndexError, beforehand.
+
+    Examples
+    --------
+
+    >>> cloud = np.array([[0.0, 0.0], [3.0, 4.0], [6.0, 8.0]])
+    >>> distance_pairs(np.array([0, 0, 2]), np.array([1, 2, 2]), cloud).tolist()
+    [5.0, 10.0, 0.0]
+    >>> distance_pairs(np.array([0]), np.array([1]), cloud, Metric("cityblock")).tolist()
+    [7.0]
+    >>> distance_pairs(np.array([0, 0]), np.array([0, 2]), cloud,
+    ...                cloud0=np.array([[6.0, 0.0]])).tolist()
+    [6.0, 8.0]
+    >>> distance_pairs(np.array([0]), np.array([2]), cloud,
+    ...                cloud0=np.array([[6.0, 0.0, 1.0]]))
+    Traceback (most recent call last):
+        ...
+    ValueError: cloud0 has 3 coordinates, but cloud has 2.
+
+    """
+    if indices1.shape[0] != indices0.shape[0]:
+        raise ValueError("indices0 and indices1 must have the same length.")
+    if cloud0 is not None and cloud0.shape[1] != cloud.shape[1]:
+        raise ValueError("cloud0 has {} coordinates, but cloud has {}.".format(
+            cloud0.shape[1], cloud.shape[1]))
+    check_indices(indices0, cloud.shape[0] if cloud0 is None else cloud0.shape[0])
+    check_indices(indices1, cloud.shape[0])
+    cdef np.ndarray[NDBL_t] output = np.ndarray(shape=(indices0.shape[0],),
+                                                dtype=np.float64)
+    cdef const NINT_t[:] view0 = indices0
+    cdef const NINT_t[:] view1 = indices1
+    cdef const NDBL_t[:, :] view_cloud = cloud
+    cdef const NDBL_t[:, :] view_cloud0 = cloud if cloud0 is None else cloud0
+    cdef NDBL_t[:] view_output = output
+    cdef const NDBL_t[:] view_w
+    cdef int code = METRIC_EUCLIDEAN
+    cdef NDBL_t p = 2.0
+    cdef bint parallel = indices0.shape[0] >= PARALLEL_MIN_PAIRS
+    if metric is None:
+        view_w = np.empty(shape=(0,), dtype=np.float64)
+    else:
+        code = metric.code
+        p = metric.p
+        metric.check(cloud.shape[1])
+        view_w = metric.w
+    with nogil:
+        pairs_kernel(view0, view1, view_cloud0, view_cloud, view_output,
+                     code, p, view_w, parallel)
+    return output
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+@cython.linetrace(False)
+@cython.profile(False)
+cdef inline bint pair_greater(NDBL_t value0, NINT_t id0,
+                              NDBL_t value1, NINT_t id1) nogil:
+    """ Order (value, id) pairs by value, then by id. """
+    return value0 > value1 or (value0 == value1 and id0 > id1)
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+@cython.linetrace(False)
+@cython.profile(False)
+cdef inline void heap_sift_down(NDBL_t[:] values, NINT_t[:] ids,
+                                Py_ssize_t i, Py_ssize_t size,
+                                NDBL_t value, NINT_t ident) noexcept nogil:
+    """ Put (value, ident) at position i of the binary max-heap of (value, id)
+    pairs in values[:size] and ids[:size], and restore the heap below i. """
+    cdef Py_ssize_t child
+    while True:
+        child = 2*i + 1
+        if child >= size:
+            break
+        if child + 1 < size and pair_greater(values[child + 1], ids[child + 1],
+                                             values[child], ids[child]):
+            child = child + 1
+        if not pair_greater(values[child], ids[child], value, ident):
+            break
+        values[i] = values[child]
+        ids[i] = ids[child]
+        i = child
+    values[i] = value
+    ids[i] = ident
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+@cython.linetrace(False)
+@cython.profile(False)
+cdef int group_k_smallest_kernel(const NINT_t[:] offsets,
+                                 const NDBL_t[:] values,
+                                 const NINT_t[:] ids,
+                                 NDBL_t[:, :] out_values,
+                                 NINT_t[:, :] out_ids,
+                                 bint parallel) nogil:
+    """ For each group g, whose pairs are values[offsets[g]:offsets[g+1]] and
+    ids[offsets[g]:offsets[g+1]], put the k smallest pairs in increasing order
+    in row g of out_values and out_ids.  The rows must be pre-filled with
+    (inf, -1), and serve as the bounded heaps.
+    Groups are spread across OpenMP threads if parallel is set. """
+    cdef Py_ssize_t g
+    cdef Py_ssize_t m = offsets.shape[0] - 1
+    if parallel:
+        for g in prange(m, schedule='dynamic'):
+            group_k_smallest_row(offsets[g], offsets[g + 1], values, ids,
+                                 out_values[g, :], out_ids[g, :])
+    else:
+        for g in range(m):
+            group_k_smallest_row(offsets[g], offsets[g + 1], values, ids,
+                                 out_values[g, :], out_ids[g, :])
+    return 0
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+@cython.linetrace(False)
+@cython.profile(False)
+cdef int group_k_smallest_row(Py_ssize_t start,
+                              Py_ssize_t stop,
+                              const NDBL_t[:] values,
+                              const NINT_t[:] ids,
+                              NDBL_t[:] heap_values,
+                              NINT_t[:] heap_ids) nogil:
+    """ One group of :func:`group_k_smallest_kernel`.  The k slots of the row
+    hold a max-heap of (inf, -1) fillers and the best pairs so far, which is
+    finally sorted in place. """
+    cdef Py_ssize_t i, size
+    cdef Py_ssize_t k = heap_values.shape[0]
+    cdef NDBL_t top_value
+    cdef NINT_t top_id
+    for i in range(start, stop):
+        if pair_greater(heap_values[0], heap_ids[0], values[i], ids[i]) or heap_ids[0] < 0:
+            heap_sift_down(heap_values, heap_ids, 0, k, values[i], ids[i])
+    # heap-sort in place, largest to the end
+    for size in range(k - 1, 0, -1):
+        top_value = heap_values[0]
+        top_id = heap_ids[0]
+        heap_sift_down(heap_values, heap_ids, 0, size, heap_values[size], heap_ids[size])
+        heap_values[size] = top_value
+        heap_ids[size] = top_id
+    return 0
+
+
+cpdef group_k_smallest(np.ndarray[NINT_t] group,
+                       np.ndarray[NDBL_t] values,
+                       np.ndarray[NINT_t] ids,
+                       NINT_t k,
+                       NINT_t m):
+    """ The k smallest (value, id) pairs in each of the groups 0, ..., m-1,
+    ordered by value and then by id.  The group labels must be
+    non-decreasing, so that each group is contiguous.  Each group is scanned
+    once with a bounded max-heap of size k, and large batches of groups are
+    spread across OpenMP threads.
+
+    Returns
+    -------
+    values, ids : :class:`numpy.ndarray`
+        Arrays of shape (m, k).  Groups with fewer than k pairs are padded
+        with (inf, -1).
+
+    Examples
+    --------
+
+    >>> group = np.array([0, 0, 0, 2, 2, 2, 2])
+    >>> values = np.array([3.0, 1.0, 2.0, 5.0, 4.0, 7.0, 4.0])
+    >>> ids = np.array([10, 11, 12, 13, 14, 15, 16])
+    >>> best, which = group_k_smallest(group, values, ids, 2, 4)
+    >>> best.tolist()
+    [[1.0, 2.0], [inf, inf], [4.0, 4.0], [inf, inf]]
+    >>> which.tolist()
+    [[11, 12], [-1, -1], [14, 16], [-1, -1]]
+
+    """
+    cdef np.ndarray[NDBL_t, ndim=2] out_values = np.inf*np.ones(shape=(m, k), dtype=np.float64)
+    cdef np.ndarray[NINT_t, ndim=2] out_ids = -np.ones(shape=(m, k), dtype=np.int64)
+    cdef np.ndarray[NINT_t] offsets = np.zeros(shape=(m + 1,), dtype=np.int64)
+    np.cumsum(np.bincount(group, minlength=m), out=offsets[1:])
+    cdef const NINT_t[:] view_offsets = offsets
+    cdef const NDBL_t[:] view_values = values
+    cdef const NINT_t[:] view_ids = ids
+    cdef NDBL_t[:, :] view_out_values = out_values
+    cdef NINT_t[:, :] view_out_ids = out_ids
+    cdef bint parallel = m > 1 and values.shape[0] >= PARALLEL_MIN_PAIRS
+    if k > 0:
+        with nogil:
+            group_k_smallest_kernel(view_offsets, view_values, view_ids,
+                                    view_out_values, view_out_ids, parallel)
+    return out_values, out_ids
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+@cython.linetrace(False)
+@cython.profile(False)
+cdef inline void heap_sift_up(NDBL_t[:] values, NINT_t[:] ids,
+                              Py_ssize_t i, NDBL_t value, NINT_t ident) noexcept nogil:
+    """ Put (value, ident) at the new last position i of the binary max-heap
+    of (value, id) pairs in values[:i+1] and ids[:i+1], and restore the heap
+    above i. """
+    cdef Py_ssize_t parent
+    while i > 0:
+        parent = (i - 1) // 2
+        if not pair_greater(value, ident, values[parent], ids[parent]):
+            break
+        values[i] = values[parent]
+        ids[i] = ids[parent]
+        i = parent
+    values[i] = value
+    ids[i] = ident
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+@cython.linetrace(False)
+@cython.profile(False)
+cdef int group_kth_weighted_kernel(const NINT_t[:] offsets,
+                                   const NDBL_t[:] values,
+                                   const NINT_t[:] weights,
+                                   NINT_t k,
+                                   NDBL_t[:, :] heap_values,
+                                   NINT_t[:, :] heap_weights,
+                                   NDBL_t[:] output,
+                                   bint parallel) nogil:
+    """ For each group g, whose entries are values[offsets[g]:offsets[g+1]]
+    with positive weights[offsets[g]:offsets[g+1]], find the least value
+    whose entries, with all smaller ones, weigh at least k.  Row g of
+    heap_values and heap_weights (of length k+1) is a max-heap of the lightest
+    set of smallest entries weighing at least k.
+    Groups are spread across OpenMP threads if parallel is set. """
+    cdef Py_ssize_t g
+    cdef Py_ssize_t m = offsets.shape[0] - 1
+    if parallel:
+        for g in prange(m, schedule='dynamic'):
+            output[g] = group_kth_weighted_row(offsets[g], offsets[g + 1],
+                                               values, weights, k,
+                                               heap_values[g, :], heap_weights[g, :])
+    else:
+        for g in range(m):
+            output[g] = group_kth_weighted_row(offsets[g], offsets[g + 1],
+                                               values, weights, k,
+                                               heap_values[g, :], heap_weights[g, :])
+    return 0
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+@cython.linetrace(False)
+@cython.profile(False)
+cdef NDBL_t group_kth_weighted_row(Py_ssize_t start,
+                                   Py_ssize_t stop,
+                                   const NDBL_t[:] values,
+                                   const NINT_t[:] weights,
+                                   NINT_t k,
+                                   NDBL_t[:] heap_values,
+                                   NINT_t[:] heap_weights) nogil:
+    """ One group of :func:`group_kth_weighted_kernel`. """
+    cdef Py_ssize_t i
+    cdef Py_ssize_t size = 0
+    cdef NINT_t total = 0
+    for i in range(start, stop):
+        if total >= k and values[i] >= heap_values[0]:
+            continue
+        heap_sift_up(heap_values, heap_weights, size, values[i], weights[i])
+        size = size + 1
+        total = total + weights[i]
+        # drop the largest entries while the rest still weigh at least k
+        while size > 1 and total - heap_weights[0] >= k:
+            total = total - heap_weights[0]
+            size = size - 1
+            heap_sift_down(heap_values, heap_weights, 0, size,
+                           heap_values[size], heap_weights[size])
+    if total >= k:
+        return heap_values[0]
+    return INFINITY
+
+
+cpdef np.ndarray[NDBL_t] group_kth_weighted(np.ndarray[NINT_t] group,
+                                            np.ndarray[NDBL_t] values,
+                                            np.ndarray[NINT_t] weights,
+                                            NINT_t k,
+                                            NINT_t m):
+    """ For each of the groups 0, ..., m-1, the least value v such that the
+    entries of the group with value at most v weigh at least k in total, or
+    infinity if the whole group weighs less than k.  With unit weights, this
+    is the k-th smallest value.  The group labels must be non-decreasing, so
+    that each group is contiguous, and the weights must be positive.  Each
+    group is scanned once with a bounded max-heap, and large batches of
+    groups are spread across OpenMP threads.
+
+    Examples
+    --------
+
+    >>> group = np.array([0, 0, 0, 2, 2, 2, 2])
+    >>> values = np.array([3.0, 1.0, 2.0, 5.0, 4.0, 7.0, 4.5])
+    >>> group_kth_weighted(group, values, np.ones(7, dtype=np.int64), 2, 4).tolist()
+    [2.0, inf, 4.5, inf]
+    >>> group_kth_weighted(group, values, np.array([1, 1, 1, 1, 3, 1, 1]), 2, 4).tolist()
+    [2.0, inf, 4.0, inf]
+
+    """
+    cdef np.ndarray[NDBL_t] output = np.inf*np.ones(shape=(m,), dtype=np.float64)
+    cdef np.ndarray[NINT_t] offsets = np.zeros(shape=(m + 1,), dtype=np.int64)
+    np.cumsum(np.bincount(group, minlength=m), out=offsets[1:])
+    cdef NDBL_t[:, :] heap_values = np.ndarray(shape=(m, k + 1), dtype=np.float64)
+    cdef NINT_t[:, :] heap_weights = np.ndarray(shape=(m, k + 1), dtype=np.int64)
+    cdef const NINT_t[:] view_offsets = offsets
+    cdef const NDBL_t[:] view_values = values
+    cdef const NINT_t[:] view_weights = weights
+    cdef NDBL_t[:] view_output = output
+    cdef bint parallel = m > 1 and values.shape[0] >= PARALLEL_MIN_PAIRS
+    if k > 0:
+        with nogil:
+            group_kth_weighted_kernel(view_offsets, view_values, view_weights, k,
+                                      heap_values, heap_weights, view_output,
+                                      parallel)
     return output
 
 
@@ -488,40 +1508,344 @@ cpdef np.ndarray[NDBL_t, ndim=2] distance_cache_numpy(
                            np.ndarray[NINT_t] indices0, 
                            np.ndarray[NINT_t] indices1, 
                            np.ndarray[NDBL_t, ndim=2] cloud, 
-                           np.ndarray[NDBL_t, ndim=2] cache):
+                           np.ndarray[NDBL_t, ndim=2] cache,
+                           object metric=None):
     """ Get bulk distances, using NumPy storage cache. """
    
-    cdef NINT_t i,ind0,j,ind1
-    cdef np.ndarray[NDBL_t, ndim=2] cloud0, cloud1, output
+    cdef np.ndarray[NINT_t, ndim=2] rows, cols
+    cdef np.ndarray[NDBL_t, ndim=2] output
+    # negative indices would silently wrap around in the cache
+    check_indices(indices0, cloud.shape[0])
+    check_indices(indices1, cloud.shape[0])
+    rows, cols = np.meshgrid(indices0, indices1, indexing='ij')
+    output = cache[rows, cols]
+    missing = output < 0
+    if np.any(missing):
+        a = rows[missing]
+        b = cols[missing]
+        found = distance_pairs(a, b, cloud, metric)
+        cache[a, b] = found
+        cache[b, a] = found
+        output[missing] = found
+    return output
 
-    output = np.ndarray((indices0.shape[0], indices1.shape[0]),dtype=np.float64)
-    for i,ind0 in enumerate(indices0):
-        for j,ind1 in enumerate(indices1):
-            if cache[ind0,ind1]<0:
-                cache[ind0,ind1] = euclidean(cloud[ind0,:], cloud[ind1,:])
-                cache[ind1,ind0] = cache[ind0,ind1]
-            output[i,j] = cache[ind0,ind1]
+
+cpdef make_condensed_cache(NINT_t N, filename=None, cloud=None, metric=None):
+    """ Make an empty condensed distance cache for N points, for
+    :code:`PointCloud(cache_type="condensed")`.
+
+    The cache has the layout of :func:`scipy.spatial.distance.pdist`: one
+    entry per pair i < j, at position :func:`condensed_index`.  Unknown
+    distances are marked -1.0.
+
+    Parameters
+    ----------
+    N : int
+        Number of points in the cloud.
+    filename : str
+        If given, the cache is a :class:`numpy.memmap` backed by this file,
+        so that it can be reused by later processes on the same cloud.  The
+        file "filename.key" records N, a hash of cloud, and the metric, and
+        an existing file is only reused if they all match; otherwise, a new
+        file is made.  Default: None (keep the cache in memory)
+    cloud : :class:`numpy.ndarray`
+        The coordinates of the N points.  Without it, an existing file is
+        never reused.  Default: None
+    metric : :class:`Metric` or function
+        The distance function.  Default: None
+        (meaning "euclidean")
+
+    Returns
+    -------
+    cache : :class:`numpy.ndarray` or :class:`numpy.memmap`
+
+    Examples
+    --------
+
+    >>> import os, tempfile
+    >>> filename = os.path.join(tempfile.mkdtemp(), "dists.dat")
+    >>> cloud = np.random.rand(6, 2)
+    >>> cache = make_condensed_cache(6, filename, cloud)
+    >>> cache[0] = 0.5
+    >>> cache.flush()
+    >>> make_condensed_cache(6, filename, cloud)[0]
+    0.5
+    >>> make_condensed_cache(6, filename, cloud, Metric("cityblock"))[0]
+    -1.0
+    >>> make_condensed_cache(6, filename, cloud + 1.0)[0]
+    -1.0
+
+    """
+    import os
+    import hashlib
+    cdef NINT_t size = N*(N-1)//2
+    if filename is None:
+        return -np.ones(shape=(size,), dtype=np.float64)
+    keyfile = filename + ".key"
+    key = None
+    if cloud is not None:
+        cloud = np.ascontiguousarray(cloud, dtype=np.float64)
+        if metric is None:
+            metric = Metric()
+        if isinstance(metric, Metric):
+            # the repr of a long w is abbreviated, so hash the weights
+            dist = "{} {} {}".format(metric.name, metric.p,
+                                     hashlib.sha1(metric.w.tobytes()).hexdigest())
+        else:
+            dist = repr(metric)
+        key = "{} {} {} {}".format(N, cloud.shape, hashlib.sha1(cloud.tobytes()).hexdigest(), dist)
+    if key is not None and os.path.exists(keyfile) \
+            and os.path.exists(filename) and os.path.getsize(filename) == 8*size:
+        with open(keyfile) as f:
+            if f.read() == key:
+                return np.memmap(filename, dtype=np.float64, mode='r+', shape=(size,))
+    # the old key no longer describes the file, even if we stop part-way
+    if os.path.exists(keyfile):
+        os.remove(keyfile)
+    cache = np.memmap(filename, dtype=np.float64, mode='w+', shape=(size,))
+    cache[:] = -1.0
+    cache.flush()
+    if key is not None:
+        with open(keyfile, 'w') as f:
+            f.write(key)
+    return cache
+
+
+cpdef condensed_index(NINT_t N,
+                      np.ndarray[NINT_t] indices0,
+                      np.ndarray[NINT_t] indices1):
+    """ Position of the pairs (indices0[p], indices1[p]) in a condensed
+    distance array for N points, as from :func:`scipy.spatial.distance.pdist`.
+    Pairs may be given in either order, but must not be diagonal.  Raises
+    IndexError unless all indices are in range(N).
+
+    Examples
+    --------
+
+    >>> cloud = np.random.rand(5, 2)
+    >>> i = np.array([0, 1, 4, 2])
+    >>> j = np.array([1, 4, 2, 3])
+    >>> from scipy.spatial.distance import pdist, cdist
+    >>> np.all(pdist(cloud)[condensed_index(5, i, j)] == cdist(cloud, cloud)[i, j])
+    True
+
+    """
+    check_indices(indices0, N)
+    check_indices(indices1, N)
+    cdef np.ndarray[NINT_t] a = np.minimum(indices0, indices1)
+    cdef np.ndarray[NINT_t] b = np.maximum(indices0, indices1)
+    return N*a - a*(a+1)//2 + (b - a - 1)
+
+
+cpdef np.ndarray[NDBL_t, ndim=2] distance_cache_condensed(
+                           np.ndarray[NINT_t] indices0,
+                           np.ndarray[NINT_t] indices1,
+                           np.ndarray[NDBL_t, ndim=2] cloud,
+                           np.ndarray[NDBL_t] cache,
+                           object metric=None):
+    """ Get bulk distances, using a condensed (upper-triangular) storage
+    cache from :func:`make_condensed_cache`.  All missing distances of the
+    block are computed and stored in one vectorized pass.
+
+    Examples
+    --------
+
+    >>> cloud = np.random.rand(6, 3)
+    >>> cache = make_condensed_cache(6)
+    >>> D = distance_cache_condensed(np.arange(3), np.arange(6), cloud, cache)
+    >>> np.allclose(D, cdist(cloud[:3], cloud)), np.count_nonzero(cache >= 0)
+    (True, 12)
+    >>> D = distance_cache_condensed(np.arange(6), np.arange(6), cloud, cache)
+    >>> np.allclose(cache, pdist(cloud))
+    True
+
+    """
+    cdef NINT_t N = cloud.shape[0]
+    cdef np.ndarray[NINT_t, ndim=2] rows, cols
+    cdef np.ndarray[NDBL_t, ndim=2] output
+    # an index outside the cloud can still land inside the condensed cache
+    check_indices(indices0, N)
+    check_indices(indices1, N)
+    rows, cols = np.meshgrid(indices0, indices1, indexing='ij')
+    output = np.zeros(shape=(indices0.shape[0], indices1.shape[0]), dtype=np.float64)
+    offdiag = rows != cols
+    a = rows[offdiag]
+    b = cols[offdiag]
+    keys = condensed_index(N, a, b)
+    found = cache[keys]
+    missing = found < 0
+    if np.any(missing):
+        a = a[missing]
+        b = b[missing]
+        found[missing] = distance_pairs(a, b, cloud, metric)
+        cache[keys[missing]] = found[missing]
+    output[offdiag] = found
     return output
 
 cpdef np.ndarray[NDBL_t, ndim=2] distance_cache_dict(
                      np.ndarray[NINT_t] indices0, 
                      np.ndarray[NINT_t] indices1, 
                      np.ndarray[NDBL_t, ndim=2] cloud, 
-                     dict cache):
+                     dict cache,
+                     object metric=None):
     """ Get bulk distances, using dictionary storage cache. """
    
     cdef NINT_t i,ind0,j,ind1,min0,max1
     cdef np.ndarray[NDBL_t, ndim=2] cloud0, cloud1, output
+    cdef const NDBL_t[:, :] view_cloud = cloud
+    cdef const NDBL_t[:] view_w
+    cdef int code = METRIC_EUCLIDEAN
+    cdef NDBL_t p = 2.0
+    if metric is None:
+        view_w = np.empty(shape=(0,), dtype=np.float64)
+    else:
+        code = metric.code
+        p = metric.p
+        metric.check(cloud.shape[1])
+        view_w = metric.w
+    # metric_pair is unchecked, and its values are kept in the cache
+    check_indices(indices0, cloud.shape[0])
+    check_indices(indices1, cloud.shape[0])
 
     output = np.ndarray((indices0.shape[0], indices1.shape[0]),dtype=np.float64)
     for i,ind0 in enumerate(indices0):
         for j,ind1 in enumerate(indices1):
             if (ind0, ind1) not in cache:
-                cache[(ind0,ind1)] = euclidean(cloud[ind0,:], cloud[ind1,:])
+                cache[(ind0,ind1)] = metric_pair(view_cloud, ind0, view_cloud, ind1, code, p, view_w)
                 cache[(ind1,ind0)] = cache[(ind0, ind1)]
             output[i,j] = cache[(ind0,ind1)]
     return output
 
+class DistanceLRU(object):
+    """ A bounded least-recently-used store of pairwise distances, for
+    :code:`PointCloud(cache_type="lru")`.
+
+    Each pair (i, j) with i < j is stored once, under the single integer key
+    i*N + j, in an :class:`collections.OrderedDict` ordered from least to
+    most recently used.  When the store is full, the least recently used
+    pairs are evicted.
+
+    Parameters
+    ----------
+    N : int
+        Number of points in the cloud.
+    max_bytes : int
+        Approximate memory budget of the store, in bytes.
+
+    Attributes
+    ----------
+    capacity : int
+        Maximum number of stored pairs, from max_bytes/ENTRY_BYTES.
+    hits : int
+        Number of distances answered from the store.
+    misses : int
+        Number of distances computed and stored.
+    evictions : int
+        Number of distances forgotten to respect the budget.
+
+    Examples
+    --------
+
+    >>> cloud = np.array([[0.0, 0.0], [3.0, 4.0], [6.0, 8.0]])
+    >>> cache = DistanceLRU(3, 2*DistanceLRU.ENTRY_BYTES)
+    >>> cache.capacity
+    2
+    >>> distance_cache_lru(np.array([0]), np.array([1, 2]), cloud, cache).tolist()
+    [[5.0, 10.0]]
+    >>> distance_cache_lru(np.array([1]), np.array([0, 2]), cloud, cache).tolist()
+    [[5.0, 5.0]]
+    >>> (len(cache), cache.hits, cache.misses, cache.evictions)
+    (2, 1, 3, 1)
+    >>> distance_cache_lru(np.array([0]), np.array([1, 3]), cloud, cache)
+    Traceback (most recent call last):
+        ...
+    IndexError: Index 3 is out of range for 3 points.
+    >>> (len(cache), cache.hits, cache.misses, cache.evictions)
+    (2, 1, 3, 1)
+
+    """
+
+    # rough size of one entry: dict slot, ordering link, int key, float value
+    ENTRY_BYTES = 200
+
+    def __init__(self, N, max_bytes):
+        self.N = N
+        self.max_bytes = max_bytes
+        self.capacity = max(1, int(max_bytes // self.ENTRY_BYTES))
+        self.store = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self.store)
+
+    def clear(self):
+        self.store.clear()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+
+cpdef np.ndarray[NDBL_t, ndim=2] distance_cache_lru(
+                     np.ndarray[NINT_t] indices0,
+                     np.ndarray[NINT_t] indices1,
+                     np.ndarray[NDBL_t, ndim=2] cloud,
+                     object cache,
+                     object metric=None):
+    """ Get bulk distances, using a bounded :class:`DistanceLRU` storage cache. """
+
+    cdef NINT_t i, j, ind0, ind1, key, hits, misses
+    cdef NINT_t N = cache.N
+    cdef NINT_t capacity = cache.capacity
+    cdef np.ndarray[NDBL_t, ndim=2] output
+    cdef const NDBL_t[:, :] view_cloud = cloud
+    cdef const NDBL_t[:] view_w
+    cdef int code = METRIC_EUCLIDEAN
+    cdef NDBL_t p = 2.0
+    if metric is None:
+        view_w = np.empty(shape=(0,), dtype=np.float64)
+    else:
+        code = metric.code
+        p = metric.p
+        metric.check(cloud.shape[1])
+        view_w = metric.w
+    # metric_pair is unchecked, and its values are kept in the cache
+    check_indices(indices0, cloud.shape[0])
+    check_indices(indices1, cloud.shape[0])
+    store = cache.store
+    move_to_end = store.move_to_end
+
+    hits = 0
+    misses = 0
+    output = np.ndarray((indices0.shape[0], indices1.shape[0]), dtype=np.float64)
+    for i in range(indices0.shape[0]):
+        ind0 = indices0[i]
+        for j in range(indices1.shape[0]):
+            ind1 = indices1[j]
+            if ind0 == ind1:
+                output[i, j] = 0.0
+                continue
+            if ind0 < ind1:
+                key = ind0*N + ind1
+            else:
+                key = ind1*N + ind0
+            value = store.get(key)
+            if value is not None:
+                move_to_end(key)
+                output[i, j] = value
+                hits += 1
+            else:
+                output[i, j] = metric_pair(view_cloud, ind0, view_cloud, ind1, code, p, view_w)
+                store[key] = output[i, j]
+                misses += 1
+                if len(store) > capacity:
+                    store.popitem(last=False)
+                    cache.evictions += 1
+    cache.hits += hits
+    cache.misses += misses
+    return output
+
 cpdef np.ndarray[NDBL_t, ndim=2] distance_cache_dok(
                      np.ndarray[NINT_t] indices0, 
                      np.ndarray[NINT_t] indices1, 
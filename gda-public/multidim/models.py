@@ -647,7 +647,8 @@ class CDER(GaussianMixtureClassifier):
                     adult_a = np.array([adult], dtype=np.int64)
                     pre_elders = np.array(prev_level.friends1[this_level.predecessor[adult]])
                     pre_eldersR = distance_cache_None(
-                        adult_a, pre_elders, self.covertree.coords).flatten()
+                        adult_a, pre_elders, self.covertree.coords,
+                        self.covertree.metric).flatten()
                     my_elders = pre_elders[pre_eldersR <= prev_level.radius]
                     prev_weights = np.concatenate([ prev_level.weights[e] for e in my_elders ])
                     
@@ -46,6 +46,43 @@ class TestBarycenters:
         randPC = multidim.PointCloud(randX)
         randPC.witnessed_barycenters(3)
 
+class TestBarycenterEdges:
+
+    def setup_method(self, f):
+        np.random.seed(0)
+        self.PC = multidim.PointCloud(np.random.rand(300, 2))
+
+    def brute(self, wb):
+        # the weighted heights of all pairs, one at a time
+        X = wb.coords.values
+        w = -wb.stratum[0]['height'].values**2
+        hgts = {}
+        for i in range(X.shape[0]):
+            for j in range(i+1, X.shape[0]):
+                mu = np.linalg.norm(X[i] - X[j])
+                hgts[i, j] = np.sqrt(mu**2*(mu**2 - 2*w[i] - 2*w[j]) + (w[i] - w[j])**2)/2/mu
+        return hgts
+
+    def test_all(self):
+        wb = self.PC.witnessed_barycenters(4)
+        brute = self.brute(wb)
+        edges = wb.stratum[1]
+        assert edges.shape[0] == len(brute)
+        assert np.all(np.diff(edges['height'].values) >= 0)
+        for i, j, h in zip(edges['bdy0'].values, edges['bdy1'].values,
+                           edges['height'].values):
+            assert np.isclose(brute[i, j], h)
+
+    def test_cutoff(self):
+        wb = self.PC.witnessed_barycenters(4, cutoff=0.1)
+        brute = self.brute(wb)
+        edges = wb.stratum[1]
+        assert set(zip(edges['bdy0'].values, edges['bdy1'].values)) == \
+            set(e for e, h in brute.items() if h <= 0.1)
+        assert np.all(edges['height'].values <= 0.1)
+        wb.make_pers0(cutoff=0.1)
+
+
 if __name__ == '__main__':
     T = TestBarycenters()
     T.setup()
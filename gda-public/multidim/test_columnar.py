@@ -0,0 +1,56 @@
+r"""
+Test that the :class:`multidim.ArrayStratum` backend of
+:class:`multidim.SimplicialComplex` agrees with the :class:`pandas.DataFrame`
+backend.
+
+Copyright
+---------
+- This file is part of https://github.com/geomdata/gda-public/
+- 2015, 2016, 2017 by Geometric Data Analytics, Inc. (http://geomdata.com)
+- AGPL license. See `LICENSE` or https://github.com/geomdata/gda-public/blob/master/LICENSE
+
+"""
+
+import numpy as np
+import multidim
+
+
+class TestColumnar:
+
+    def setup_method(self, function):
+        X = np.load("tests/circle.npy")
+        self.frame = multidim.PointCloud(X, max_length=-1)
+        self.array = multidim.PointCloud(X, max_length=-1, columnar=True)
+
+    def teardown_method(self, function):
+        del self.frame
+        del self.array
+
+    def test_types(self):
+        assert isinstance(self.array.stratum[0], multidim.ArrayStratum)
+        assert isinstance(self.array.stratum[1], multidim.ArrayStratum)
+        assert isinstance(self.array.stratum[2], multidim.ArrayStratum)
+        assert len(self.array.stratum[1]) == len(self.frame.stratum[1])
+
+    def test_pers(self):
+        for pc in [self.frame, self.array]:
+            pc.make_pers0(cutoff=0.15)
+            pc.make_pers1_rca1(cutoff=0.2)
+        assert self.frame.pers0.diagram.equals(self.array.pers0.diagram)
+        assert self.frame.pers1.diagram.equals(self.array.pers1.diagram)
+        for dim in [0, 1]:
+            assert np.all(self.frame.stratum[dim]['pos'].values ==
+                          self.array.stratum[dim]['pos'].values)
+            assert np.all(self.frame.stratum[dim]['rep'].values ==
+                          self.array.stratum[dim]['rep'].values)
+
+    def test_from_distances(self):
+        X = np.random.rand(50, 3)
+        D = multidim.squareform(multidim.pdist(X))
+        A = multidim.SimplicialComplex.from_distances(D, max_length=0.5)
+        B = multidim.SimplicialComplex.from_distances(D, max_length=0.5,
+                                                      columnar=True)
+        A.make_pers0()
+        B.make_pers0()
+        assert A.pers0.diagram.equals(B.pers0.diagram)
+        assert B.stratum[1].to_frame().equals(A.stratum[1])
@@ -0,0 +1,98 @@
+r"""
+Test the condensed distance cache, :code:`PointCloud(cache_type="condensed")`,
+in memory and backed by a :class:`numpy.memmap` file.
+
+Copyright
+---------
+- This file is part of https://github.com/geomdata/gda-public/
+- 2015, 2016, 2017 by Geometric Data Analytics, Inc. (http://geomdata.com)
+- AGPL license. See `LICENSE` or https://github.com/geomdata/gda-public/blob/master/LICENSE
+
+"""
+
+import os
+import shutil
+import tempfile
+import numpy as np
+import pytest
+import multidim
+from multidim import fast_algorithms
+from multidim.fast_algorithms import Metric
+
+
+class TestCondensedCache:
+
+    def setup_method(self, function):
+        np.random.seed(0)
+        self.dirname = tempfile.mkdtemp()
+        self.X = np.random.rand(50, 3)
+        self.D = multidim.squareform(multidim.pdist(self.X))
+
+    def teardown_method(self, function):
+        shutil.rmtree(self.dirname)
+
+    def test_blocks(self):
+        N = self.X.shape[0]
+        cache = fast_algorithms.make_condensed_cache(N)
+        assert cache.shape == (N*(N-1)//2,) and np.all(cache == -1.0)
+        for i, j in [(np.arange(0, N, 7), np.arange(N)),
+                     (np.array([3, 3, 5]), np.array([5, 3, 3])),
+                     (np.arange(N), np.arange(N)),
+                     (np.array([], dtype=np.int64), np.arange(N))]:
+            i = i.astype(np.int64)
+            j = j.astype(np.int64)
+            D = fast_algorithms.distance_cache_condensed(i, j, self.X, cache)
+            assert D.shape == (i.shape[0], j.shape[0])
+            assert np.allclose(D, self.D[np.ix_(i, j)])
+            assert np.all(D[i[:, np.newaxis] == j[np.newaxis, :]] == 0.0)
+        # every pair is known now, and stored once, in the order of pdist
+        assert np.allclose(cache, multidim.pdist(self.X))
+
+    def test_memmap(self):
+        filename = os.path.join(self.dirname, "dists.dat")
+        i = np.arange(0, 50, 3)
+        j = np.arange(50)
+        pc = multidim.PointCloud(self.X, cache_type="condensed", cache_file=filename)
+        assert isinstance(pc.dist_cache, np.memmap)
+        D = pc.dists(i, j)
+        entries = pc.cache_usage(stats=True)['entries']
+        assert entries > 0
+        pc.dist_cache.flush()
+        del pc
+
+        # a later cloud on the same file starts from the stored distances
+        pc = multidim.PointCloud(self.X, cache_type="condensed", cache_file=filename)
+        assert pc.cache_usage(stats=True)['entries'] == entries
+        assert np.all(pc.dists(i, j) == D)
+        assert np.allclose(pc.dists(j, j), self.D)
+
+    def test_key(self):
+        filename = os.path.join(self.dirname, "dists.dat")
+        i = np.arange(0, 50, 3)
+        j = np.arange(50)
+        pc = multidim.PointCloud(self.X, cache_type="condensed", cache_file=filename)
+        pc.dists(i, j)
+        assert pc.cache_usage(stats=True)['entries'] > 0
+        # a file made for other points or another distance is not reused
+        Y = np.random.rand(50, 3)
+        w = np.array([1.0, 0.5, 2.0])
+        for X, dist in [(Y, None), (self.X, "cityblock"),
+                        (self.X, Metric("minkowski", p=3, w=w))]:
+            pc = multidim.PointCloud(X, dist=dist, cache_type="condensed", cache_file=filename)
+            assert pc.cache_usage(stats=True)['entries'] == 0
+            assert np.all(pc.dists(i, j) == pc.metric.cdist(X[i], X))
+        # nor is one made without knowing the points
+        fast_algorithms.make_condensed_cache(50, filename)[:] = 1.0
+        assert np.all(fast_algorithms.make_condensed_cache(50, filename, self.X) == -1.0)
+
+    def test_indices(self):
+        for cache_type in ["condensed", "np"]:
+            pc = multidim.PointCloud(self.X, cache_type=cache_type)
+            pc.dists(np.array([0]), np.arange(50))
+            before = pc.dist_cache.copy()
+            for j in [np.array([2, 50]), np.array([2, -1])]:
+                with pytest.raises(IndexError):
+                    pc.dists(np.array([0, 1]), j)
+            assert np.all(pc.dist_cache == before)
+        with pytest.raises(IndexError):
+            fast_algorithms.condensed_index(50, np.array([0]), np.array([50]))
@@ -43,9 +43,9 @@ class TestCovers:
             s = s+"{}\n".format(cl)
             s = s+"{}\n".format(sorted(list(cl.adults)))
             for ci in sorted(list(cl.adults)):
-                s = s+"{} F1 {}\n".format(ci, cl.friends1[ci])
-                s = s+"{} F2 {}\n".format(ci, cl.friends2[ci])
-                s = s+"{} F3 {}\n".format(ci, cl.friends3[ci])
+                s = s+"{} F1 {}\n".format(ci, cl.friends1[ci].tolist())
+                s = s+"{} F2 {}\n".format(ci, cl.friends2[ci].tolist())
+                s = s+"{} F3 {}\n".format(ci, cl.friends3[ci].tolist())
         t1 = time.clock()
         assert t1-t0 < 30.0, "Took too long!"
         if sys.version_info[0] >= 3 and sys.version_info[1] >= 3:
@@ -74,6 +74,23 @@ class TestCovers:
         #    assert s == f.read(),\
         #        "CoverTree output did not match verified(mostly) example."
 
+    def test_shared(self):
+        numpy.random.seed(0)
+        N = 300
+        ct = multidim.covertree.CoverTree(multidim.PointCloud(numpy.random.rand(N, 2)))
+        levels = list(ct)
+        for cl in levels:
+            assert cl.check()
+            guardians = cl.guardians
+            for a in cl.adults:
+                assert numpy.all(guardians[cl.children[a]] == a)
+        # only the deepest level keeps a guardians array, and the packed
+        # levels store each unchanged block of children once
+        for cl in levels[:-1]:
+            assert cl._guardians is None
+            assert cl.children.flat is ct._children_pool
+        assert ct._children_used < N*(len(levels) - 1)
+
 
     #def test_sparse_complex(self):
     #    for level in self.CT2:
@@ -90,3 +107,39 @@ if __name__ == '__main__':
     #T.test_covers_compare_simple()
     #T.test_sparse_complex()
     T.teardown()
+
+
+class TestGuardians:
+
+    def setup_method(self, function):
+        numpy.random.seed(0)
+        self.X = numpy.random.rand(300, 2)
+
+    def test_rebuilt(self):
+        ct = multidim.covertree.CoverTree(multidim.PointCloud(self.X))
+        kept = []
+        for cl in ct:
+            guardians = cl.guardians
+            kept.append((guardians, guardians.copy()))
+        for cl, (guardians, before) in zip(ct, kept):
+            # what a caller kept is not changed by building deeper levels
+            assert numpy.all(guardians == before)
+            assert numpy.all(cl.guardians == before)
+            for a in cl.adults:
+                assert numpy.all(before[cl.children[a]] == a)
+        for cl in list(ct)[:-1]:
+            assert cl._guardians is None
+            assert cl.guardians is cl.guardians
+            assert not cl.guardians.flags.writeable
+
+    def test_insert(self):
+        pc = multidim.PointCloud(self.X[:200])
+        ct = multidim.covertree.CoverTree(pc)
+        levels = list(ct)
+        before = [(cl.guardians, cl.guardians.copy()) for cl in levels]
+        ct.insert(self.X[200:])
+        for cl, (old, copy) in zip(levels, before):
+            assert numpy.all(old == copy)
+            assert cl.guardians.shape == (300,)
+            for a in cl.adults:
+                assert numpy.all(cl.guardians[cl.children[a]] == a)
@@ -0,0 +1,117 @@
+r"""
+Test that :func:`multidim.covertree.CoverTree.insert` and
+:func:`multidim.PointCloud.insert` give a valid cover tree and the right
+edges, without a rebuild.
+
+Copyright
+---------
+- This file is part of https://github.com/geomdata/gda-public/
+- 2015, 2016, 2017 by Geometric Data Analytics, Inc. (http://geomdata.com)
+- AGPL license. See `LICENSE` or https://github.com/geomdata/gda-public/blob/master/LICENSE
+
+"""
+
+import numpy as np
+import multidim
+import multidim.covertree
+
+
+def verify(ct):
+    pc = ct.pointcloud
+    X = pc.coords.values
+    for cl in ct:
+        assert cl.check()
+        d = pc.dists(np.arange(ct.N), cl.guardians).diagonal()
+        assert np.all(d <= cl.radius), "Not a cover."
+        adults = np.array(cl.adults)
+        D = pc.dists(adults, adults)
+        if cl.exponent > 0:
+            assert np.all(D[np.triu_indices(adults.shape[0], 1)] > cl.radius),\
+                "Adults not separated."
+        for k, T in [(1, cl.T1), (2, cl.T2), (3, cl.T3)]:
+            friends = getattr(cl, "friends{}".format(k))
+            for i, a in enumerate(adults):
+                assert set(friends[a]) == set(adults[D[i] <= T])
+        assert np.allclose(cl.weights.data.sum(axis=0),
+                           pc.label_info['tot_mass'].values)
+
+    queries = np.random.rand(20, X.shape[1])
+    dists, indices = ct.query(queries, k=3)
+    brute = multidim.cdist(queries, X)
+    assert np.allclose(np.sort(brute, axis=1)[:, :3], dists)
+
+
+class TestInsert:
+
+    def setup_method(self, function):
+        np.random.seed(0)
+        self.X = np.random.rand(600, 2)
+
+    def test_insert(self):
+        pc = multidim.PointCloud(self.X[:500])
+        ct = multidim.covertree.CoverTree(pc, ratio=0.5)
+        for cl in ct:
+            pass
+        for start in [500, 550]:
+            new = ct.insert(self.X[start:start + 50])
+            assert new.tolist() == list(range(start, start + 50))
+            verify(ct)
+        assert ct.N == 600
+        assert np.all(ct.cohort[ct[-1].adults] >= 0)
+
+    def test_partial(self):
+        pc = multidim.PointCloud(self.X[:500])
+        ct = multidim.covertree.CoverTree(pc, exchange_teens=False)
+        ct[2]
+        ct.insert(self.X[500:])
+        verify(ct)
+
+    def test_duplicates(self):
+        pc = multidim.PointCloud(self.X[:300])
+        ct = multidim.covertree.CoverTree(pc)
+        for cl in ct:
+            pass
+        ct.insert(self.X[:10])
+        verify(ct)
+        assert pc.multiplicity[ct[-1].adults].sum() == 310
+
+    def test_outside(self):
+        pc = multidim.PointCloud(self.X[:300])
+        ct = multidim.covertree.CoverTree(pc)
+        for cl in ct:
+            pass
+        ct.insert(np.array([[3.0, 3.0]]))
+        verify(ct)
+
+    def test_phases(self):
+        pc = multidim.PointCloud(self.X[:500])
+        ct = multidim.covertree.CoverTree(pc, ratio=0.5)
+        levels = list(ct)
+        adults = [cl.adults.copy() for cl in levels]
+        # detach the tree, so that pc.insert does not place the points
+        pc.covertree = None
+        new = pc.insert(self.X[500:])
+        pc.covertree = ct
+        ct._extend(new.shape[0])
+        placement = multidim.covertree._Placement(ct, 500)
+        placement.adopt_new(new)
+        placement.place_pending()
+        for e, cl in enumerate(levels):
+            assert np.all(cl.adults == adults[e]), "Levels changed before repack."
+            g = np.array([placement.guardian(e, x) for x in new])
+            assert np.all(pc.dists(new, g).diagonal() <= cl.radius)
+        placement.repack()
+        verify(ct)
+
+    def test_edges(self):
+        pc = multidim.PointCloud(self.X[:500], max_length=0.08)
+        pc.insert(self.X[500:])
+        rebuilt = multidim.PointCloud(self.X, max_length=0.08)
+        edges = pc.stratum[1]
+        assert np.all(np.diff(edges['height'].values) >= 0)
+        assert set(zip(edges['bdy0'].values, edges['bdy1'].values)) == \
+            set(zip(rebuilt.stratum[1]['bdy0'].values, rebuilt.stratum[1]['bdy1'].values))
+        pc.make_pers0()
+        rebuilt.make_pers0()
+        assert np.allclose(np.sort(pc.pers0.diagram['death'].values),
+                           np.sort(rebuilt.pers0.diagram['death'].values))
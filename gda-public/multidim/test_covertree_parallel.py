@@ -0,0 +1,51 @@
+r"""
+Test that the bulk (parallel) construction of a
+:class:`multidim.covertree.CoverTree` gives the same tree as the
+one-orphan-at-a-time construction.
+
+Copyright
+---------
+- This file is part of https://github.com/geomdata/gda-public/
+- 2015, 2016, 2017 by Geometric Data Analytics, Inc. (http://geomdata.com)
+- AGPL license. See `LICENSE` or https://github.com/geomdata/gda-public/blob/master/LICENSE
+
+"""
+
+import numpy as np
+import multidim
+import multidim.covertree
+
+
+class TestParallel:
+
+    def setup_method(self, function):
+        np.random.seed(0)
+        self.circle = np.load("tests/circle.npy")
+        # rounding makes many duplicates and distance ties
+        self.grid = np.round(np.random.rand(600, 2), 1)
+
+    def levels(self, X, parallel, **kwargs):
+        pc = multidim.PointCloud(X, **kwargs)
+        ct = multidim.covertree.CoverTree(pc, parallel=parallel)
+        out = []
+        for cl in ct:
+            out.append((list(cl.adults),
+                        cl.guardians.tolist(),
+                        {a: cl.children[a].tolist() for a in cl.adults},
+                        {a: list(cl.friends1[a]) for a in cl.adults},
+                        {a: list(cl.friends2[a]) for a in cl.adults},
+                        {a: list(cl.friends3[a]) for a in cl.adults},
+                        dict(cl.predecessor),
+                        {a: list(s) for a, s in cl.successors.items()}))
+        return out, ct.cohort.tolist(), pc.multiplicity.tolist()
+
+    def test_same_tree(self):
+        for X in [self.circle, self.grid]:
+            for dist in ["euclidean", "cityblock"]:
+                assert self.levels(X, False, dist=dist) == \
+                    self.levels(X, True, dist=dist)
+
+    def test_check(self):
+        pc = multidim.PointCloud(self.circle)
+        for cl in multidim.covertree.CoverTree(pc, parallel=True):
+            assert cl.check()
@@ -0,0 +1,74 @@
+r"""
+Test the out-of-sample queries :func:`multidim.covertree.CoverTree.query` and
+:func:`multidim.covertree.CoverTree.query_radius` against brute force.
+
+Copyright
+---------
+- This file is part of https://github.com/geomdata/gda-public/
+- 2015, 2016, 2017 by Geometric Data Analytics, Inc. (http://geomdata.com)
+- AGPL license. See `LICENSE` or https://github.com/geomdata/gda-public/blob/master/LICENSE
+
+"""
+
+import numpy as np
+import pytest
+import multidim
+import multidim.covertree
+
+
+class TestQuery:
+
+    def setup_method(self, function):
+        np.random.seed(0)
+        self.X = np.random.rand(400, 3)
+        self.X[7] = self.X[8]
+        self.Q = np.random.rand(100, 3)
+        self.Q[0] = self.X[7]
+
+    def test_query(self):
+        for dist in ["euclidean", "cityblock"]:
+            pc = multidim.PointCloud(self.X, dist=dist)
+            ct = multidim.covertree.CoverTree(pc)
+            D = multidim.cdist(self.Q, self.X, dist)
+            for k in [1, 4]:
+                dists, indices = ct.query(self.Q, k=k)
+                assert dists.shape == (100, k)
+                assert np.allclose(dists, np.sort(D, axis=1)[:, :k])
+                assert np.allclose(D[np.arange(100)[:, np.newaxis], indices], dists)
+            dists, indices = ct.query(self.Q[0], k=2)
+            assert sorted(indices[0].tolist()) == [7, 8]
+
+    def test_query_radius(self):
+        pc = multidim.PointCloud(self.X)
+        ct = multidim.covertree.CoverTree(pc)
+        D = multidim.cdist(self.Q, self.X)
+        indices, dists = ct.query_radius(self.Q, 0.2, return_distance=True)
+        assert len(indices) == 100
+        for q in range(100):
+            assert sorted(indices[q].tolist()) == np.where(D[q] <= 0.2)[0].tolist()
+            assert np.allclose(dists[q], D[q, indices[q]])
+
+    def test_dimension(self):
+        ct = multidim.covertree.CoverTree(multidim.PointCloud(self.X))
+        for Q in [self.Q[:, :2], np.random.rand(10, 5), np.random.rand(5)]:
+            with pytest.raises(ValueError):
+                ct.query(Q, k=2)
+            with pytest.raises(ValueError):
+                ct.query_radius(Q, 0.2)
+        i = np.arange(3)
+        with pytest.raises(ValueError):
+            multidim.fast_algorithms.distance_pairs(i, i[:2], self.X)
+        with pytest.raises(ValueError):
+            multidim.fast_algorithms.distance_pairs(i, i, self.X, cloud0=self.Q[:, :2])
+        with pytest.raises(IndexError):
+            multidim.fast_algorithms.distance_pairs(i + 98, i, self.X, cloud0=self.Q)
+
+    def test_nearest_neighbors(self):
+        pc = multidim.PointCloud(self.X)
+        nn = pc.nearest_neighbors(6)
+        D = multidim.cdist(self.X, self.X)
+        assert nn.shape == (400, 7)
+        assert np.all(nn[:, 0] == np.arange(400))
+        assert np.allclose(D[np.arange(400)[:, np.newaxis], nn],
+                           np.sort(D, axis=1)[:, :7])
+        assert nn[7, 1] == 8 and nn[8, 1] == 7
@@ -0,0 +1,108 @@
+r"""
+Test that :func:`multidim.covertree.CoverTree.remove` and
+:func:`multidim.PointCloud.remove` keep a valid cover tree and the right
+strata, such as for a sliding window.
+
+Copyright
+---------
+- This file is part of https://github.com/geomdata/gda-public/
+- 2015, 2016, 2017 by Geometric Data Analytics, Inc. (http://geomdata.com)
+- AGPL license. See `LICENSE` or https://github.com/geomdata/gda-public/blob/master/LICENSE
+
+"""
+
+import numpy as np
+import multidim
+import multidim.covertree
+from multidim.test_covertree_insert import verify
+
+
+def edge_set(pc):
+    return set(zip(pc.stratum[1]['bdy0'].values, pc.stratum[1]['bdy1'].values))
+
+
+class TestRemove:
+
+    def setup_method(self, function):
+        np.random.seed(0)
+        self.X = np.random.rand(900, 2)
+
+    def test_window(self):
+        pc = multidim.PointCloud(self.X[:500], max_length=0.08)
+        ct = pc.covertree
+        for cl in ct:
+            pass
+        for start in range(0, 400, 100):
+            remap = ct.remove(np.arange(100))
+            assert remap[:100].tolist() == [-1]*100
+            assert remap[100:].tolist() == list(range(400))
+            ct.insert(self.X[start + 500:start + 600])
+            assert np.all(pc.coords.values == self.X[start + 100:start + 600])
+            verify(ct)
+            rebuilt = multidim.PointCloud(self.X[start + 100:start + 600], max_length=0.08)
+            assert edge_set(pc) == edge_set(rebuilt)
+            assert np.all(np.diff(pc.stratum[1]['height'].values) >= 0)
+
+    def test_adults(self):
+        pc = multidim.PointCloud(self.X[:500])
+        ct = multidim.covertree.CoverTree(pc, exchange_teens=False)
+        for cl in ct:
+            pass
+        adults = np.array(ct[3].adults)
+        ct.remove(adults)
+        assert ct.N == 500 - adults.shape[0]
+        verify(ct)
+
+    def test_leaves(self):
+        pc = multidim.PointCloud(self.X[:500])
+        ct = multidim.covertree.CoverTree(pc)
+        levels = [ct[e] for e in range(4)]
+        before = [(cl.adults.copy(), cl.guardians.copy(),
+                   [cl.friends1[a].copy() for a in cl.adults]) for cl in levels]
+        # points that are not adults yet guard nobody, so nothing is re-guarded
+        leaves = np.flatnonzero(ct.cohort < 0)[::3]
+        remap = ct.remove(leaves)
+        for e, (adults, guardians, friends) in enumerate(before):
+            cl = ct[e]
+            assert np.all(cl.adults == remap[adults])
+            assert np.all(cl.guardians == remap[guardians[remap >= 0]])
+            for a, f in zip(adults, friends):
+                assert np.all(cl.friends1[remap[a]] == remap[f])
+        verify(ct)
+
+    def test_reguard(self):
+        pc = multidim.PointCloud(self.X[:500])
+        ct = multidim.covertree.CoverTree(pc)
+        levels = [ct[e] for e in range(5)]
+        adults = np.array(levels[2].adults)[1::2]
+        orphans = np.flatnonzero(np.in1d(levels[2].guardians, adults))
+        orphans = orphans[~np.in1d(orphans, adults)]
+        placement = multidim.covertree._Placement(ct, ct.N)
+        placement.reguard(adults)
+        for e in range(2, 5):
+            assert all(placement.guardian(e, z) == -1 for z in adults)
+            g = np.array([placement.guardian(e, z) for z in orphans])
+            assert not np.any(np.in1d(g, adults))
+            assert np.all(pc.dists(orphans, g).diagonal() <= levels[e].radius)
+
+    def test_adult0(self):
+        pc = multidim.PointCloud(self.X[:300])
+        ct = multidim.covertree.CoverTree(pc)
+        for cl in ct:
+            pass
+        ct.remove(np.array([ct._adult0]))
+        assert ct.N == 299
+        verify(ct)
+
+    def test_labels(self):
+        pc = multidim.PointCloud.from_multisample_multilabel(
+            [self.X[:200], self.X[200:400]], ["a", "b"])
+        ct = multidim.covertree.CoverTree(pc)
+        for cl in ct:
+            pass
+        ct.remove(np.arange(150, 250))
+        assert pc.label_info['points'].tolist() == [150, 150]
+        for cl in ct:
+            assert cl.check()
+            assert np.allclose(cl.weights.data.sum(axis=0),
+                               pc.label_info['weight'].values)
@@ -0,0 +1,82 @@
+r"""
+Test that a :class:`multidim.covertree.CoverTree` survives
+:func:`multidim.covertree.CoverTree.save` and
+:func:`multidim.covertree.CoverTree.load`.
+
+Copyright
+---------
+- This file is part of https://github.com/geomdata/gda-public/
+- 2015, 2016, 2017 by Geometric Data Analytics, Inc. (http://geomdata.com)
+- AGPL license. See `LICENSE` or https://github.com/geomdata/gda-public/blob/master/LICENSE
+
+"""
+
+import shutil
+import tempfile
+import numpy as np
+import multidim
+import multidim.covertree
+
+
+def summary(ct):
+    out = []
+    # successors are only filled in by the next level
+    for cl in list(ct):
+        out.append((list(cl.adults),
+                    cl.guardians.tolist(),
+                    {a: cl.children[a].tolist() for a in cl.adults},
+                    {a: list(cl.friends1[a]) for a in cl.adults},
+                    {a: list(cl.friends2[a]) for a in cl.adults},
+                    {a: list(cl.friends3[a]) for a in cl.adults},
+                    dict(cl.predecessor),
+                    {a: list(s) for a, s in cl.successors.items()},
+                    {a: cl.weights[a].tolist() for a in cl.adults}))
+    return out, ct.cohort.tolist(), ct.pointcloud.multiplicity.tolist()
+
+
+class TestSave:
+
+    def setup_method(self, function):
+        self.dirname = tempfile.mkdtemp()
+        self.X = np.load("tests/circle.npy")
+
+    def teardown_method(self, function):
+        shutil.rmtree(self.dirname)
+
+    def test_roundtrip(self):
+        pc = multidim.PointCloud(self.X)
+        ct = multidim.covertree.CoverTree(pc)
+        expected = summary(ct)
+        ct.save(self.dirname)
+        for mmap_mode in ['r', None]:
+            pc = multidim.PointCloud(self.X)
+            loaded = multidim.covertree.CoverTree.load(pc, self.dirname,
+                                                       mmap_mode=mmap_mode)
+            assert pc.covertree is loaded
+            assert summary(loaded) == expected
+            dists, indices = loaded.query(self.X[:10], k=3)
+            assert np.all(indices[:, 0] == np.arange(10))
+
+    def test_partial(self):
+        pc = multidim.PointCloud(self.X)
+        expected = summary(multidim.covertree.CoverTree(pc))
+        pc = multidim.PointCloud(self.X)
+        ct = multidim.covertree.CoverTree(pc)
+        ct[3]
+        ct.save(self.dirname)
+        pc = multidim.PointCloud(self.X)
+        loaded = multidim.covertree.CoverTree.load(pc, self.dirname)
+        assert len(loaded) == 4
+        assert summary(loaded) == expected
+
+    def test_mismatch(self):
+        pc = multidim.PointCloud(self.X)
+        multidim.covertree.CoverTree(pc)[2]
+        pc.covertree.save(self.dirname)
+        try:
+            multidim.covertree.CoverTree.load(multidim.PointCloud(self.X[:10]),
+                                              self.dirname)
+        except ValueError:
+            pass
+        else:
+            assert False, "loaded a tree for the wrong PointCloud"
@@ -0,0 +1,74 @@
+r"""
+Test that :func:`multidim.covertree.CoverTree.sparse_complex` gives a sparse
+filtration whose persistence is close to that of the full Rips complex.
+
+Copyright
+---------
+- This file is part of https://github.com/geomdata/gda-public/
+- 2015, 2016, 2017 by Geometric Data Analytics, Inc. (http://geomdata.com)
+- AGPL license. See `LICENSE` or https://github.com/geomdata/gda-public/blob/master/LICENSE
+
+"""
+
+import numpy as np
+import pytest
+import multidim
+import multidim.covertree
+
+
+class TestSparse:
+
+    def setup_method(self, function):
+        np.random.seed(0)
+        t = np.random.rand(300)*2*np.pi
+        self.X = np.stack([np.cos(t), np.sin(t)], axis=1) \
+            + np.random.rand(300, 2)*0.1
+        self.X = np.concatenate([self.X, self.X[:5]])
+
+    def test_edges(self):
+        pc = multidim.PointCloud(self.X)
+        ct = multidim.covertree.CoverTree(pc)
+        full = self.X.shape[0]*(self.X.shape[0] - 1)//2
+        last = full
+        for epsilon in [0.1, 0.5, 0.9]:
+            sc = ct.sparse_complex(epsilon)
+            edges = sc.stratum[1]
+            assert edges.shape[0] < last
+            last = edges.shape[0]
+            hgts = edges['height'].values
+            assert np.all(np.diff(hgts) >= 0)
+            bdy0 = edges['bdy0'].values
+            bdy1 = edges['bdy1'].values
+            assert np.all(bdy0 < bdy1)
+            d = np.sqrt(((self.X[bdy0] - self.X[bdy1])**2).sum(axis=1))
+            assert np.all(hgts >= d - 1e-12)
+            assert np.all(hgts <= d*(1 + epsilon) + 1e-12)
+        with pytest.raises(ValueError):
+            ct.sparse_complex(1.0)
+
+    def test_linear(self):
+        per_point = []
+        for n in [500, 2000]:
+            pc = multidim.PointCloud(np.random.rand(n, 2))
+            sc = multidim.covertree.CoverTree(pc).sparse_complex(0.9)
+            per_point.append(sc.stratum[1].shape[0]/n)
+        assert per_point[1] < 2*per_point[0]
+
+    def test_persistence(self):
+        pc = multidim.PointCloud(self.X, max_length=-1)
+        pc.make_pers0()
+        pc.make_pers1_rca1()
+        sc = multidim.covertree.CoverTree(
+            multidim.PointCloud(self.X)).sparse_complex(0.1)
+        sc.make_pers0()
+        sc.make_pers1_rca1()
+        # the full complex has no edges of length 0, so compare the longest
+        assert np.allclose(np.sort(sc.pers0.diagram['death'].values)[-100:],
+                           np.sort(pc.pers0.diagram['death'].values)[-100:],
+                           rtol=0.1)
+
+        def top(diagram):
+            pers = diagram['death'].values - diagram['birth'].values
+            return np.sort(pers)[-1]
+        assert top(pc.pers1.diagram) > 0.5
+        assert np.isclose(top(sc.pers1.diagram), top(pc.pers1.diagram), rtol=0.25)
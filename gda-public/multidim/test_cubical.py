@@ -0,0 +1,123 @@
+r"""
+Test cubical persistence of images and volumes in :mod:`homology.cubical`,
+by counting components and holes of sublevel sets directly, and tiled
+persistence of memory-mapped arrays against the in-memory result.
+
+Copyright
+---------
+- This file is part of https://github.com/geomdata/gda-public/
+- 2015, 2016, 2017 by Geometric Data Analytics, Inc. (http://geomdata.com)
+- AGPL license. See `LICENSE` or https://github.com/geomdata/gda-public/blob/master/LICENSE
+
+"""
+
+import os
+import shutil
+import tempfile
+import numpy as np
+import pytest
+from scipy import ndimage
+from homology import cubical
+
+
+def alive(pd, t):
+    r""" number of bars of a diagram that are alive at threshold t """
+    bars = pd.diagram
+    return np.count_nonzero((bars['birth'].values <= t) & (t < bars['death'].values))
+
+
+def voids(img, t):
+    r""" number of components of the superlevel set above t, joined to all
+    neighbors, that are cut off from the outside of the grid """
+    outside = np.pad(img > t, 1, mode='constant', constant_values=True)
+    return ndimage.label(outside, structure=np.ones((3,)*img.ndim))[1] - 1
+
+
+class TestCubical:
+
+    def setup_method(self, function):
+        np.random.seed(0)
+        self.img = np.random.randint(0, 10, size=(30, 40)).astype(np.float64)
+        self.vol = np.random.randint(0, 6, size=(8, 9, 10)).astype(np.float64)
+
+    def test_pers0(self):
+        for img in [self.img, self.vol]:
+            pd = cubical.pers0(img)
+            assert np.all(pd.diagram['pers'].values > 0)
+            assert np.all(img.ravel()[pd.diagram['birth_index'].values] == pd.diagram['birth'].values)
+            for t in np.unique(img)[:-1]:
+                n = ndimage.label(img <= t)[1]
+                assert alive(pd, t) == n
+
+    def test_pers1(self):
+        img = self.img
+        pd = cubical.pers1(img)
+        assert np.all(pd.diagram['pers'].values > 0)
+        for t in np.unique(img):
+            sub = img <= t
+            V = np.count_nonzero(sub)
+            E = np.count_nonzero(sub[1:, :] & sub[:-1, :]) \
+                + np.count_nonzero(sub[:, 1:] & sub[:, :-1])
+            F = np.count_nonzero(sub[1:, 1:] & sub[:-1, 1:] & sub[1:, :-1] & sub[:-1, :-1])
+            b0 = ndimage.label(sub)[1]
+            assert alive(pd, t) == b0 - (V - E + F)
+            assert alive(pd, t) == voids(img, t)
+
+    def test_pers2(self):
+        shell = np.full((7, 7, 7), 5.0)
+        shell[1:6, 1:6, 1:6] = 1.0
+        shell[2:5, 2:5, 2:5] = 4.0
+        shell[3, 3, 3] = 2.0
+        pd = cubical.pers2(shell)
+        assert pd.diagram[['birth', 'death']].values.tolist() == [[1.0, 4.0]]
+
+        pd = cubical.pers2(self.vol)
+        for t in np.unique(self.vol):
+            assert alive(pd, t) == voids(self.vol, t)
+
+    def test_fortran(self):
+        for img, pers in [(self.img, [cubical.pers0, cubical.pers1]),
+                          (self.vol, [cubical.pers0, cubical.pers2])]:
+            for f in pers:
+                expected = f(img).diagram
+                assert f(np.asfortranarray(img)).diagram.equals(expected)
+                assert f(np.ascontiguousarray(img.T).T).diagram.equals(expected)
+            transposed = cubical.pers0(img.T).diagram
+            assert transposed.equals(cubical.pers0(np.ascontiguousarray(img.T)).diagram)
+
+    def test_dimension(self):
+        with pytest.raises(ValueError):
+            cubical.pers1(self.vol)
+        with pytest.raises(ValueError):
+            cubical.pers2(self.img)
+
+
+class TestTiled:
+
+    def setup_method(self, function):
+        np.random.seed(0)
+        self.dirname = tempfile.mkdtemp()
+
+    def teardown_method(self, function):
+        shutil.rmtree(self.dirname)
+
+    def test_ties(self):
+        for shape in [(13, 7), (1, 9), (9, 1), (6, 5, 4)]:
+            img = np.random.randint(0, 4, size=shape).astype(np.float64)
+            expected = cubical.pers0(img).diagram
+            for tile in range(1, shape[0] + 1):
+                assert cubical.pers0(img, tile=tile).diagram.equals(expected)
+
+    def test_memmap(self):
+        img = ndimage.gaussian_filter(np.random.rand(300, 200), 3).astype(np.float32)
+        filename = os.path.join(self.dirname, "img.dat")
+        mm = np.memmap(filename, dtype=np.float32, mode='w+', shape=img.shape)
+        mm[:] = img
+        mm.flush()
+        del mm
+        mm = np.memmap(filename, dtype=np.float32, mode='r', shape=img.shape)
+        expected = cubical.pers0(img).diagram
+        assert cubical.pers0(mm, tile=32).diagram.equals(expected)
+        assert cubical.pers0(mm, tile=50, parallel=True).diagram.equals(expected)
+        assert cubical.pers0(mm[100:], tile=50, parallel=True).diagram.equals(
+            cubical.pers0(img[100:]).diagram)
@@ -0,0 +1,65 @@
+r"""
+Test :func:`multidim.PointCloud.unique_with_multiplicity` and
+:func:`multidim.PointCloud.deduplicate` in several dimensions.
+
+Copyright
+---------
+- This file is part of https://github.com/geomdata/gda-public/
+- 2015, 2016, 2017 by Geometric Data Analytics, Inc. (http://geomdata.com)
+- AGPL license. See `LICENSE` or https://github.com/geomdata/gda-public/blob/master/LICENSE
+
+"""
+
+import numpy as np
+import multidim
+
+
+class TestDeduplicate:
+
+    def setup_method(self, function):
+        np.random.seed(0)
+        self.X = np.random.rand(200, 3)
+        self.repeats = np.random.randint(1, 5, size=200)
+        self.Y = np.repeat(self.X, self.repeats, axis=0)
+        self.shuffle = np.random.permutation(self.Y.shape[0])
+        self.Y = self.Y[self.shuffle]
+
+    def test_exact(self):
+        pc = multidim.PointCloud(self.Y)
+        coords, counts = pc.unique_with_multiplicity()
+        order = np.lexsort(self.X.T[::-1])
+        assert np.all(coords == self.X[order])
+        assert np.all(counts == self.repeats[order])
+
+        new, inverse, counts = pc.deduplicate()
+        assert new.coords.shape == (200, 3)
+        assert np.all(new.coords.values[inverse] == self.Y)
+        assert np.all(np.bincount(inverse) == counts)
+        assert np.all(new.stratum[0]['mass'].values == counts)
+        assert np.all(np.diff(np.unique(inverse, return_index=True)[1]) > 0)
+
+    def test_epsilon(self):
+        pc = multidim.PointCloud(self.Y)
+        coords, counts = pc.unique_with_multiplicity(epsilon=0.2)
+        assert counts.sum() == self.Y.shape[0]
+        assert coords.shape[0] < 200
+        new, inverse, counts = pc.deduplicate(epsilon=0.2)
+        assert np.all(np.linalg.norm(new.coords.values[inverse] - self.Y, axis=1) <= 0.2)
+        D = multidim.cdist(new.coords.values, new.coords.values)
+        assert np.all(D[np.triu_indices(D.shape[0], 1)] > 0.2*pc.covertree.ratio)
+        assert np.isclose(new.stratum[0]['mass'].sum(), self.Y.shape[0])
+
+    def test_labels(self):
+        pc = multidim.PointCloud.from_multisample_multilabel(
+            [self.Y[:300], self.Y[300:], self.Y[:50]], ["a", "b", "a"])
+        heights = np.random.rand(pc.coords.shape[0])
+        pc.stratum[0]['height'] = heights
+        new, inverse, counts = pc.deduplicate()
+        assert np.all(new.labels[inverse] == pc.labels)
+        assert np.all(new.source[inverse] == pc.source)
+        assert new.label_info['points'].tolist() == \
+            [np.count_nonzero(new.labels == i) for i in range(2)]
+        assert np.allclose(np.bincount(new.labels, weights=new.stratum[0]['mass'].values),
+                           pc.label_info['weight'].values)
+        for g in range(new.coords.shape[0]):
+            assert new.stratum[0]['height'].values[g] == heights[inverse == g].min()
@@ -0,0 +1,69 @@
+r"""
+Test :func:`multidim.SimplicialComplex.from_distances` and
+:func:`multidim.fast_algorithms.edges_from_dists` on square, condensed, and
+memory-mapped distances.
+
+Copyright
+---------
+- This file is part of https://github.com/geomdata/gda-public/
+- 2015, 2016, 2017 by Geometric Data Analytics, Inc. (http://geomdata.com)
+- AGPL license. See `LICENSE` or https://github.com/geomdata/gda-public/blob/master/LICENSE
+
+"""
+
+import itertools
+import os
+import shutil
+import tempfile
+import numpy as np
+import multidim
+from multidim import fast_algorithms
+
+
+class TestFromDistances:
+
+    def setup_method(self, function):
+        np.random.seed(0)
+        self.dirname = tempfile.mkdtemp()
+        # rounded, so that there are ties
+        self.X = np.round(np.random.rand(80, 2), 1)
+        self.y = multidim.pdist(self.X)
+        self.D = multidim.squareform(self.y)
+
+    def teardown_method(self, function):
+        shutil.rmtree(self.dirname)
+
+    def test_edges(self):
+        n = self.X.shape[0]
+        idx = np.arange(n, dtype=np.int64) + 100
+        pairs = np.array(list(itertools.combinations(range(n), 2)))
+        for cutoff in [-1.0, 0.0, 0.3, 2.0]:
+            keep = np.flatnonzero(self.y < cutoff) if cutoff >= 0 else np.arange(pairs.shape[0])
+            keep = keep[np.argsort(self.y[keep], kind='stable')]
+            for dists in [self.D, self.y]:
+                for chunk in [1, 50, 1048576]:
+                    val, pos, bdy = fast_algorithms.edges_from_dists(idx, dists, cutoff, chunk=chunk)
+                    assert np.all(val == self.y[keep])
+                    assert np.all(bdy == idx[pairs[keep]])
+                    assert pos.dtype == 'bool' and np.all(pos)
+
+    def test_condensed(self):
+        filename = os.path.join(self.dirname, "dists.dat")
+        mm = np.memmap(filename, dtype=np.float64, mode='w+', shape=self.y.shape)
+        mm[:] = self.y
+        mm.flush()
+        del mm
+        mm = np.memmap(filename, dtype=np.float64, mode='r', shape=self.y.shape)
+
+        A = multidim.SimplicialComplex.from_distances(self.D, max_length=0.4)
+        for dists in [self.y, mm]:
+            for columnar in [False, True]:
+                B = multidim.SimplicialComplex.from_distances(dists, max_length=0.4,
+                                                              columnar=columnar)
+                assert B.stratum[0].shape[0] == self.X.shape[0]
+                for dim in [0, 1]:
+                    for col in A.stratum[dim].columns:
+                        assert np.all(B.stratum[dim][col].values == A.stratum[dim][col].values)
+        A.make_pers0()
+        B.make_pers0()
+        assert A.pers0.diagram.equals(B.pers0.diagram)
@@ -0,0 +1,84 @@
+r"""
+Test :func:`multidim.PointCloud.landmarks` and
+:func:`multidim.PointCloud.witness_complex`.
+
+Copyright
+---------
+- This file is part of https://github.com/geomdata/gda-public/
+- 2015, 2016, 2017 by Geometric Data Analytics, Inc. (http://geomdata.com)
+- AGPL license. See `LICENSE` or https://github.com/geomdata/gda-public/blob/master/LICENSE
+
+"""
+
+import numpy as np
+import pytest
+import multidim
+
+
+class TestLandmarks:
+
+    def setup_method(self, function):
+        np.random.seed(0)
+        self.X = np.random.rand(500, 2)
+
+    def test_landmarks(self):
+        pc = multidim.PointCloud(self.X)
+        for n in [1, 10, 37, 100]:
+            marks = pc.landmarks(n)
+            assert marks.shape == (n,)
+            assert np.unique(marks).shape == (n,)
+            for cl in pc.covertree:
+                if len(cl.adults) > n:
+                    break
+                assert set(cl.adults) <= set(marks)
+                covered = pc.dists(np.arange(500), marks).min(axis=1)
+                assert np.all(covered <= cl.radius)
+        assert pc.landmarks(level=3).tolist() == list(pc.covertree[3].adults)
+        with pytest.raises(ValueError):
+            pc.landmarks()
+
+    def test_duplicates(self):
+        pc = multidim.PointCloud(np.concatenate([self.X[:20], self.X[:20]]))
+        marks = pc.landmarks(100)
+        assert marks.shape == (20,)
+        assert sorted(marks % 20) == list(range(20))
+
+
+class TestWitness:
+
+    def setup_method(self, function):
+        np.random.seed(0)
+        t = np.random.rand(400)*2*np.pi
+        self.X = np.stack([np.cos(t), np.sin(t)], axis=1) \
+            + np.random.rand(400, 2)*0.2
+
+    def test_full(self):
+        pc = multidim.PointCloud(self.X)
+        marks = pc.landmarks(30)
+        D = multidim.cdist(self.X, self.X[marks])
+        near = np.sort(D, axis=1)
+        for nu in [0, 1, 2]:
+            wc = pc.witness_complex(marks, k=30, nu=nu)
+            m_nu = near[:, nu - 1] if nu > 0 else 0.0
+            edges = wc.stratum[1]
+            assert edges.shape[0] == 30*29//2
+            assert np.all(np.diff(edges['height'].values) >= 0)
+            for a, b, h in zip(edges['bdy0'].values, edges['bdy1'].values,
+                               edges['height'].values):
+                assert a < b
+                assert np.isclose(h, (np.maximum(D[:, a], D[:, b]) - m_nu).min())
+            assert np.isclose(wc.stratum[0]['mass'].sum(), 400.0)
+            assert np.allclose(wc.coords.values, self.X[marks])
+
+    def test_persistence(self):
+        pc = multidim.PointCloud(self.X)
+        wc = pc.witness_complex(50, k=8, nu=0)
+        assert wc.stratum[1].shape[0] < 50*8
+        wc.make_pers0()
+        assert wc.pers0.diagram.shape[0] == 50
+        wc = pc.witness_complex(50, k=50)
+        wc.make_pers1_rca1()
+        pers = wc.pers1.diagram['death'] - wc.pers1.diagram['birth']
+        assert pers.max() > 0.5
+        with pytest.raises(ValueError):
+            pc.witness_complex(50, nu=3)
@@ -193,6 +193,79 @@ class TestLowerStar:
             """[3, {1, 3}]"""
         pass
 
+class TestLowerStarArrays:
+
+    def setup_method(self, function):
+        numpy.random.seed(0)
+
+    def check_faces(self, sc, img):
+        vert_hgt = img.ravel()
+        edges = sc.stratum[1]
+        bdy0 = edges['bdy0'].values
+        bdy1 = edges['bdy1'].values
+        assert numpy.all(edges['height'].values ==
+                         numpy.maximum(vert_hgt[bdy0], vert_hgt[bdy1]))
+        assert len(set(zip(bdy0, bdy1))) == len(edges)
+        faces = sc.stratum[2]
+        verts = numpy.stack([numpy.concatenate([bdy0[faces[b].values], bdy1[faces[b].values]])
+                             for b in ['bdy0', 'bdy1', 'bdy2']])
+        verts = numpy.sort(verts.reshape(3, 2, -1).transpose(2, 0, 1).reshape(-1, 6), axis=1)
+        # each vertex of a triangle is on two of its edges
+        assert numpy.all(verts[:, 0] == verts[:, 1])
+        assert numpy.all(verts[:, 2] == verts[:, 3])
+        assert numpy.all(verts[:, 4] == verts[:, 5])
+        assert numpy.all(numpy.diff(verts[:, ::2], axis=1) > 0)
+        assert numpy.all(faces['height'].values == vert_hgt[verts].max(axis=1))
+
+    def test_image(self):
+        img = numpy.random.randint(0, 5, size=(7, 9)).astype(numpy.float64)
+        sc = multidim.lower_star_for_image(img)
+        assert len(sc.stratum[1]) == 7*8 + 6*9 + 6*8
+        assert len(sc.stratum[2]) == 2*6*8
+        self.check_faces(sc, img)
+        # the diagonal of each square passes through its highest corner
+        diag = sc.stratum[1].iloc[7*8 + 6*9:]
+        corners = numpy.stack([img[:-1, :-1], img[:-1, 1:], img[1:, 1:], img[1:, :-1]]).reshape(4, -1)
+        assert numpy.all(diag['height'].values == corners.max(axis=0))
+
+    def test_volume(self):
+        vol = numpy.random.rand(4, 5, 6)
+        sc = multidim.lower_star_for_image(vol, columnar=True)
+        # the 2-skeleton of a triangulated box, with 6 tetrahedra per cube
+        assert len(sc.stratum[0]) - len(sc.stratum[1]) + len(sc.stratum[2]) == 1 + 6*3*4*5
+        self.check_faces(sc, vol)
+
+    def test_slices(self):
+        for shape in [(1, 5, 6), (5, 1, 6), (5, 6, 1), (1, 1, 6), (1, 1, 1)]:
+            vol = numpy.random.rand(*shape)
+            sc = multidim.lower_star_for_image(vol)
+            m, n = sorted(shape)[1:]
+            assert len(sc.stratum[0]) == m*n
+            assert len(sc.stratum[1]) == m*(n - 1) + (m - 1)*n + (m - 1)*(n - 1)
+            assert len(sc.stratum[2]) == 2*(m - 1)*(n - 1)
+            if len(sc.stratum[2]) > 0:
+                self.check_faces(sc, vol)
+
+    def test_sort(self):
+        from scipy import ndimage
+        vol = numpy.random.rand(6, 7, 8)
+        sc = multidim.lower_star_for_image(vol, sort=True)
+        assert numpy.all(numpy.diff(sc.stratum[1]['height'].values) >= 0)
+        assert numpy.all(numpy.diff(sc.stratum[2]['height'].values) >= 0)
+        self.check_faces(sc, vol)
+
+        # components of sublevel sets, with the 14 Freudenthal neighbors
+        structure = numpy.zeros((3, 3, 3), dtype='bool')
+        for d in [(0, 0, 0), (1, 0, 0), (0, 1, 0), (0, 0, 1), (1, 1, 0),
+                  (1, 0, 1), (0, 1, 1), (1, 1, 1)]:
+            structure[tuple(1 + numpy.array(d))] = True
+            structure[tuple(1 - numpy.array(d))] = True
+        sc.make_pers0()
+        diagram = sc.pers0.diagram
+        for t in numpy.linspace(0.05, 0.95, 10):
+            alive = numpy.count_nonzero((diagram['birth'] <= t) & (diagram['death'] > t))
+            assert alive == ndimage.label(vol <= t, structure=structure)[1]
+
 if __name__ == '__main__':
     T = TestLowerStar()
     T.setup()
@@ -0,0 +1,89 @@
+r"""
+Test that the compiled :class:`multidim.fast_algorithms.Metric` kernels are
+used consistently by :class:`multidim.PointCloud` and
+:class:`multidim.covertree.CoverTree`.
+
+Copyright
+---------
+- This file is part of https://github.com/geomdata/gda-public/
+- 2015, 2016, 2017 by Geometric Data Analytics, Inc. (http://geomdata.com)
+- AGPL license. See `LICENSE` or https://github.com/geomdata/gda-public/blob/master/LICENSE
+
+"""
+
+import numpy as np
+import pytest
+import multidim
+import multidim.covertree
+from multidim.fast_algorithms import Metric
+
+
+class TestMetrics:
+
+    def setup_method(self, function):
+        np.random.seed(0)
+        self.X = np.random.rand(300, 4)
+        self.w = np.array([1.0, 0.5, 2.0, 0.25])
+
+    def brute_edges(self, metric, max_length):
+        kwargs = {'p': metric.p, 'w': metric.w} if metric.code == 4 else {}
+        D = multidim.squareform(multidim.pdist(self.X, metric.name, **kwargs))
+        i, j = np.where(np.triu(D <= max_length, k=1))
+        return set(zip(i, j))
+
+    def covertree_edges(self, dist, max_length):
+        pc = multidim.PointCloud(self.X, max_length=max_length, dist=dist)
+        bdy = pc.stratum[1][['bdy0', 'bdy1']].values
+        return pc, set(zip(bdy[:, 0], bdy[:, 1]))
+
+    def test_edges(self):
+        for dist, max_length in [("cityblock", 0.4),
+                                 ("manhattan", 0.4),
+                                 ("chebyshev", 0.15),
+                                 (Metric("minkowski", p=3, w=self.w), 0.25)]:
+            pc, edges = self.covertree_edges(dist, max_length)
+            assert edges == self.brute_edges(pc.metric, max_length), dist
+
+    def test_levels(self):
+        pc = multidim.PointCloud(self.X, dist="cityblock")
+        ct = multidim.covertree.CoverTree(pc, ratio=0.5, exchange_teens=True)
+        for cl in ct:
+            assert cl.check()
+            for ci in cl.adults:
+                d = pc.dists(np.array([ci]), cl.children[ci])
+                assert np.all(d <= cl.radius)
+
+    def test_caches(self):
+        metric = Metric("minkowski", p=3, w=self.w)
+        i = np.arange(0, 300, 7)
+        j = np.arange(300)
+        expected = multidim.cdist(self.X[i], self.X[j], 'minkowski',
+                                  p=3, w=self.w)
+        for cache_type in [None, "np", "dict", "lru", "condensed"]:
+            pc = multidim.PointCloud(self.X, dist=metric, cache_type=cache_type)
+            assert np.allclose(pc.dists(i, j), expected), cache_type
+            assert np.allclose(pc.dists(i, j), expected), cache_type
+
+    def test_weights(self):
+        metric = Metric("minkowski", p=3, w=self.w[:3])
+        i = np.arange(10)
+        with pytest.raises(ValueError):
+            multidim.PointCloud(self.X, dist=metric)
+        with pytest.raises(ValueError):
+            multidim.fast_algorithms.distance_pairs(i, i, self.X, metric)
+        with pytest.raises(ValueError):
+            multidim.fast_algorithms.distance_cache_None(i, i, self.X, metric)
+        with pytest.raises(ValueError):
+            metric.cdist(self.X[:3], self.X[:5])
+        assert np.allclose(metric.cdist(self.X[:3, :3], self.X[:5, :3]),
+                           multidim.cdist(self.X[:3, :3], self.X[:5, :3], 'minkowski',
+                                          p=3, w=self.w[:3]))
+
+    def test_compiled(self, monkeypatch):
+        def python_call(self, u, v):
+            raise AssertionError("called the Python metric")
+        monkeypatch.setattr(Metric, "__call__", python_call)
+        for dist, max_length in [(Metric("euclidean"), 0.3),
+                                 (Metric("minkowski", p=3, w=self.w), 0.25)]:
+            pc, edges = self.covertree_edges(dist, max_length)
+            assert edges == self.brute_edges(pc.metric, max_length), dist
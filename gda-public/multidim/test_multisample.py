@@ -0,0 +1,60 @@
+r"""
+Test :func:`multidim.PointCloud.from_multisample_multilabel` on lists and
+iterators of many small samples.
+
+Copyright
+---------
+- This file is part of https://github.com/geomdata/gda-public/
+- 2015, 2016, 2017 by Geometric Data Analytics, Inc. (http://geomdata.com)
+- AGPL license. See `LICENSE` or https://github.com/geomdata/gda-public/blob/master/LICENSE
+
+"""
+
+import numpy as np
+import pytest
+import multidim
+
+
+class TestMultisample:
+
+    def setup_method(self, function):
+        np.random.seed(0)
+        self.samples = [np.random.rand(np.random.randint(1, 6), 3) for _ in range(500)]
+        self.labels = [["red", "blue", "green"][i] for i in np.random.randint(0, 3, 500)]
+
+    def test_weights(self):
+        pc = multidim.PointCloud.from_multisample_multilabel(self.samples, self.labels)
+        assert pc.label_info.index.tolist() == ["blue", "green", "red"]
+        assert np.all(pc.coords.values == np.concatenate(self.samples))
+        start = 0
+        for i, (X, l) in enumerate(zip(self.samples, self.labels)):
+            stop = start + X.shape[0]
+            assert np.all(pc.source[start:stop] == i)
+            assert np.all(pc.labels[start:stop] == pc.label_info.loc[l, 'int_index'])
+            assert np.allclose(pc.stratum[0]['mass'].values[start:stop],
+                               1.0/X.shape[0]/self.labels.count(l))
+            start = stop
+        for l in pc.label_info.index:
+            assert pc.label_info.loc[l, 'clouds'] == self.labels.count(l)
+            assert pc.label_info.loc[l, 'points'] == sum(
+                X.shape[0] for X, m in zip(self.samples, self.labels) if m == l)
+        assert np.allclose(pc.label_info['weight'].values, 1.0)
+
+    def test_iterator(self):
+        pc = multidim.PointCloud.from_multisample_multilabel(
+            self.samples, self.labels, equal_priors=False)
+        streamed = multidim.PointCloud.from_multisample_multilabel(
+            (X for X in self.samples), iter(self.labels), equal_priors=False)
+        assert np.all(streamed.coords.values == pc.coords.values)
+        assert np.all(streamed.labels == pc.labels)
+        assert np.all(streamed.source == pc.source)
+        assert np.all(streamed.stratum[0]['mass'].values == 1.0)
+        assert streamed.label_info.equals(pc.label_info)
+
+    def test_mismatch(self):
+        with pytest.raises(AssertionError):
+            multidim.PointCloud.from_multisample_multilabel(
+                self.samples + [np.random.rand(3, 2)], self.labels + ["red"])
+        with pytest.raises(AssertionError):
+            multidim.PointCloud.from_multisample_multilabel(
+                iter(self.samples), self.labels[:-1])
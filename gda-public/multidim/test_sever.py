@@ -68,3 +68,44 @@ A SimplicialComplex with 12 points, 0 edges, and 0 faces.
 10  670.0  560.0
 11  671.0  557.0
 """
+
+import numpy as np
+import multidim
+
+
+def centroid(pc):
+    return pc.coords.values.mean(axis=0)
+
+
+class TestSever:
+
+    def setup_method(self, function):
+        np.random.seed(0)
+        self.centers = np.random.permutation(np.arange(600.0)).reshape(-1, 2)*10
+        self.X = np.repeat(self.centers, 3, axis=0) + np.random.rand(900, 2)
+        self.X = self.X[np.random.permutation(900)]
+        self.pc = multidim.PointCloud(self.X, max_length=2.0)
+        self.pc.make_pers0(cutoff=2.0)
+
+    def test_components(self):
+        components = self.pc.components()
+        assert len(components) == 300
+        assert np.all(np.sort(np.concatenate(components)) == np.arange(900))
+        for c in components:
+            assert c.shape == (3,)
+            assert np.all(np.diff(c) > 0)
+            assert np.ptp(self.X[c], axis=0).max() < 1.0
+
+    def test_sever(self):
+        expected = [(c, self.X[c]) for c in self.pc.components()]
+        for (indices, sub_pc), (c, coords) in zip(self.pc.sever(), expected):
+            assert np.all(indices == c)
+            assert np.all(sub_pc.coords.values == coords)
+
+    def test_parallel(self):
+        serial = list(self.pc.sever(func=centroid))
+        parallel = list(self.pc.sever(func=centroid, parallel=True))
+        assert len(serial) == len(parallel) == 300
+        for (i, a), (j, b) in zip(serial, parallel):
+            assert np.all(i == j)
+            assert np.all(a == b)
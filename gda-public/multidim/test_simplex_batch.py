@@ -0,0 +1,105 @@
+r"""
+Test :class:`multidim.SimplexBatch` and batched iteration over
+:class:`multidim.SimplexStratum`, for both DataFrame and ArrayStratum strata.
+
+Copyright
+---------
+- This file is part of https://github.com/geomdata/gda-public/
+- 2015, 2016, 2017 by Geometric Data Analytics, Inc. (http://geomdata.com)
+- AGPL license. See `LICENSE` or https://github.com/geomdata/gda-public/blob/master/LICENSE
+
+"""
+
+from collections import OrderedDict
+import numpy as np
+import pytest
+import multidim
+
+
+class TestSimplexBatch:
+
+    def setup_method(self, function):
+        np.random.seed(0)
+        self.X = np.random.rand(60, 2)
+
+    def complexes(self):
+        for columnar in [False, True]:
+            pc = multidim.PointCloud(self.X, max_length=0.3, columnar=columnar)
+            pc.make_pers0()
+            yield pc
+
+    def test_read(self):
+        for pc in self.complexes():
+            for dim in [0, 1]:
+                S = pc.stratum[dim]
+                cells = pc.cells(dim)
+                assert len(cells) == len(S)
+                mask = S['height'].values >= np.median(S['height'].values)
+                picks = np.random.permutation(len(S))[:10]
+                for batch, rows in [(cells[5:40:3], np.arange(len(S))[5:40:3]),
+                                    (cells[mask], np.flatnonzero(mask)),
+                                    (cells[picks], picks)]:
+                    assert len(batch) == rows.shape[0]
+                    assert np.all(batch.index == rows)
+                    assert np.all(batch.height == S['height'].values[rows])
+                    assert np.all(batch.positive == S['pos'].values[rows])
+                    assert np.all(batch.representative == S['rep'].values[rows])
+                    if dim == 0:
+                        assert np.all(batch.mass == S['mass'].values[rows])
+                        assert batch.boundary.shape == (rows.shape[0], 0)
+                    else:
+                        assert batch.mass is None
+                        assert np.all(batch.boundary == S[['bdy0', 'bdy1']].values[rows])
+                    for k, cell in enumerate(batch):
+                        assert cell == cells[rows[k]]
+                        assert cell.height == batch.height[k]
+                        assert repr(cell) == repr(cells[rows[k]])
+                    assert batch[1] == cells[rows[1]]
+                    assert np.all(batch[2:4].index == rows[2:4])
+
+    def test_iterate(self):
+        for pc in self.complexes():
+            cells = pc.cells(1)
+            cells.batch_size = 7
+            seen = [(c.index, c.height, c.positive, c.representative, c.boundary)
+                    for c in cells]
+            S = pc.stratum[1]
+            assert seen == [(i, S['height'].values[i], S['pos'].values[i],
+                             S['rep'].values[i], {S['bdy0'].values[i], S['bdy1'].values[i]})
+                            for i in range(len(S))]
+
+    def test_write(self):
+        for pc in self.complexes():
+            cells = pc.cells(0)
+            batch = cells[10:20]
+            batch.height = np.arange(10.0)
+            batch.positive = False
+            assert np.all(pc.stratum[0]['height'].values[10:20] == np.arange(10.0))
+            assert not np.any(pc.stratum[0]['pos'].values[10:20])
+            assert np.all(batch.height == np.arange(10.0))
+
+            records = list(cells.batches(8))[0]
+            cell = next(iter(records))
+            cell.mass = 3.0
+            assert pc.stratum[0]['mass'].values[0] == 3.0
+            assert cell.mass == 3.0
+            cells[1].height = 5.0
+            assert pc.stratum[0]['height'].values[1] == 5.0
+
+    def test_labels(self):
+        for columnar in [False, True]:
+            index = np.arange(5)*10 + 3
+            stratum = {0: multidim.stratum_from_arrays(OrderedDict([
+                ('height', np.arange(5.0)),
+                ('pos', np.ones(5, dtype='bool')),
+                ('rep', index),
+            ]), index=index, columnar=columnar)}
+            sc = multidim.SimplicialComplex(stratum=stratum, columnar=columnar)
+            cells = sc.cells(0)
+            assert cells[23].height == 2.0
+            assert np.all(cells[np.array([43, 3])].height == [4.0, 0.0])
+            assert [c.index for c in cells] == index.tolist()
+            with pytest.raises(KeyError):
+                cells[np.array([3, 4])]
+            with pytest.raises(KeyError):
+                cells[4].height
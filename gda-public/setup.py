@@ -54,6 +54,7 @@ setup(
     ext_modules=cythonize(['multidim/fast_algorithms.pyx', 
                            'homology/dim0.pyx',
                            'homology/dim1.pyx',
+                           'homology/cubical.pyx',
                            'timeseries/curve_geometry.pyx', 
                            'timeseries/fast_algorithms.pyx']),
     include_dirs=[get_include()],